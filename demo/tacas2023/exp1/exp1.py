@@ -1,4 +1,4 @@
-from quadrotor_agent import QuadrotorAgent
+from verse.agents.example_agent.quadrotor_agent import QuadrotorAgent
 from verse import Scenario
 from verse.plotter.plotter3D_new import *
 from verse.plotter.plotter3D import *
@@ -1,4 +1,4 @@
-from quadrotor_agent import QuadrotorAgent
+from verse.agents.example_agent.quadrotor_agent import QuadrotorAgent
 from verse import Scenario
 from verse.plotter.plotter2D import reachtube_tree
 from verse.plotter.plotter3D_new import *
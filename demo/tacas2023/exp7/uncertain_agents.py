@@ -6,58 +6,8 @@ from scipy.integrate import ode
 from verse.agents import BaseAgent
 from verse.parser import ControllerIR
 
-from scipy.optimize import minimize
-from sympy import Symbol, diff
-from sympy.utilities.lambdify import lambdify
-from sympy.core import *
-
-def find_min(expr, var_range):
-    bounds = []
-    vars = list(expr.free_symbols)
-    x0 = []
-    jac = []
-    for var in vars:
-        bounds.append(var_range[var])
-        x0.append(var_range[var][0])
-        jac.append(diff(expr, var))
-    expr_func = lambdify([vars], expr)
-    jac_func = lambdify([vars], jac)
-    res = minimize(
-        expr_func, 
-        x0,
-        bounds = bounds,
-        jac = jac_func,
-        method = 'L-BFGS-B'
-    )
-    return res.fun
-
-def find_max(expr, var_range):
-    tmp = -expr 
-    res = find_min(tmp, var_range)
-    return -res
-
-def computeD(exprs, symbol_x, symbol_w, x, w, x_hat, w_hat):
-    d = []
-    for expr in exprs:
-        if all(a<=b for a,b in zip(x, x_hat)) and all(a<=b for a,b in zip(w,w_hat)):
-            var_range = {}
-            for i, var in enumerate(symbol_x):
-                var_range[var] = (x[i], x_hat[i])
-            for i, var in enumerate(symbol_w):
-                var_range[var] = (w[i], w_hat[i])
-            res = find_min(expr, var_range)
-            d.append(res)
-        elif all(b<=a for a,b in zip(x,x_hat)) and all(b<=a for a,b in zip(w,w_hat)):
-            var_range = {}
-            for i,var in enumerate(symbol_x):
-                var_range[var] = (x_hat[i], x[i])
-            for i, var in enumerate(symbol_w):
-                var_range[var] = (w_hat[i], w[i])
-            res = find_max(expr, var_range)
-            d.append(res)
-        else:
-            raise ValueError(f"Condition for x, w, x_hat, w_hat not satisfied: {[x, w, x_hat, w_hat]}")
-    return d
+from sympy import Symbol
+from verse.analysis.mixmonotone import SymbolicObjective, compute_decomposition_symbolic
 
 class Agent1(BaseAgent):
     def __init__(self, id):
@@ -74,17 +24,22 @@ class Agent1(BaseAgent):
 
     def decomposition(self, x, w, xhat, what, params):
         dt = params
-        x1 = Symbol('x1',real=True)
-        x2 = Symbol('x2',real=True)
-
-        w1 = Symbol('w1',real=True)
-        w2 = Symbol('w2',real=True)
-
-        exprs = [
-            x1+dt*x1*(1.1+w1-x1-0.1*x2),
-            x2+dt*x2*(4+w2-3*x1-x2),
-        ]
-        res = computeD(exprs, [x1, x2], [w1, w2], x, w, xhat, what)
+        if not hasattr(self, '_objectives'):
+            x1 = Symbol('x1',real=True)
+            x2 = Symbol('x2',real=True)
+
+            w1 = Symbol('w1',real=True)
+            w2 = Symbol('w2',real=True)
+
+            dt_symbol = Symbol('dt',real=True)
+
+            exprs = [
+                x1+dt_symbol*x1*(1.1+w1-x1-0.1*x2),
+                x2+dt_symbol*x2*(4+w2-3*x1-x2),
+            ]
+            self._objectives = ([SymbolicObjective(expr, [x1, x2, w1, w2], [dt_symbol]) for expr in exprs], [x1, x2], [w1, w2])
+        objectives, symbol_x, symbol_w = self._objectives
+        res = compute_decomposition_symbolic(objectives, symbol_x, symbol_w, x, w, xhat, what, [dt])
         return res
 
 class Agent2(BaseAgent):
@@ -113,7 +68,9 @@ class Agent2(BaseAgent):
         j2w1 = 0
         j2w2 = dt*x2
 
-        return np.array([[j1x1, j1x2, j1w1, j1w2], [j2x1, j2x2, j2w1, j2w2]])
+        # Broadcast the constant entries, x may hold arrays of points
+        jac = np.broadcast_arrays(j1x1, j1x2, j1w1, j1w2, j2x1, j2x2, j2w1, j2w2)
+        return np.array(jac).reshape((2, 4) + jac[0].shape)
 
 class Agent3(BaseAgent):
     def __init__(self, id):
@@ -153,12 +110,14 @@ class Agent4(BaseAgent):
         j3x1,j3x2,j3x3,j3x4,j3w1 = [ 0, 0, 1, -dt, 0]
         j4x1,j4x2,j4x3,j4x4,j4w1 = [ 0, 0, dt, 1, 0]
 
-        return np.array([
-            [j1x1,j1x2,j1x3,j1x4,j1w1], 
-            [j2x1,j2x2,j2x3,j2x4,j2w1], 
-            [j3x1,j3x2,j3x3,j3x4,j3w1], 
-            [j4x1,j4x2,j4x3,j4x4,j4w1], 
-        ])
+        # Broadcast the constant entries, x may hold arrays of points
+        jac = np.broadcast_arrays(
+            j1x1,j1x2,j1x3,j1x4,j1w1,
+            j2x1,j2x2,j2x3,j2x4,j2w1,
+            j3x1,j3x2,j3x3,j3x4,j3w1,
+            j4x1,j4x2,j4x3,j4x4,j4w1,
+        )
+        return np.array(jac).reshape((4, 5) + jac[0].shape)
 
 class Agent5(BaseAgent):
     def __init__(self, id):
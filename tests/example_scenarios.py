@@ -0,0 +1,125 @@
+# Small scenarios shared by the unit tests
+import os
+from enum import Enum, auto
+
+import numpy as np
+
+from verse import Scenario, BaseAgent
+from verse.agents.example_agent.ball_agent import BallAgent
+from verse.scenario.scenario import ScenarioConfig
+
+DEMO_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'demo')
+
+
+class BallMode(Enum):
+    Normal = auto()
+
+
+def ball_scenario(config=None):
+    """The two bouncing balls of demo/ball, for simulation"""
+    scenario = Scenario(config or ScenarioConfig())
+    controller = os.path.join(DEMO_DIR, 'ball', 'ball_bounces.py')
+    scenario.add_agent(BallAgent('red-ball', file_name=controller))
+    scenario.add_agent(BallAgent('green-ball', file_name=controller))
+    scenario.set_init(
+        [[[5, 10, 2, 2], [5, 10, 2, 2]], [[15, 1, 1, -2], [15, 1, 1, -2]]],
+        [(BallMode.Normal,), (BallMode.Normal,)]
+    )
+    return scenario
+
+
+BRANCHING_CONTROLLER = '''
+from enum import Enum, auto
+import copy
+from typing import List
+class BallMode(Enum):
+    A = auto()
+    B = auto()
+    C = auto()
+    D = auto()
+class State:
+    x: float
+    y: float
+    vx: float
+    vy: float
+    mode: BallMode
+    def __init__(self, x, y, vx, vy, mode: BallMode):
+        pass
+def decisionLogic(ego: State, others: List[State]):
+    output = copy.deepcopy(ego)
+    if ego.mode == BallMode.A and ego.x > 5:
+        output.mode = BallMode.B
+    if ego.mode == BallMode.A and ego.x > 5:
+        output.mode = BallMode.C
+    if ego.mode == BallMode.A and ego.x > 5:
+        output.mode = BallMode.D
+    return output
+'''
+
+
+class BranchingMode(Enum):
+    A = auto()
+    B = auto()
+    C = auto()
+    D = auto()
+
+
+def branching_scenario(**config):
+    """Two balls that switch to one of three modes at the same time step, which gives nine children"""
+    scenario = Scenario(ScenarioConfig(**config))
+    scenario.add_agent(BallAgent('ball1', code=BRANCHING_CONTROLLER))
+    scenario.add_agent(BallAgent('ball2', code=BRANCHING_CONTROLLER))
+    scenario.set_init([[[0, 0, 1, 0], [0, 0, 1, 0]], [[0, 1, 1, 0], [0, 1, 1, 0]]], [(BranchingMode.A,), (BranchingMode.A,)])
+    return scenario
+
+
+THERMO_CONTROLLER = '''
+from enum import Enum, auto
+import copy
+class ThermoMode(Enum):
+    ON = auto()
+    OFF = auto()
+class State:
+    temp = 0.0
+    cycle_time = 0.0
+    thermo_mode: ThermoMode = ThermoMode.ON
+    def __init__(self, temp, cycle_time, thermo_mode: ThermoMode):
+        pass
+def decisionLogic(ego: State):
+    output = copy.deepcopy(ego)
+    if ego.thermo_mode == ThermoMode.ON:
+        if ego.cycle_time >= 1.0 and ego.cycle_time < 1.1:
+            output.thermo_mode = ThermoMode.OFF
+            output.cycle_time = 0.0
+    if ego.thermo_mode == ThermoMode.OFF:
+        if ego.cycle_time >= 1.0 and ego.cycle_time < 1.1:
+            output.thermo_mode = ThermoMode.ON
+            output.cycle_time = 0.0
+    return output
+'''
+
+
+class ThermoMode(Enum):
+    ON = auto()
+    OFF = auto()
+
+
+class ThermoAgent(BaseAgent):
+    """Temperature converging exponentially to 90 when ON and 60 when OFF, with a cycle timer"""
+    def TC_simulate(self, mode, init, time_bound, time_step, lane_map=None):
+        target = 90.0 if mode[0] == 'ON' else 60.0
+        n = int(np.ceil(time_bound / time_step))
+        ts = np.arange(n + 1) * time_step
+        trace = np.zeros((n + 1, 3))
+        trace[:, 0] = ts
+        trace[:, 1] = target + (init[0] - target) * np.exp(-0.5 * ts)
+        trace[:, 2] = init[1] + ts
+        return trace
+
+
+def thermo_scenario(config=None, init=((60, 0), (90, 0))):
+    """A single thermostat switching mode every second, for verification"""
+    scenario = Scenario(config or ScenarioConfig())
+    scenario.add_agent(ThermoAgent('t', code=THERMO_CONTROLLER))
+    scenario.set_init([[list(init[0]), list(init[1])]], [(ThermoMode.ON,)])
+    return scenario
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy as np
+
+from example_scenarios import branching_scenario, thermo_scenario
+from verse.analysis.analysis_tree import AnalysisTree, AnalysisTreeNode
+
+
+def ids(nodes):
+    return sorted(node.id for node in nodes)
+
+
+class TestTreeIndexes(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.sim = branching_scenario().simulate(12, 0.1)
+        cls.reach = thermo_scenario().verify(4, 0.05)
+
+    def test_get_node(self):
+        for tree in [self.sim, self.reach]:
+            for node in tree.nodes:
+                self.assertIs(tree.get_node(node.id), node)
+            self.assertIsNone(tree.get_node(len(tree.nodes)))
+
+    def test_nodes_in_mode(self):
+        self.assertEqual(ids(self.sim.nodes_in_mode('ball1', ('B',))), [n.id for n in self.sim.nodes if n.mode['ball1'][0] == 'B'])
+        self.assertEqual(len(self.sim.nodes_in_mode('ball1', ('B',))), 3)
+        self.assertEqual(ids(self.reach.nodes_in_mode('t', ['ON'])), [0, 2, 4])
+        self.assertEqual(self.reach.nodes_in_mode('t', ('BROKEN',)), [])
+        self.assertEqual(self.reach.nodes_in_mode('other', ('ON',)), [])
+
+    def test_nodes_and_boxes_at(self):
+        for tree, agent_id in [(self.sim, 'ball2'), (self.reach, 't')]:
+            for t in np.linspace(-0.5, 12.5, 27).round(2).tolist() + [0.95, 1.0, 5.1]:
+                nodes = [n for n in tree.nodes if n.trace[agent_id][0][0] <= t <= n.trace[agent_id][-1][0]]
+                self.assertEqual(ids(tree.nodes_at(agent_id, t)), ids(nodes), msg=t)
+                expected = []
+                for node in nodes:
+                    trace = node.trace[agent_id]
+                    if tree is self.reach:
+                        expected += [(node.id, 2 * i) for i in range(len(trace) // 2) if trace[2 * i][0] <= t <= trace[2 * i + 1][0]]
+                    else:
+                        expected += [(node.id, i) for i in range(len(trace)) if trace[i][0] == t]
+                found = []
+                for node, rows in tree.boxes_at(agent_id, t):
+                    row = next(i for i in range(len(node.trace[agent_id])) if node.trace[agent_id][i] is rows[0])
+                    found.append((node.id, row))
+                self.assertEqual(sorted(found), sorted(expected), msg=t)
+
+    def test_nodes_at_bounds(self):
+        # Both ends of a trace are covered, including traces of a single point
+        root = AnalysisTreeNode(trace={'a': [[0.1, 0], [0.3, 0]]}, child=[
+            AnalysisTreeNode(trace={'a': [[0.3, 0]]}, child=[]),
+            AnalysisTreeNode(trace={'a': []}, child=[]),
+        ])
+        tree = AnalysisTree(root)
+        self.assertEqual(ids(tree.nodes_at('a', 0.1)), [0])
+        self.assertEqual(ids(tree.nodes_at('a', 0.3)), [0, 1])
+        self.assertEqual(tree.nodes_at('a', np.nextafter(0.3, 1)), [])
+        self.assertEqual(tree.nodes_at('b', 0.2), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,75 @@
+import asyncio
+import os
+import time
+import unittest
+
+from verse.analysis.utils import ForkPool
+
+from example_scenarios import thermo_scenario
+
+
+def square(x):
+    return x * x
+
+
+def fail(x):
+    raise ValueError(x)
+
+
+class TestForkPool(unittest.TestCase):
+    def make_pool(self, max_workers):
+        pool = ForkPool(max_workers)
+        self.addCleanup(pool.shutdown)
+        return pool
+
+    def test_more_jobs_than_workers(self):
+        pool = self.make_pool(1)
+
+        async def run():
+            return await asyncio.gather(*(pool.submit(square, i) for i in range(3)))
+        self.assertEqual(asyncio.run(run()), [0, 1, 4])
+
+    def test_verify_async_in_separate_event_loops(self):
+        # The pool outlives the event loop of each asyncio.run
+        pool = self.make_pool(1)
+        expected = thermo_scenario().verify(3, 0.05).to_dict()
+
+        async def run():
+            scenario = thermo_scenario()
+            return await asyncio.gather(scenario.verify_async(3, 0.05, pool=pool), scenario.verify_async(3, 0.05, pool=pool))
+        for _ in range(2):
+            trees = asyncio.run(run())
+            for tree in trees:
+                self.assertEqual(tree.to_dict(), expected)
+
+    def test_workers_are_reused(self):
+        pool = self.make_pool(1)
+        pids = [asyncio.run(pool.submit(os.getpid)) for _ in range(2)]
+        self.assertNotEqual(pids[0], os.getpid())
+        self.assertEqual(pids[0], pids[1])
+
+    def test_job_errors_are_raised(self):
+        pool = self.make_pool(1)
+        with self.assertRaisesRegex(ValueError, 'bad'):
+            asyncio.run(pool.submit(fail, 'bad'))
+        self.assertEqual(asyncio.run(pool.submit(square, 3)), 9)
+
+    def test_cancel_stops_the_job(self):
+        pool = self.make_pool(1)
+        pid = asyncio.run(pool.submit(os.getpid))
+
+        async def run():
+            job = asyncio.ensure_future(pool.submit(time.sleep, 60))
+            await asyncio.sleep(0.5)
+            job.cancel()
+            with self.assertRaises(asyncio.CancelledError):
+                await job
+            return await pool.submit(os.getpid)
+        start = time.perf_counter()
+        # The worker is interrupted rather than killed and takes the next job
+        self.assertEqual(asyncio.run(run()), pid)
+        self.assertLess(time.perf_counter() - start, 30)
+
+
+if __name__ == '__main__':
+    unittest.main()
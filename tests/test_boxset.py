@@ -0,0 +1,90 @@
+import unittest
+
+import numpy as np
+
+from verse.analysis.analysis_tree import AnalysisTree, AnalysisTreeNode
+from verse.analysis.boxset import BoxSet, TreeBoxes
+
+
+class TestBoxSet(unittest.TestCase):
+    def setUp(self):
+        self.boxes = BoxSet([[[0, 0], [1, 1]], [[2, -1], [3, 0]]])
+
+    def test_shapes(self):
+        self.assertEqual(BoxSet([[0, 0, 0], [1, 2, 3]]).data.shape, (1, 2, 3))
+        self.assertIs(BoxSet(self.boxes).data, self.boxes.data)
+        for bad in [[1, 2, 3], [[0, 0], [1, 1], [2, 2]], np.zeros((2, 3, 2))]:
+            with self.assertRaises(ValueError):
+                BoxSet(bad)
+
+    def test_tube(self):
+        tube = [[0, 1, 2], [0.1, 3, 4], [0.1, 1.5, 2.5], [0.2, 3.5, 4.5], [0.2, 0, 0]]
+        boxes = BoxSet.from_tube(tube)
+        self.assertEqual(len(boxes), 2)
+        np.testing.assert_array_equal(boxes.lo, [[0, 1, 2], [0.1, 1.5, 2.5]])
+        np.testing.assert_array_equal(boxes.hi, [[0.1, 3, 4], [0.2, 3.5, 4.5]])
+        np.testing.assert_array_equal(boxes.to_tube(), tube[:4])
+        self.assertEqual(len(BoxSet.from_tube([[0, 1, 2]])), 0)
+
+    def test_trace(self):
+        trace = [[0, 1, 2], [0.1, 3, 4]]
+        np.testing.assert_array_equal(BoxSet.from_trace(trace, True).data, BoxSet.from_tube(trace).data)
+        points = BoxSet.from_trace(trace, False)
+        np.testing.assert_array_equal(points.lo, trace)
+        np.testing.assert_array_equal(points.hi, trace)
+        self.assertEqual(BoxSet.from_trace([], False).data.shape, (0, 2, 0))
+
+    def test_hull_union_bloat(self):
+        np.testing.assert_array_equal(self.boxes.hull().data, [[[0, -1], [3, 1]]])
+        union = self.boxes.union([[5, 5], [6, 6]])
+        self.assertEqual(len(union), 3)
+        np.testing.assert_array_equal(union[2].data, [[[5, 5], [6, 6]]])
+        np.testing.assert_array_equal(self.boxes.bloat(0.5).data, [[[-0.5, -0.5], [1.5, 1.5]], [[1.5, -1.5], [3.5, 0.5]]])
+        np.testing.assert_array_equal(self.boxes.bloat([1, 0]).widths(), [[3, 1], [3, 1]])
+
+    def test_contains_and_overlaps(self):
+        other = BoxSet([[[0.2, 0.2], [0.8, 1]], [[0.5, 0.5], [2.5, 1]], [[2, -1], [3, 0]]])
+        np.testing.assert_array_equal(self.boxes.contains(other), [True, False, True])
+        # The first box touches the second one of other at a corner
+        self.assertTrue(BoxSet([[0, 0], [1, 1]]).overlaps([[1, 1], [2, 2]])[0, 0])
+        np.testing.assert_array_equal(self.boxes.overlaps(other), [[True, True, False], [False, False, True]])
+
+    def test_intersection(self):
+        other = BoxSet([[[0.5, 0.5], [2, 2]], [[5, 5], [6, 6]]])
+        inter = self.boxes.intersection(other)
+        np.testing.assert_array_equal(inter[0].data, [[[0.5, 0.5], [1, 1]]])
+        np.testing.assert_array_equal(inter.is_empty(), [False, True])
+        np.testing.assert_array_equal(self.boxes.intersection([[0.5, -2], [2.5, 2]]).data,
+                                      [[[0.5, 0], [1, 1]], [[2, -1], [2.5, 0]]])
+
+    def test_time_slice(self):
+        boxes = BoxSet.from_tube([[0, 0], [0.1, 1], [0.1, 1], [0.2, 2], [0.2, 2], [0.3, 3]])
+        np.testing.assert_array_equal(boxes.time_slice(0.15, 0.25).lo[:, 0], [0.1, 0.2])
+        np.testing.assert_array_equal(boxes.time_slice(0.1, 0.1).lo[:, 0], [0, 0.1])
+        self.assertEqual(len(boxes.time_slice(0.4, 1)), 0)
+        np.testing.assert_array_equal(boxes.time_slice(1.5, 2.5, dim=1).lo[:, 1], [1, 2])
+
+
+class TestTreeBoxes(unittest.TestCase):
+    def test_tree(self):
+        child = AnalysisTreeNode(trace={'a': [[1, 0], [2, 1], [2, 0], [3, 2]], 'b': [[1, 5], [2, 6]]}, child=[], type='reachtube')
+        root = AnalysisTreeNode(trace={'a': [[0, 1], [1, 2]], 'b': []}, child=[child], type='simtrace')
+        tree = AnalysisTree(root)
+        boxes = TreeBoxes(tree, 'a')
+        self.assertEqual(len(boxes), 4)
+        np.testing.assert_array_equal(boxes.lo, [[1], [2], [0], [0]])
+        np.testing.assert_array_equal(boxes.hi, [[1], [2], [1], [2]])
+        np.testing.assert_array_equal(boxes.times, [0, 1, 1, 2])
+        np.testing.assert_array_equal(boxes.ends, [0, 1, 2, 3])
+        np.testing.assert_array_equal(boxes.nodes, [0, 0, 1, 1])
+        np.testing.assert_array_equal(boxes.rows, [0, 1, 0, 2])
+        other = TreeBoxes(tree, 'b')
+        self.assertEqual(len(other), 1)
+        ind, other_ind = boxes.align(other)
+        np.testing.assert_array_equal(ind, [2])
+        np.testing.assert_array_equal(other_ind, [0])
+        self.assertEqual(len(TreeBoxes(tree, 'c')), 0)
+
+
+if __name__ == '__main__':
+    unittest.main()
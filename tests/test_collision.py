@@ -0,0 +1,80 @@
+import itertools
+import unittest
+
+import numpy as np
+
+from example_scenarios import ball_scenario
+from verse.analysis import AnalysisTree, AnalysisTreeNode
+from verse.analysis.collision import potential_collisions
+
+
+def brute_force(tree, dims, margin):
+    """(node id, agents, start time) of every pair of rectangles or points of two agents that overlap"""
+    found = set()
+    for node in tree.nodes:
+        step = 2 if node.type == 'reachtube' else 1
+        for a, b in itertools.combinations(list(tree.root.agent), 2):
+            A, B = np.array(node.trace[a]), np.array(node.trace[b])
+            for i in range(len(A) // step):
+                for j in range(len(B) // step):
+                    ta0, ta1 = A[i * step][0], A[i * step + step - 1][0]
+                    tb0, tb1 = B[j * step][0], B[j * step + step - 1][0]
+                    if not (max(ta0, tb0) < min(ta1, tb1) or ta0 == tb0):
+                        continue
+                    lo_a, hi_a = A[i * step][1:][dims] - margin / 2, A[i * step + step - 1][1:][dims] + margin / 2
+                    lo_b, hi_b = B[j * step][1:][dims] - margin / 2, B[j * step + step - 1][1:][dims] + margin / 2
+                    if np.all((lo_a <= hi_b) & (lo_b <= hi_a)):
+                        found.add((node.id, (a, b), max(ta0, tb0)))
+    return found
+
+
+def traffic_tree(num_agents, num_steps, reach, rng):
+    """Agents driving along x in three lanes, as points or as rectangles around consecutive points"""
+    ts = np.arange(num_steps) * 0.1
+    trace = {}
+    for k in range(num_agents):
+        x = rng.uniform(0, 8) + np.cumsum(rng.normal(1, 0.3, num_steps)) * 0.1
+        y = rng.integers(0, 3) * 3.5 + np.cumsum(rng.normal(0, 0.05, num_steps))
+        if reach:
+            rows = []
+            for i in range(num_steps - 1):
+                rows.append([ts[i], min(x[i], x[i + 1]) - 0.2, min(y[i], y[i + 1]) - 0.2])
+                rows.append([ts[i + 1], max(x[i], x[i + 1]) + 0.2, max(y[i], y[i + 1]) + 0.2])
+            trace[f'v{k}'] = rows
+        else:
+            trace[f'v{k}'] = np.stack([ts, x, y], 1).tolist()
+    root = AnalysisTreeNode(trace=trace, type='reachtube' if reach else 'simtrace', agent={a: None for a in trace},
+                            child=[], init={}, mode={}, static={})
+    return AnalysisTree(root)
+
+
+class TestPotentialCollisions(unittest.TestCase):
+    def check(self, tree, dims, margin):
+        contacts = potential_collisions(tree, dims, margin)
+        expected = brute_force(tree, dims, margin)
+        # Every overlap is in a window, and every window starts at an overlap
+        for node_id, agents, start in expected:
+            self.assertTrue(any(c.node.id == node_id and c.agents == agents and c.start <= start <= c.end for c in contacts))
+        for c in contacts:
+            self.assertIn((c.node.id, c.agents, c.start), expected)
+        self.assertEqual(contacts, sorted(contacts, key=lambda c: (c.start, c.node.id, c.agents)))
+        return contacts
+
+    def test_random_traffic(self):
+        rng = np.random.default_rng(0)
+        for reach in [True, False]:
+            tree = traffic_tree(6, 120, reach, rng)
+            self.check(tree, [0, 1], 0.0)
+            self.assertGreater(len(self.check(tree, [0, 1], 1.0)), 0)
+            self.check(tree, [1], 0.5)
+
+    def test_simulation_tree(self):
+        tree = ball_scenario().simulate(20, 0.1)
+        self.assertEqual(self.check(tree, [0, 1], 0.0), [])
+        contacts = self.check(tree, [0, 1], 4.0)
+        self.assertGreater(len(contacts), 0)
+        self.assertEqual(potential_collisions(tree, [0, 1], 4.0, agents=['red-ball']), [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,47 @@
+import unittest
+
+from verse.analysis.incremental import (
+    CachedTransition, TransitionStore, reach_trans_suit, sim_trans_key, sim_trans_suit,
+)
+
+
+def transition(x, disc, n=0):
+    return CachedTransition({'car': [x, 0.0]}, n, [disc], [x, 1.0], [])
+
+
+class TestTransitionStore(unittest.TestCase):
+    def test_duplicates_are_dropped(self):
+        store = TransitionStore([transition(0.0, 'A'), transition(0.0, 'A', n=3)], sim_trans_key)
+        added = store.extend([transition(0.0, 'A'), transition(0.0, 'B')])
+        self.assertEqual([t.disc for t in store], [['A'], ['B']])
+        self.assertEqual([t.disc for t in added], [['B']])
+
+    def test_suitable_keeps_insertion_order(self):
+        # Interleave two initial sets, and a third one that never suits
+        ts = [transition(x, d) for d in 'ABC' for x in (0.0, 1.0, 5.0)]
+        store = TransitionStore(ts, sim_trans_key)
+        self.assertEqual(len(store.by_inits), 3)
+        close = lambda a, b: abs(a['car'][0] - b['car'][0]) <= 1
+        res = store.suitable({'car': [0.5, 0.0]}, close)
+        self.assertEqual(res, [t for t in ts if t.inits['car'][0] <= 1])
+        self.assertEqual(store.num_suitable({'car': [0.5, 0.0]}, close), len(res))
+        self.assertEqual(store.suitable({'car': [0.0, 0.0]}, sim_trans_suit), [t for t in ts if t.inits['car'][0] == 0])
+        self.assertEqual(store.suitable({'car': [9.0, 0.0]}, sim_trans_suit), [])
+
+    def test_reach_suitability_is_containment(self):
+        inits = lambda lo, hi: {'car': [[[lo, 0.0], [hi, 0.0]]]}
+        outer = CachedTransition(inits(0.0, 2.0), 0, ['A'], [0.0], [])
+        inner = CachedTransition(inits(0.5, 1.0), 0, ['B'], [0.0], [])
+        store = TransitionStore([outer, inner], sim_trans_key)
+        self.assertEqual(store.suitable(inits(0.6, 0.9), reach_trans_suit), [outer, inner])
+        self.assertEqual(store.suitable(inits(0.1, 1.5), reach_trans_suit), [outer])
+
+    def test_filter(self):
+        store = TransitionStore([transition(x, 'A') for x in range(4)], sim_trans_key)
+        even = store.filter(lambda t: t.inits['car'][0] % 2 == 0)
+        self.assertEqual([t.inits['car'][0] for t in even], [0, 2])
+        self.assertEqual(len(even.by_inits), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
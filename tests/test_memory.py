@@ -0,0 +1,68 @@
+import json
+import unittest
+
+import numpy as np
+
+from example_scenarios import thermo_scenario
+from verse.analysis.analysis_tree import SpilledTraces
+from verse.analysis.utils import trace_nbytes
+from verse.scenario.scenario import ScenarioConfig
+
+
+def tree_key(tree):
+    return json.dumps(tree.to_dict(), default=str)
+
+
+class TestMemoryUsage(unittest.TestCase):
+    def test_trace_nbytes(self):
+        self.assertEqual(trace_nbytes(np.zeros((10, 3))), 240)
+        # A list of lists of floats costs more than the array of the same numbers
+        self.assertGreater(trace_nbytes(np.zeros((10, 3)).tolist()), 240)
+        self.assertEqual(trace_nbytes([[0.0] * 3] * 10), trace_nbytes(np.zeros((10, 3)).tolist()))
+
+    def test_usage_grows_with_runs_and_caches(self):
+        scenario = thermo_scenario(ScenarioConfig(incremental=True))
+        self.assertEqual(sum(scenario.memory_usage().values()), 0)
+        tree = scenario.verify(3, 0.05)
+        usage = scenario.memory_usage()
+        self.assertEqual(usage['traces'], sum(node.trace_nbytes() for node in tree.nodes))
+        self.assertEqual(usage['nodes'], sum(node.meta_nbytes() for node in tree.nodes))
+        self.assertGreater(usage['tube_cache'], 0)
+        self.assertEqual(usage['sim_cache'], 0)
+        scenario.simulate(3, 0.05)
+        after = scenario.memory_usage()
+        self.assertGreater(after['traces'], usage['traces'])
+        self.assertGreater(after['sim_cache'], 0)
+        self.assertEqual(after['tube_cache'], usage['tube_cache'])
+
+    def test_memory_limit_drops_caches(self):
+        # With the caches dropped after every node, nothing is reused from them
+        expected = tree_key(thermo_scenario().verify(3, 0.05))
+        scenario = thermo_scenario(ScenarioConfig(incremental=True, memory_limit=1))
+        self.assertEqual(tree_key(scenario.verify(3, 0.05)), expected)
+        self.assertGreater(scenario.num_cache_evictions, 0)
+        self.assertEqual(scenario.verifier.cache.nbytes, 0)
+        # The trees are never dropped, their traces are spilled to disk instead
+        self.assertEqual(scenario.memory_usage()['traces'], 0)
+        self.assertEqual(len(scenario.past_runs), 1)
+        self.assertEqual(tree_key(scenario.past_runs[0]), expected)
+
+    def test_memory_limit_spills_past_runs(self):
+        unlimited = thermo_scenario(ScenarioConfig(incremental=True))
+        expected = tree_key(unlimited.simulate(3, 0.05, seed=0))
+        unlimited.simulate(3, 0.05, seed=0)
+        usage = unlimited.memory_usage()
+        caches = usage['sim_cache'] + usage['tube_cache'] + usage['trans_cache']
+        # The limit leaves room for the caches but not for the trees
+        scenario = thermo_scenario(ScenarioConfig(incremental=True, memory_limit=caches))
+        scenario.simulate(3, 0.05, seed=0)
+        scenario.simulate(3, 0.05, seed=0)
+        self.assertEqual(scenario.num_cache_evictions, 0)
+        self.assertEqual(scenario.memory_usage()['sim_cache'], caches)
+        self.assertLess(scenario.memory_usage()['traces'], usage['traces'])
+        self.assertTrue(all(isinstance(node.trace, SpilledTraces) for node in scenario.past_runs[0].nodes))
+        for tree in scenario.past_runs:
+            self.assertEqual(tree_key(tree), expected)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,139 @@
+import os
+import sys
+import unittest
+
+import numpy as np
+from sympy import Symbol
+
+from example_scenarios import DEMO_DIR
+from verse.analysis.mixmonotone import (
+    BatchedBoundSolver, SymbolicObjective, calculate_bloated_tube_mixmono_disc, compute_decomposition_symbolic,
+    extract_dynamics_symbolic, get_symbolic_decomposition,
+)
+
+sys.path.insert(0, os.path.join(DEMO_DIR, 'tacas2023', 'exp7'))
+import uncertain_agents
+
+INIT = [[[0.3, 0.3], [0.5, 0.5]]]
+UNCERTAIN = [[-0.1, -0.1], [0.1, 0.1]]
+
+
+def tube(agent, params):
+    return np.array(calculate_bloated_tube_mixmono_disc(['Default'], INIT, UNCERTAIN, 1.0, 0.01, agent, None, params))
+
+
+class TestBatchedSolver(unittest.TestCase):
+    def test_batched_matches_separate(self):
+        separate = tube(uncertain_agents.Agent2('car'), {})
+        for corner in [False, True]:
+            batched = tube(uncertain_agents.Agent2('car'), {'mixmono_solver': 'batched', 'mixmono_corner': corner})
+            self.assertEqual(batched.shape, separate.shape)
+            np.testing.assert_allclose(batched, separate, atol=1e-6, err_msg=f"mixmono_corner={corner}")
+
+    def test_bound_of_box(self):
+        solver = BatchedBoundSolver(uncertain_agents.Agent2('car'))
+        low, high = np.array([0.3, 0.3, -0.1, -0.1]), np.array([0.5, 0.5, 0.1, 0.1])
+        lowest = solver.bound(low, high, 2, [0.01], 1)
+        highest = solver.bound(low, high, 2, [0.01], -1)
+        # Compare with the dynamics on a grid of the box
+        grid = np.stack(np.meshgrid(*[np.linspace(l, h, 5) for l, h in zip(low, high)]), -1).reshape(-1, 4)
+        values = np.array([solver._dynamics(z, 2, [0.01]) for z in grid])
+        np.testing.assert_allclose(lowest, values.min(axis=0), atol=1e-6)
+        np.testing.assert_allclose(highest, values.max(axis=0), atol=1e-6)
+
+    def test_corners_need_monotone_box(self):
+        solver = BatchedBoundSolver(WigglyAgent('car'), use_corner=True)
+        low, high = np.array([0.0]), np.array([1.0])
+        # The Jacobian is positive at both corners and the center, but the maximum is inside the box
+        self.assertTrue(all(solver._jac(np.array([x]), 1, [])[0, 0] > 0 for x in [0, 0.5, 1]))
+        solver.bound(low, high, 1, [], -1)
+        self.assertEqual((solver.num_corner_hits, solver.num_optimizer_calls), (0, 1))
+        # On a box where it is monotone the corner is used
+        self.assertEqual(solver.bound(np.array([0.98]), np.array([1.0]), 1, [], -1), solver._dynamics(np.array([1.0]), 1, []).tolist())
+        self.assertEqual(solver.num_corner_hits, 1)
+
+    def test_points_are_evaluated_together(self):
+        shapes = []
+        class Recording(uncertain_agents.Agent2):
+            def dynamics(self, x, args):
+                shapes.append(np.shape(x[0]))
+                return super().dynamics(x, args)
+        class Pointwise(uncertain_agents.Agent2):
+            def dynamics_jac(self, x, args):
+                return super().dynamics_jac([float(v) for v in x], [float(v) for v in args])
+        params = {'mixmono_solver': 'batched'}
+        expected = tube(uncertain_agents.Agent2('car'), params)
+        np.testing.assert_array_equal(tube(Recording('car'), params), expected)
+        # Both dimensions are optimized at once, from one call on two points
+        self.assertIn((2,), shapes)
+        self.assertNotIn((), shapes)
+        np.testing.assert_allclose(tube(Pointwise('car'), params), expected, atol=1e-12)
+
+
+class WigglyAgent(uncertain_agents.Agent2):
+    # Increasing at 0, 0.5 and 1 but decreasing on (0.53, 0.97)
+    def dynamics(self, x, args):
+        return [4000 / 3 * (x[0] - 0.75) ** 3 - 200 * x[0]]
+
+    def dynamics_jac(self, x, args):
+        return np.array([[4000 * (x[0] - 0.75) ** 2 - 200]])
+
+
+class Agent3Returning(uncertain_agents.Agent3):
+    # Same dynamics with other kinds of assignments outside of the markers
+    def dynamics(self, x, args):
+        w1, w2, dt = args
+        x1, x2 = x
+        scale = 1.0
+        '''Begin Dynamic'''
+        x1_plus = x1+dt*(x1*(1.1+w1-x1-0.1*x2))
+        x2_plus = x2+dt*(x2*(4+w2-3*x1-x2))
+        '''End Dynamic'''
+        res = [x1_plus * scale, x2_plus * scale]
+        out = res
+        return out
+
+
+class TestSymbolicDecomposition(unittest.TestCase):
+    def test_extract_ignores_other_assignments(self):
+        exprs, symbol_x, symbol_w, dt = extract_dynamics_symbolic(Agent3Returning('car'))
+        self.assertEqual([s.name for s in symbol_x], ['x1', 'x2'])
+        self.assertEqual([s.name for s in symbol_w], ['w1', 'w2'])
+        self.assertEqual(len(exprs), 2)
+
+    def test_objective_without_params(self):
+        x, y, dt = Symbol('x'), Symbol('y'), Symbol('dt')
+        objective = SymbolicObjective(x * x + y, [x, y])
+        self.assertAlmostEqual(objective.minimize({x: (-1, 1), y: (0, 1)}), 0)
+        self.assertAlmostEqual(objective.maximize({x: (-1, 1), y: (0, 1)}), 2)
+        # Parameters of one objective don't leak into another
+        self.assertAlmostEqual(SymbolicObjective(x * dt, [x], [dt]).minimize({x: (1, 2)}, [0.5]), 0.5)
+        self.assertEqual(SymbolicObjective(x, [x]).params, [])
+
+    def test_lambdified_objectives_match_sympy(self):
+        agent = uncertain_agents.Agent3('car')
+        exprs, symbol_x, symbol_w, dt = extract_dynamics_symbolic(agent)
+        objectives, _, _ = get_symbolic_decomposition(agent)
+        rng = np.random.default_rng(0)
+        for x in rng.uniform(-1, 1, (5, 4)):
+            subs = dict(zip(symbol_x + symbol_w + [dt], list(x) + [0.01]))
+            for expr, objective, value in zip(exprs, objectives, agent.dynamics(list(x[:2]), list(x[2:]) + [0.01])):
+                self.assertAlmostEqual(float(expr.subs(subs)), value)
+                self.assertAlmostEqual(float(objective.expr_func([subs[v] for v in objective.vars], 0.01)), value)
+
+    def test_decomposition_bounds_dynamics(self):
+        agent = uncertain_agents.Agent3('car')
+        objectives, symbol_x, symbol_w = get_symbolic_decomposition(agent)
+        low, high = [0.3, 0.3, -0.1, -0.1], [0.5, 0.5, 0.1, 0.1]
+        lowest = compute_decomposition_symbolic(objectives, symbol_x, symbol_w, low[:2], low[2:], high[:2], high[2:], [0.01])
+        highest = compute_decomposition_symbolic(objectives, symbol_x, symbol_w, high[:2], high[2:], low[:2], low[2:], [0.01])
+        grid = np.stack(np.meshgrid(*[np.linspace(l, h, 5) for l, h in zip(low, high)]), -1).reshape(-1, 4)
+        values = np.array([agent.dynamics(list(z[:2]), list(z[2:]) + [0.01]) for z in grid])
+        np.testing.assert_allclose(lowest, values.min(axis=0), atol=1e-6)
+        np.testing.assert_allclose(highest, values.max(axis=0), atol=1e-6)
+        # Agent2 has the same dynamics with a hand written Jacobian
+        np.testing.assert_allclose(tube(agent, {}), tube(uncertain_agents.Agent2('car'), {}), atol=1e-6)
+
+
+if __name__ == '__main__':
+    unittest.main()
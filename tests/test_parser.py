@@ -0,0 +1,74 @@
+import json
+import os
+import pickle
+import tempfile
+import unittest
+from unittest import mock
+
+from example_scenarios import THERMO_CONTROLLER, thermo_scenario
+from verse.parser import parser
+from verse.parser.parser import ControllerIR
+
+
+def tree_key(tree):
+    return json.dumps(tree.to_dict(), default=str)
+
+
+class TestParseCache(unittest.TestCase):
+    def setUp(self):
+        patcher = mock.patch.dict(parser._parse_cache, clear=True)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def test_same_source_is_parsed_once(self):
+        first = ControllerIR.parse(THERMO_CONTROLLER)
+        with mock.patch.object(parser.Env, 'parse', side_effect=AssertionError("parsed again")):
+            second = ControllerIR.parse(THERMO_CONTROLLER)
+        self.assertIs(second.paths, first.paths)
+        # mode_defs get the lanes of the map added, so each controller has its own
+        self.assertIsNot(second.mode_defs, first.mode_defs)
+        self.assertEqual(len(parser._parse_cache), 1)
+
+    def test_file_and_code_share_entries(self):
+        with tempfile.TemporaryDirectory() as tmp:
+            path = os.path.join(tmp, 'controller.py')
+            with open(path, 'w') as f:
+                f.write(THERMO_CONTROLLER)
+            ControllerIR.parse(fn=path)
+            ControllerIR.parse(THERMO_CONTROLLER)
+        self.assertEqual(len(parser._parse_cache), 1)
+        ControllerIR.parse(THERMO_CONTROLLER + '\n# changed\n')
+        self.assertEqual(len(parser._parse_cache), 2)
+
+    def test_disk_cache(self):
+        expected = tree_key(thermo_scenario().verify(3, 0.01))
+        parser._parse_cache.clear()
+        with tempfile.TemporaryDirectory() as tmp, mock.patch.object(parser, 'PARSE_CACHE_DIR', tmp):
+            ControllerIR.parse(THERMO_CONTROLLER)
+            self.assertEqual(len(os.listdir(tmp)), 1)
+            # A new process only finds the pickled controller
+            parser._parse_cache.clear()
+            with mock.patch.object(parser.Env, 'parse', side_effect=AssertionError("parsed again")):
+                self.assertEqual(tree_key(thermo_scenario().verify(3, 0.01)), expected)
+            # Unreadable files are parsed again and replaced
+            parser._parse_cache.clear()
+            with open(os.path.join(tmp, os.listdir(tmp)[0]), 'wb') as f:
+                f.write(b'garbage')
+            self.assertEqual(tree_key(thermo_scenario().verify(3, 0.01)), expected)
+            parser._parse_cache.clear()
+            with mock.patch.object(parser.Env, 'parse', side_effect=AssertionError("parsed again")):
+                ControllerIR.parse(THERMO_CONTROLLER)
+
+
+class TestIRPickler(unittest.TestCase):
+    def test_scenario_round_trip(self):
+        scenario = thermo_scenario()
+        with self.assertRaises(TypeError):
+            pickle.dumps(scenario)
+        copied = pickle.loads(parser.dumps(scenario))
+        self.assertIsNot(copied.agent_dict['t'].decision_logic, scenario.agent_dict['t'].decision_logic)
+        self.assertEqual(tree_key(copied.verify(3, 0.01)), tree_key(scenario.verify(3, 0.01)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from example_scenarios import thermo_scenario
+from verse.analysis.analysis_tree import AnalysisTree, AnalysisTreeNode
+from verse.plotter.plotter2D import anime_frames, trace_bounds
+
+
+def sim_tree():
+    """Two balls moving right, with two branches after t = 1"""
+    def trace(start, x, vx):
+        ts = np.round(np.arange(start, start + 1.05, 0.1), 3)
+        return np.stack([ts, x + vx * (ts - start), np.zeros(len(ts))], axis=1).tolist()
+    agent = {'red-ball': None, 'green-ball': None}
+    children = [AnalysisTreeNode(trace={'red-ball': trace(1, 1, vx), 'green-ball': trace(1, 6, -vx)}, agent=agent, child=[],
+                                 start_time=1, id=k + 1) for k, vx in enumerate([1, 2])]
+    root = AnalysisTreeNode(trace={'red-ball': trace(0, 0, 1), 'green-ball': trace(0, 5, 1)}, agent=agent, child=children)
+    return AnalysisTree(root)
+
+
+class TestAnimeFrames(unittest.TestCase):
+    def test_simulation_points(self):
+        tree = sim_tree()
+        frames = anime_frames(tree)
+        times = list(frames)
+        self.assertEqual(times, sorted(set(times)))
+        for t in [0.0, 1.0, times[-1]]:
+            for agent_id in ['red-ball', 'green-ball']:
+                expected = {tuple(row) for node in tree.nodes for row in np.array(node.trace[agent_id]) if round(row[0], 3) == t}
+                points = frames[t][agent_id]
+                self.assertEqual({tuple(row) for row in points}, expected)
+                # Points shared by the branches are shown once
+                self.assertEqual(len(points), len(expected))
+            self.assertEqual(set(frames[t]), {'red-ball', 'green-ball'})
+        self.assertNotIn(-1.0, frames)
+
+    def test_rounded_times(self):
+        # Times that only differ after num_digit digits share a frame
+        root = AnalysisTreeNode(trace={'a': [[0.1, 0], [0.30000000000000004, 1]], 'b': [[0.1, 0], [0.3, 2]]},
+                                agent={'a': None, 'b': None}, child=[])
+        frames = anime_frames(AnalysisTree(root))
+        self.assertEqual(list(frames), [0.1, 0.3])
+        self.assertEqual(frames[0.3]['a'].tolist(), [[0.30000000000000004, 1]])
+        self.assertEqual(frames[0.3]['b'].tolist(), [[0.3, 2]])
+
+    def test_reachtube_rectangles(self):
+        tree = thermo_scenario().verify(3, 0.01)
+        frames = anime_frames(tree, reachtube=True)
+        for t in [0.0, 0.5, 1.5]:
+            rects = frames[t]['t']
+            self.assertGreater(len(rects), 0)
+            self.assertTrue(np.all(rects[:, 0, 0].round(3) == t))
+            for rect in rects:
+                self.assertTrue(any(np.array_equal(np.array(node.trace['t'][row:row + 2]), rect)
+                                    for node in tree.nodes for row in range(0, len(node.trace['t']), 2)))
+        x_min, x_max, _, _ = trace_bounds(tree, 1, 2)
+        self.assertLessEqual(x_min, 60)
+        self.assertGreaterEqual(x_max, 90)
+
+
+if __name__ == '__main__':
+    unittest.main()
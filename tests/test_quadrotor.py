@@ -0,0 +1,81 @@
+import os
+import pickle
+import unittest
+from unittest import mock
+
+import numpy as np
+import torch
+
+from example_scenarios import DEMO_DIR
+from verse.agents.example_agent.quadrotor_agent import QuadrotorAgent, load_controller
+from verse.map.example_map.map_tacas import M5
+from verse.map.lane_map_3d import WaypointTracker
+
+CONTROLLER = os.path.join(DEMO_DIR, 'tacas2023', 'exp9', 'quadrotor_controller3.py')
+MODE = ['Normal', 'T1']
+INITS = [[1.5 + 0.5 * i, -0.5 + 0.5 * i, 0, 0, 0, 0] for i in range(3)]
+
+
+def quadrotor():
+    return QuadrotorAgent('q', file_name=CONTROLLER, t_v_pair=(1, 1), box_side=[0.4] * 3)
+
+
+class TestQuadrotorBatch(unittest.TestCase):
+    def test_controller_is_loaded_once(self):
+        controller = load_controller()
+        self.assertIs(load_controller(), controller)
+        self.assertFalse(controller.training)
+        self.assertFalse(any(p.requires_grad for p in controller.parameters()))
+        self.assertEqual(controller(torch.zeros(2, 6)).shape, (2, 8))
+
+    def test_batch_matches_single_runs(self):
+        agent, lane_map = quadrotor(), M5()
+        batch = agent.TC_simulate_batch(MODE, INITS, 3, 0.2, lane_map)
+        self.assertEqual(len(batch), len(INITS))
+        for init, trace in zip(INITS, batch):
+            single = agent.TC_simulate(MODE, init, 3, 0.2, lane_map)
+            np.testing.assert_array_equal(trace, single)
+            np.testing.assert_allclose(np.array(trace)[0, 1:], init)
+
+    def test_waypoint_box(self):
+        agent = quadrotor()
+        states = np.zeros((3, 9))
+        states[:, 3:6] = [[1.21, 0, 0], [1.19, 0.2, -0.2], [1, 0, 0.21]]
+        waypoints = [[0, 0, 0, 1, 0, 0]] * 3
+        np.testing.assert_array_equal(agent.action_handler(MODE, states, waypoints), [0, 1, 0])
+
+    def test_batch_uses_action_handler(self):
+        agent, lane_map = quadrotor(), M5()
+        with mock.patch.object(QuadrotorAgent, 'action_handler', autospec=True, side_effect=QuadrotorAgent.action_handler) as handler:
+            agent.TC_simulate_batch(MODE, INITS, 1, 0.2, lane_map)
+        states = handler.call_args.args[2]
+        self.assertEqual(states.shape, (len(INITS), 9))
+
+
+class TestWaypointTracker(unittest.TestCase):
+    def test_map_is_not_modified(self):
+        agent, lane_map = quadrotor(), M5()
+        before = pickle.dumps(lane_map)
+        first = agent.TC_simulate(MODE, INITS[0], 3, 0.2, lane_map)
+        agent.TC_simulate_batch(MODE, INITS, 3, 0.2, lane_map)
+        self.assertEqual(pickle.dumps(lane_map), before)
+        # Runs don't see the waypoints of earlier runs
+        np.testing.assert_array_equal(agent.TC_simulate(MODE, INITS[0], 3, 0.2, lane_map), first)
+
+    def test_tracker_follows_waypoints(self):
+        agent, lane_map = quadrotor(), M5()
+        tracker = WaypointTracker()
+        trace = agent.TC_simulate(MODE, INITS[0], 3, 0.2, lane_map, tracker)
+        self.assertGreater(len(tracker.wps), 1)
+        self.assertEqual(tracker.curr_wp, tracker.wps[-1])
+        # Consecutive waypoints are chained, and the quadrotor moves along them
+        for prev, wp in zip(tracker.wps, tracker.wps[1:]):
+            np.testing.assert_allclose(prev[3:], wp[:3])
+        self.assertGreater(np.array(trace)[-1, 1], INITS[0][0])
+        copied = tracker.copy()
+        copied.wps.append([0] * 6)
+        self.assertNotEqual(len(copied.wps), len(tracker.wps))
+
+
+if __name__ == '__main__':
+    unittest.main()
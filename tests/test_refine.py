@@ -0,0 +1,56 @@
+import os
+import unittest
+from unittest import mock
+
+import numpy as np
+
+from example_scenarios import THERMO_CONTROLLER, ThermoAgent, thermo_scenario
+from verse.analysis.utils import map_parallel
+
+PARAMS = {'bloating_method': 'GLOBAL'}
+REFINE = dict(PARAMS, refine_width=[1.0, 1.0], refine_depth=3)
+
+
+def root_tube(params, init=((60, 0), (90, 0))):
+    return np.array(thermo_scenario(init=init).verify(0.5, 0.01, params=params).root.trace['t'])
+
+
+def corners(tube):
+    """Lower and upper corners of the rectangles of a tube"""
+    return tube[0::2], tube[1::2]
+
+
+class TestRefinedTube(unittest.TestCase):
+    def test_refined_tube_contains_sample_traces(self):
+        tube = corners(root_tube(PARAMS))
+        refined = corners(root_tube(dict(REFINE, refine_workers=2)))
+        self.assertEqual(len(refined[0]), len(tube[0]))
+        self.assertTrue(np.all(refined[1] - refined[0] <= tube[1] - tube[0] + 1e-6))
+        rng = np.random.default_rng(0)
+        for temp in np.concatenate([[60, 90], rng.uniform(60, 90, 20)]):
+            trace = ThermoAgent('t', code=THERMO_CONTROLLER).TC_simulate(['ON'], [temp, 0], 0.5, 0.01)[:len(refined[0]) + 1]
+            for lo, hi in [tube, refined]:
+                self.assertTrue(np.all(lo <= trace[:-1] + 1e-9) and np.all(trace[:-1] <= hi + 1e-9))
+                self.assertTrue(np.all(lo[:, 1:] <= trace[1:, 1:] + 1e-9) and np.all(trace[1:, 1:] <= hi[:, 1:] + 1e-9))
+
+    def test_workers_fall_back_to_sequential(self):
+        sequential = root_tube(dict(REFINE, refine_workers=1))
+        np.testing.assert_array_equal(root_tube(dict(REFINE, refine_workers=2)), sequential)
+        with mock.patch('multiprocessing.get_all_start_methods', return_value=['spawn']):
+            np.testing.assert_array_equal(root_tube(dict(REFINE, refine_workers=2)), sequential)
+
+
+class TestMapParallel(unittest.TestCase):
+    def test_dead_workers_fall_back_to_sequential(self):
+        parent = os.getpid()
+        def double(x):
+            if os.getpid() != parent:
+                os._exit(1)
+            return 2 * x
+        with self.assertWarns(UserWarning):
+            self.assertEqual(map_parallel(double, range(4), 2), [0, 2, 4, 6])
+        self.assertEqual(map_parallel(lambda x: 2 * x, range(4), 2), [0, 2, 4, 6])
+
+
+if __name__ == '__main__':
+    unittest.main()
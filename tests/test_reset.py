@@ -0,0 +1,41 @@
+import math
+import unittest
+
+from verse.automaton.reset import compile_reset, eval_reset_corners
+
+
+class TestCompileReset(unittest.TestCase):
+    def test_variables_in_argument_order(self):
+        names, func = compile_reset('ego.x + 2 * ego.v - others.x + ego.x')
+        self.assertEqual(names, ['ego.x', 'ego.v', 'others.x'])
+        self.assertEqual(func(1, 2, 3), 3)
+
+    def test_builtins_are_allowed(self):
+        names, func = compile_reset('abs(ego.vx) * -0.9 + min(ego.y, 0)')
+        self.assertEqual(names, ['ego.vx', 'ego.y'])
+        self.assertAlmostEqual(func(-2, 1), -1.8)
+
+    def test_unknown_names_and_syntax_errors(self):
+        self.assertIsNone(compile_reset('ego.x + offset'))
+        # Every dotted name is taken as a variable, apply_reset checks that they are state variables
+        self.assertEqual(compile_reset('math.sin(ego.x)')[0], ['math.sin', 'ego.x'])
+        self.assertIsNone(compile_reset('ego.x +'))
+        names, func = compile_reset('3.5')
+        self.assertEqual((names, func()), ([], 3.5))
+
+
+class TestResetCorners(unittest.TestCase):
+    def test_min_and_max_over_corners(self):
+        _, func = compile_reset('ego.x * ego.y - ego.z')
+        self.assertEqual(eval_reset_corners(func, [(-1, 2), (3, 4), (0, 1)]), (-5.0, 8.0))
+
+    def test_scalar_only_expressions(self):
+        # math functions don't take arrays, so the corners are evaluated one by one
+        func = lambda x: math.floor(x) + 0.5
+        self.assertEqual(eval_reset_corners(func, [(0.2, 2.7)]), (0.5, 2.5))
+        _, const = compile_reset('1 + 1')
+        self.assertEqual(eval_reset_corners(const, []), (2, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+
+import numpy as np
+
+from example_scenarios import ball_scenario, thermo_scenario
+from verse.analysis import UnsafeSet, check_unsafe
+from verse.analysis.safety import intersects
+
+
+def first_hit_brute_force(tree, agent_id, lo, hi):
+    """Earliest (time, node id, row) of a rectangle or point of the agent that meets the box [lo, hi]"""
+    hits = []
+    for node in tree.nodes:
+        trace = np.array(node.trace[agent_id])
+        step = 2 if node.type == 'reachtube' else 1
+        for row in range(0, len(trace) - step + 1, step):
+            rect_lo, rect_hi = trace[row, 1:], trace[row + step - 1, 1:]
+            if np.all(rect_lo <= hi) and np.all(lo <= rect_hi):
+                hits.append((trace[row, 0], node.id, row))
+    return min(hits) if hits else None
+
+
+class TestCheckUnsafe(unittest.TestCase):
+    def test_box_against_brute_force(self):
+        tree = thermo_scenario().verify(4, 0.05)
+        boxes = [([None, 0.5], [62, None]), ([85, None], [None, None]), ([None, None], [55, None]), ([70, 0.2], [71, 0.3])]
+        unsafe = [UnsafeSet.box('t', lo, hi) for lo, hi in boxes]
+        for (lo, hi), violation in zip(boxes, check_unsafe(tree, unsafe)):
+            lo = np.array([-np.inf if v is None else v for v in lo])
+            hi = np.array([np.inf if v is None else v for v in hi])
+            expected = first_hit_brute_force(tree, 't', lo, hi)
+            if expected is None:
+                self.assertIsNone(violation)
+            else:
+                self.assertEqual((violation.time, violation.node.id, violation.index), expected)
+        self.assertIsNone(check_unsafe(tree, unsafe)[2])
+
+    def test_pair_of_agents(self):
+        # The balls start 10 apart in x and come within 2 of each other in both x and y later on
+        tree = ball_scenario().simulate(20, 0.1)
+        near = UnsafeSet.box(('red-ball', 'green-ball'), [-2, -2, None, None], [2, 2, None, None])
+        violation, = check_unsafe(tree, [near])
+        self.assertIsNotNone(violation)
+        red, green = np.array(violation.node.trace['red-ball']), np.array(violation.node.trace['green-ball'])
+        self.assertTrue(np.all(np.abs(red[violation.index, 1:3] - green[violation.index, 1:3]) <= 2))
+        # No earlier rows of any node are that close
+        for node in tree.nodes:
+            red, green = np.array(node.trace['red-ball']), np.array(node.trace['green-ball'])
+            close = np.all(np.abs(red[:, 1:3] - green[:, 1:3]) <= 2, axis=1)
+            self.assertTrue(np.all(red[close, 0] >= violation.time))
+
+    def test_half_space(self):
+        # temp + 10 * cycle_time >= 95 as -temp - 10 * cycle_time <= -95
+        tree = thermo_scenario().verify(2, 0.05)
+        violation, = check_unsafe(tree, [UnsafeSet('t', [[-1, -10]], [-95])])
+        row = np.array(violation.node.trace['t'][violation.index + 1])
+        self.assertGreaterEqual(row[1] + 10 * row[2], 95)
+        self.assertTrue(np.all(intersects(np.zeros((1, 2)), np.ones((1, 2)), np.array([[1.0, 1.0]]), np.array([0.0]))))
+        self.assertFalse(np.any(intersects(np.zeros((1, 2)), np.ones((1, 2)), np.array([[1.0, 1.0]]), np.array([-0.1]))))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,150 @@
+import copy
+import os
+import unittest
+from enum import Enum, auto
+
+import numpy as np
+
+from example_scenarios import DEMO_DIR
+from verse.agents.example_agent import CarAgent
+from verse.analysis.analysis_tree import AnalysisTreeNode
+from verse.map.example_map.map_tacas import M1
+from verse.scenario import Scenario
+from verse.sensor.base_sensor import BaseSensor, compile_sensor, find_neighbors
+
+CONTROLLER = os.path.join(DEMO_DIR, 'tacas2023', 'exp2', 'example_controller5.py')
+
+with open(CONTROLLER) as f:
+    _source = f.read()
+# Brakes behind the one other car
+SINGLE_OTHER_CONTROLLER = _source[:_source.index('def vehicle_front')] + """
+def decisionLogic(ego:State, other:State, track_map):
+    output = copy.deepcopy(ego)
+    if ego.agent_mode == AgentMode.Normal and other.x - ego.x > 0 and other.x - ego.x < 3:
+        output.agent_mode = AgentMode.Brake
+    return output
+"""
+
+
+class AgentMode(Enum):
+    Normal = auto()
+    Brake = auto()
+
+
+class TrackMode(Enum):
+    T1 = auto()
+
+
+def cars_node(xs, type='simtrace', code=None):
+    """A node with one car per entry of xs, standing still at (x, 0) for three time steps"""
+    agents = {f'car{i}': CarAgent(f'car{i}', file_name=CONTROLLER) if code is None else CarAgent(f'car{i}', code=code) for i in range(len(xs))}
+    trace = {}
+    for (agent_id, agent), x in zip(agents.items(), xs):
+        points = np.array([[t, x, 0, 0, 0] for t in range(3)], dtype=float)
+        trace[agent_id] = np.repeat(points, 2, axis=0) if type == 'reachtube' else points
+    return AnalysisTreeNode(trace=trace, agent=agents, type=type)
+
+
+class TestFindNeighbors(unittest.TestCase):
+    def test_radius_and_k_nearest(self):
+        node = cars_node([0, 1, 2, 10])
+        self.assertEqual(find_neighbors(node, radius=5)['car0'], ['car1', 'car2'])
+        self.assertEqual(find_neighbors(node, k_nearest=1)['car0'], ['car1'])
+        self.assertEqual(find_neighbors(node, k_nearest=3)['car0'], ['car1', 'car2', 'car3'])
+        # Both limits apply together
+        self.assertEqual(find_neighbors(node, radius=5, k_nearest=1)['car0'], ['car1'])
+        self.assertEqual(find_neighbors(node, radius=1.5, k_nearest=3)['car0'], ['car1'])
+        self.assertEqual(find_neighbors(node, radius=20, k_nearest=3)['car3'], ['car0', 'car1', 'car2'])
+        self.assertEqual(find_neighbors(node, radius=5, k_nearest=2)['car3'], [])
+
+    def test_reachtube(self):
+        node = cars_node([0, 1, 2, 10], 'reachtube')
+        self.assertEqual(find_neighbors(node, radius=5, k_nearest=1)['car0'], ['car1'])
+        self.assertEqual(find_neighbors(node, radius=8.5)['car3'], ['car2'])
+
+    def test_matches_brute_force(self):
+        rng = np.random.default_rng(0)
+        for type in ['simtrace', 'reachtube']:
+            node = cars_node(rng.uniform(0, 30, size=12), type)
+            for trace in node.trace.values():
+                trace[:, 1:3] += rng.normal(size=(len(trace), 2))
+                if type == 'reachtube':
+                    trace[1::2, 1:3] = np.maximum(trace[0::2, 1:3], trace[1::2, 1:3])
+            step = 2 if type == 'reachtube' else 1
+            lo = {k: v[::step, 1:3] for k, v in node.trace.items()}
+            hi = {k: v[step - 1::step, 1:3] for k, v in node.trace.items()}
+            for radius, k_nearest in [(3, None), (6, 2), (None, 3)]:
+                expected = {}
+                for ego in node.trace:
+                    others = [o for o in node.trace if o != ego]
+                    min_dist = np.array([np.linalg.norm(np.maximum(np.maximum(lo[o] - hi[ego], lo[ego] - hi[o]), 0), axis=1) for o in others])
+                    max_dist = np.array([np.linalg.norm(np.maximum(hi[o] - lo[ego], hi[ego] - lo[o]), axis=1) for o in others])
+                    sensed = min_dist <= (np.inf if radius is None else radius)
+                    if k_nearest is not None:
+                        sensed &= min_dist <= np.sort(max_dist, axis=0)[k_nearest - 1]
+                    expected[ego] = [o for o, s in zip(others, sensed.any(axis=1)) if s]
+                self.assertEqual(find_neighbors(node, radius, k_nearest), expected)
+
+    def test_single_other_is_never_missing(self):
+        # The controller needs one other car, so a car that senses none senses all of them
+        node = cars_node([0, 1, 10], code=SINGLE_OTHER_CONTROLLER)
+        self.assertEqual(find_neighbors(node, radius=5), {'car0': ['car1'], 'car1': ['car0']})
+        scenario = Scenario()
+        for agent_id in ['car0', 'car1']:
+            scenario.add_agent(CarAgent(agent_id, code=SINGLE_OTHER_CONTROLLER))
+        scenario.set_map(M1())
+        scenario.set_sensor(BaseSensor(radius=1))
+        scenario.set_init([[[0, 0, 0, 1], [0, 0, 0, 1]], [[50, 0, 0, 1], [50, 0, 0, 1]]], [(AgentMode.Normal, TrackMode.T1)] * 2)
+        trace = scenario.simulate(1, 0.1).root.trace['car0']
+        self.assertAlmostEqual(trace[-1][1], 1, places=1)
+
+    def test_sensor_without_limits_senses_all(self):
+        node = cars_node([0, 1])
+        self.assertIsNone(BaseSensor().neighbors(node))
+        self.assertEqual(BaseSensor(radius=0.5).neighbors(node), {'car0': [], 'car1': []})
+
+
+class TestCompiledSensor(unittest.TestCase):
+    def states(self, width, reach=False):
+        state = lambda x: [0.0] + [x + i for i in range(width)]
+        return {
+            f'car{i}': ([state(i), state(i + 0.5)] if reach else state(i), ['Normal', 'T1'], [])
+            for i in range(3)
+        }
+
+    def test_layout_follows_state_widths(self):
+        agent = CarAgent('car0', file_name=CONTROLLER)
+        sensor = BaseSensor()
+        for width in [3, 4, 3]:
+            for reach in [False, True]:
+                state_dict = self.states(width, reach)
+                cont, disc, len_dict = sensor.sense(None, agent, state_dict, None)
+                expected = sensor.sense_dicts(None, agent, state_dict, None)
+                self.assertEqual(sorted(cont), sorted(expected[0]))
+                for k in cont:
+                    np.testing.assert_array_equal(cont[k], expected[0][k])
+                self.assertEqual((disc, len_dict), expected[1:])
+        self.assertEqual(len(agent._sensor_layouts[1]), 4)
+
+    def test_fill_results_are_independent(self):
+        agent = CarAgent('car0', file_name=CONTROLLER)
+        for reach in [False, True]:
+            layout = compile_sensor(agent, self.states(4, reach))
+            first = layout.fill(self.states(4, reach))[0]
+            expected = copy.deepcopy(first)
+            second = layout.fill({k: (np.add(state, 100).tolist(), mode, static) for k, (state, mode, static) in self.states(4, reach).items()})[0]
+            for k in first:
+                np.testing.assert_array_equal(first[k], expected[k])
+                self.assertFalse(np.array_equal(first[k], second[k]))
+
+    def test_layouts_are_dropped_with_decision_logic(self):
+        agent = CarAgent('car0', file_name=CONTROLLER)
+        layout = compile_sensor(agent, self.states(4))
+        self.assertIs(compile_sensor(agent, self.states(4)), layout)
+        agent.decision_logic = copy.copy(agent.decision_logic)
+        self.assertIsNot(compile_sensor(agent, self.states(4)), layout)
+        self.assertEqual(len(agent._sensor_layouts[1]), 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
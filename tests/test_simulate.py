@@ -0,0 +1,103 @@
+import json
+import unittest
+
+import numpy as np
+
+from example_scenarios import THERMO_CONTROLLER, ball_scenario, branching_scenario, thermo_scenario
+from verse.parser.parser import ControllerIR
+from verse.scenario.scenario import ControllerAdapter
+
+
+def child_modes(tree):
+    return [(n.mode['ball1'][0], n.mode['ball2'][0]) for n in tree.root.child]
+
+
+def tree_key(tree):
+    return json.dumps(tree.to_dict(), default=str)
+
+
+class TestSimulateBudget(unittest.TestCase):
+    def test_budget_marks_frontier(self):
+        full = ball_scenario().simulate(40, 0.1)
+        partial = ball_scenario().simulate(40, 0.1, node_budget=2)
+        self.assertLess(len(partial.nodes), len(full.nodes))
+        self.assertEqual([n.frontier for n in partial.nodes[:2]], [False, False])
+        self.assertTrue(any(n.frontier for n in partial.nodes))
+
+    def test_resume_matches_full_run(self):
+        full = tree_key(ball_scenario().simulate(40, 0.1))
+        for budget in [1, 2, 3]:
+            scenario = ball_scenario()
+            partial = scenario.simulate(40, 0.1, node_budget=budget)
+            resumed = scenario.simulate(40, 0.1, resume_from=partial)
+            self.assertEqual(tree_key(resumed), full, msg=f"node_budget={budget}")
+
+
+class TestSimulateIter(unittest.TestCase):
+    def test_nodes_are_yielded_in_bfs_order(self):
+        full = ball_scenario().simulate(40, 0.1)
+        scenario = ball_scenario()
+        nodes = list(scenario.simulate_iter(40, 0.1))
+        self.assertEqual([n.id for n in nodes], list(range(len(full.nodes))))
+        self.assertEqual(tree_key(scenario.past_runs[-1]), tree_key(full))
+        self.assertEqual([n.to_dict() for n in nodes], [n.to_dict() for n in full.nodes])
+
+    def test_break_records_partial_tree(self):
+        scenario = ball_scenario()
+        for i, node in enumerate(scenario.simulate_iter(40, 0.1)):
+            if i == 1:
+                break
+        partial = scenario.past_runs[-1]
+        self.assertEqual([n.frontier for n in partial.nodes[:2]], [False, False])
+        self.assertTrue(all(n.frontier for n in partial.nodes[2:]))
+        self.assertGreater(len(partial.nodes), 2)
+
+
+class TestSimulateSimple(unittest.TestCase):
+    def test_matches_simulate(self):
+        init = ((70, 0), (70, 0))
+        full = thermo_scenario(init=init).simulate(4, 0.01)
+        simple = thermo_scenario(init=init).simulate_simple(4, 0.01)
+        self.assertEqual([list(n.mode['t']) for n in simple.nodes], [list(n.mode['t']) for n in full.nodes])
+        for a, b in zip(simple.nodes, full.nodes):
+            np.testing.assert_array_equal(a.trace['t'], b.trace['t'])
+
+    def test_controller_is_executed_once_per_agent(self):
+        scenario = thermo_scenario()
+        agent = scenario.agent_dict['t']
+        scenario.simulate_simple(2, 0.01)
+        adapter = ControllerAdapter.get(agent)
+        scenario.simulate_simple(2, 0.01)
+        self.assertIs(ControllerAdapter.get(agent), adapter)
+        agent.decision_logic = ControllerIR.parse(THERMO_CONTROLLER.replace('1.0', '0.5'))
+        self.assertIsNot(ControllerAdapter.get(agent), adapter)
+
+
+class TestBranching(unittest.TestCase):
+    def test_branching_limit(self):
+        full = child_modes(branching_scenario().simulate(8, 0.1))
+        self.assertEqual(len(set(full)), 9)
+        self.assertEqual(child_modes(branching_scenario(branching_limit=4).simulate(8, 0.1)), full[:4])
+
+    def test_random_branching_is_seeded(self):
+        def modes(seed, np_seed):
+            np.random.seed(np_seed)
+            scenario = branching_scenario(branching_limit=4, branching_policy='random', branching_seed=seed)
+            return [child_modes(scenario.simulate(8, 0.1)) for _ in range(2)]
+        runs = modes(1, 0)
+        self.assertEqual(len(runs[0]), 4)
+        self.assertEqual(runs[0], runs[1])
+        self.assertEqual(modes(1, 1), runs)
+        self.assertTrue(set(runs[0]) < set(child_modes(branching_scenario().simulate(8, 0.1))))
+        self.assertGreater(len({tuple(modes(seed, 0)[0]) for seed in range(5)}), 1)
+
+    def test_random_branching_resume_matches_full_run(self):
+        config = dict(branching_limit=4, branching_policy='random', branching_seed=3)
+        full = tree_key(branching_scenario(**config).simulate(12, 0.1))
+        scenario = branching_scenario(**config)
+        partial = scenario.simulate(12, 0.1, node_budget=1)
+        self.assertEqual(tree_key(scenario.simulate(12, 0.1, resume_from=partial)), full)
+
+
+if __name__ == '__main__':
+    unittest.main()
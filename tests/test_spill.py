@@ -0,0 +1,70 @@
+import copy
+import gc
+import os
+import pickle
+import tempfile
+import unittest
+
+import numpy as np
+
+from verse.analysis.analysis_tree import AnalysisTree, AnalysisTreeNode, SpilledTraces
+from verse.scenario.scenario import ScenarioConfig
+
+from example_scenarios import thermo_scenario
+
+
+class TestSpill(unittest.TestCase):
+    def test_scenarios_sharing_spill_dir(self):
+        inits = [((60, 0), (90, 0)), ((70, 0), (75, 0))]
+        expected = [thermo_scenario(init=init).verify(3, 0.05).to_dict() for init in inits]
+        with tempfile.TemporaryDirectory() as spill_dir:
+            scenarios = [thermo_scenario(ScenarioConfig(spill_dir=spill_dir), init=init) for init in inits]
+            trees = [scenario.verify(3, 0.05) for scenario in scenarios]
+            for scenario, tree, exp in zip(scenarios, trees, expected):
+                self.assertTrue(all(isinstance(node.trace, SpilledTraces) for node in tree.nodes))
+                self.assertEqual(scenario.memory_usage()['traces'], 0)
+                self.assertEqual(tree.to_dict(), exp)
+            self.assertEqual(len(os.listdir(spill_dir)), 2)
+            # The directory of a run goes away with the last of its nodes
+            copies = [copy.deepcopy(tree.root) for tree in trees]
+            del scenarios, trees, scenario, tree
+            gc.collect()
+            self.assertEqual(len(os.listdir(spill_dir)), 2)
+            self.assertEqual(AnalysisTree(copies[0]).to_dict(), expected[0])
+            del copies
+            gc.collect()
+            self.assertEqual(os.listdir(spill_dir), [])
+
+    def test_incremental_caches_are_kept(self):
+        # Spilling only frees the traces of the nodes, the caches keep their copies
+        with tempfile.TemporaryDirectory() as spill_dir:
+            usage = {}
+            for config in [ScenarioConfig(incremental=True), ScenarioConfig(incremental=True, spill_dir=spill_dir)]:
+                scenario = thermo_scenario(config)
+                scenario.simulate(3, 0.05)
+                scenario.verify(3, 0.05)
+                usage[config.spill_dir] = scenario.memory_usage()
+            self.assertEqual(usage[spill_dir]['traces'], 0)
+            self.assertGreater(usage[None]['traces'], 0)
+            for cache in ['sim_cache', 'tube_cache', 'trans_cache']:
+                self.assertEqual(usage[spill_dir][cache], usage[None][cache])
+            self.assertGreater(usage[spill_dir]['sim_cache'], 0)
+
+    def test_spilled_traces(self):
+        with tempfile.TemporaryDirectory() as spill_dir:
+            node_traces = {'a': [[0.0, 1.0], [0.1, 2.0]], 'b': np.array([[0.0, 3.0]])}
+            node = AnalysisTreeNode(trace=dict(node_traces), child=[])
+            node.spill(os.path.join(spill_dir, 'node0'))
+            self.assertIsInstance(node.trace, SpilledTraces)
+            self.assertEqual(node.trace['a'], node_traces['a'])
+            self.assertIsInstance(node.trace['b'], np.ndarray)
+            self.assertEqual(node.trace_nbytes(), 0)
+            node.trace['a'] = [[0.0, 5.0]]
+            self.assertEqual(node.trace['a'], [[0.0, 5.0]])
+            self.assertEqual(sorted(node.trace), ['a', 'b'])
+            pickled = pickle.loads(pickle.dumps(node.trace))
+            np.testing.assert_array_equal(pickled['b'], node_traces['b'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,135 @@
+import json
+import os
+import tempfile
+import unittest
+from collections import defaultdict
+
+from example_scenarios import thermo_scenario
+
+from verse.analysis.analysis_tree import AnalysisTreeNode
+from verse.analysis.verifier import Verifier
+from verse.scenario.scenario import ScenarioConfig
+
+
+def reach_node(lo, hi, start_time=1.0, mode=('ON',), static=()):
+    return AnalysisTreeNode(
+        trace={'t': [[start_time, lo, 0], [start_time + 1, hi, 0]]}, init={'t': [[[lo, 0], [hi, 0]]]},
+        mode={'t': list(mode)}, static={'t': list(static)}, uncertain_param={'t': []}, agent={}, child=[],
+        start_time=start_time, type='reachtube',
+    )
+
+
+class TestSubsume(unittest.TestCase):
+    def setUp(self):
+        self.verifier = Verifier(ScenarioConfig(subsume_nodes=True, merge_ratio=0.5))
+        self.node = reach_node(60, 70)
+        self.visited = defaultdict(list)
+        self.visited[Verifier.subsumption_key(self.node)].append(self.node)
+
+    def test_contained_node_is_dropped(self):
+        self.assertTrue(self.verifier.subsume(self.visited, set(), reach_node(62, 68)))
+        self.assertEqual((self.verifier.num_subsumed, self.verifier.num_merged), (1, 0))
+        self.assertEqual(self.node.init['t'], [[[60, 0], [70, 0]]])
+
+    def test_other_modes_times_and_parameters_are_kept(self):
+        for new_node in [reach_node(62, 68, mode=('OFF',)), reach_node(62, 68, start_time=2.0), reach_node(62, 68, static=('A',))]:
+            self.assertFalse(self.verifier.subsume(self.visited, set(), new_node))
+        self.assertEqual(self.verifier.num_subsumed, 0)
+
+    def test_queued_node_is_enlarged(self):
+        self.assertTrue(self.verifier.subsume(self.visited, set(), reach_node(65, 72)))
+        self.assertEqual(self.verifier.num_merged, 1)
+        self.assertEqual(self.node.init['t'], [[[60, 0], [72, 0]]])
+        self.assertNotIn('t', self.node.trace)
+
+    def test_merge_ratio_and_expanded_nodes(self):
+        # The hull is 25 wide, more than 1.5 times the widest of the boxes
+        self.assertFalse(self.verifier.subsume(self.visited, set(), reach_node(75, 85)))
+        self.assertFalse(self.verifier.subsume(self.visited, {id(self.node)}, reach_node(65, 72)))
+        self.assertEqual(self.node.init['t'], [[[60, 0], [70, 0]]])
+
+
+class TestFixedPoint(unittest.TestCase):
+    def test_cover(self):
+        verifier = Verifier(ScenarioConfig(detect_fixed_point=True))
+        node = reach_node(60, 70)
+        explored = defaultdict(list)
+        explored[Verifier.mode_key(node)].append(node)
+        # Later nodes starting inside its initial set are covered, earlier ones are not
+        later, earlier = reach_node(62, 68, start_time=3.0), reach_node(62, 68, start_time=0.5)
+        self.assertTrue(verifier.cover(explored, later))
+        self.assertFalse(verifier.cover(explored, earlier))
+        self.assertFalse(verifier.cover(explored, reach_node(62, 72, start_time=3.0)))
+        self.assertFalse(verifier.cover(explored, reach_node(62, 68, start_time=3.0, mode=('OFF',))))
+        self.assertEqual(verifier.covered, [(later, node)])
+
+    def test_periodic_thermostat_stops(self):
+        full = thermo_scenario().verify(6, 0.01)
+        scenario = thermo_scenario(ScenarioConfig(detect_fixed_point=True))
+        tree = scenario.verify(6, 0.01)
+        self.assertLess(len(tree.nodes), len(full.nodes))
+        self.assertEqual(json.dumps([n.to_dict() for n in tree.nodes], default=str),
+                         json.dumps([n.to_dict() for n in full.nodes[:len(tree.nodes)]], default=str))
+        # The covered node is an ON node inside the initial set of the root
+        (covered, by), = scenario.verifier.covered
+        self.assertIs(by, tree.root)
+        self.assertEqual(list(covered.mode['t']), ['ON'])
+
+
+class TestVerifyIter(unittest.TestCase):
+    def test_nodes_are_yielded_in_bfs_order(self):
+        full = thermo_scenario().verify(4, 0.01)
+        nodes = list(thermo_scenario().verify_iter(4, 0.01))
+        self.assertEqual(json.dumps([n.to_dict() for n in nodes], default=str), json.dumps([n.to_dict() for n in full.nodes], default=str))
+
+    def test_break_records_partial_tree(self):
+        scenario = thermo_scenario()
+        for node in scenario.verify_iter(4, 0.01):
+            if node.start_time > 1:
+                break
+        partial = scenario.past_runs[-1]
+        self.assertEqual([n.frontier for n in partial.nodes], [False, False, False, True])
+
+
+class TestVerifyBudget(unittest.TestCase):
+    def test_node_budget(self):
+        full = thermo_scenario().verify(4, 0.05)
+        partial = thermo_scenario().verify(4, 0.05, node_budget=2)
+        self.assertEqual([n.frontier for n in partial.nodes], [False, False, True])
+        self.assertEqual(json.dumps(partial.nodes[1].to_dict(), default=str), json.dumps(full.nodes[1].to_dict(), default=str))
+
+    def test_time_budget(self):
+        # The budget is checked after each node, so the root is always computed
+        partial = thermo_scenario().verify(4, 0.05, time_budget=0)
+        self.assertEqual([n.frontier for n in partial.nodes], [False, True])
+
+
+class TestCheckpoint(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.path = os.path.join(tmp.name, 'verify.pkl')
+
+    def interrupted(self, num_nodes, **config):
+        scenario = thermo_scenario(ScenarioConfig(checkpoint_file=self.path, checkpoint_interval=0, **config))
+        for i, node in enumerate(scenario.verify_iter(6, 0.05)):
+            if i + 1 == num_nodes:
+                break
+        self.assertTrue(os.path.exists(self.path))
+
+    def test_resume_matches_full_run(self):
+        for config in [{}, {'incremental': True}]:
+            full = json.dumps(thermo_scenario(ScenarioConfig(**config)).verify(6, 0.05).to_dict(), default=str)
+            for num_nodes in [1, 3]:
+                self.interrupted(num_nodes, **config)
+                resumed = thermo_scenario(ScenarioConfig(**config)).verify(6, 0.05, resume_from=self.path)
+                self.assertEqual(json.dumps(resumed.to_dict(), default=str), full, msg=f"{config} {num_nodes}")
+
+    def test_other_horizon_is_refused(self):
+        self.interrupted(2)
+        with self.assertRaises(ValueError):
+            thermo_scenario().verify(5, 0.05, resume_from=self.path)
+
+
+if __name__ == '__main__':
+    unittest.main()
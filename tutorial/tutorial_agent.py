@@ -8,7 +8,7 @@ import torch
 from tutorial_utils import drone_params
 from verse import BaseAgent
 from verse import LaneMap
-from verse.map.lane_map_3d import LaneMap_3d
+from verse.map.lane_map_3d import LaneMap_3d, WaypointTracker
 
 class CarAgent(BaseAgent):
     def __init__(self, id, code = None, file_name = None, initial_state = None, initial_mode = None):
@@ -113,17 +113,17 @@ class DroneAgent(BaseAgent):
         dref_z = bz
         return [dref_x, dref_y, dref_z, dx, dy, dz, dvx, dvy, dvz]
 
-    def action_handler(self, mode, state, track_map: LaneMap_3d):
+    def action_handler(self, mode, state, track_map: LaneMap_3d, tracker: WaypointTracker):
         # if mode[0] == 'Normal':
         df = 0
-        if track_map.check_guard_box(self.id, state[3:9], self.box_side):
+        if track_map.check_guard_box(tracker, state[3:9], self.box_side):
             # track_map.get_next_point(mode[1], self.id, state[3:6])
             df = 1
         # else:
         #     raise ValueError
         return df
 
-    def runModel(self, mode,  initalCondition, time_bound, time_step, ref_input, track_map: LaneMap_3d):
+    def runModel(self, mode,  initalCondition, time_bound, time_step, ref_input, track_map: LaneMap_3d, tracker: WaypointTracker):
         # path = os.path.abspath(__file__)
         # path = path.replace('quadrotor_agent.py', 'prarm.json')
         # # print(path)
@@ -201,7 +201,7 @@ class DroneAgent(BaseAgent):
             idx = np.argmax(res)
             u = control_input_list[idx] + ref_input[0:3] + [sc]
 
-            df = self.action_handler(mode, init, track_map)
+            df = self.action_handler(mode, init, track_map, tracker)
 
             u = u+[df]
             init = trajectory[i]  # len 9
@@ -231,21 +231,22 @@ class DroneAgent(BaseAgent):
         traces = []
         end_time = 0
         time_limit = self.t_v_pair[0]
+        tracker = WaypointTracker()
         mode_parameters = track_map.get_next_point(
-                track_map.trans_func(mode[1]), self.id, np.array(initialCondition[:3]), np.array(initialCondition[3:6]), self.t_v_pair)
+                track_map.trans_func(mode[1]), tracker, np.array(initialCondition[:3]), np.array(initialCondition[3:6]), self.t_v_pair)
         while time_bound > end_time:
             ref_vx = (mode_parameters[3] - mode_parameters[0]) / time_limit
             ref_vy = (mode_parameters[4] - mode_parameters[1]) / time_limit
             ref_vz = (mode_parameters[5] - mode_parameters[2]) / time_limit
             sym_rot_angle = 0
             trace = self.runModel(mode, mode_parameters[0:3] + list(initialCondition), min(time_limit, time_bound-end_time), time_step, [ref_vx, ref_vy, ref_vz,
-                                                                                                                                         sym_rot_angle], track_map)
+                                                                                                                                         sym_rot_angle], track_map, tracker)
             for p in trace:
                 p[0] = round(p[0]+end_time, 4)
             end_time = trace[-1][0]
             initialCondition = trace[-1][1:]
             mode_parameters = track_map.get_next_point(
-                track_map.trans_func(mode[1]), self.id,  None, np.array(initialCondition[3:6]), self.t_v_pair)
+                track_map.trans_func(mode[1]), tracker,  None, np.array(initialCondition[3:6]), self.t_v_pair)
             if round(trace[0][0]-0, 4) != 0:
                 trace = trace[1:]
             traces.extend(trace)
@@ -1,5 +1,6 @@
 # Example agent.
 from typing import Tuple, List
+import functools
 import json
 import os
 import numpy as np
@@ -8,7 +9,7 @@ import torch
 import math
 from verse.agents import BaseAgent
 from verse.map import LaneMap
-from verse.map.lane_map_3d import LaneMap_3d
+from verse.map.lane_map_3d import LaneMap_3d, WaypointTracker
 
 
 class FFNNC(torch.nn.Module):
@@ -25,6 +26,32 @@ class FFNNC(torch.nn.Module):
         return x
 
 
+PARAM_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'prarm.json')
+CONTROL_INPUTS = np.array([[-0.1, -0.1, 7.81],
+                           [-0.1, -0.1, 11.81],
+                           [-0.1, 0.1, 7.81],
+                           [-0.1, 0.1, 11.81],
+                           [0.1, -0.1, 7.81],
+                           [0.1, -0.1, 11.81],
+                           [0.1, 0.1, 7.81],
+                           [0.1, 0.1, 11.81]])
+
+
+@functools.lru_cache(maxsize=None)
+def load_controller(path=PARAM_PATH) -> FFNNC:
+    """
+    The tracking controller with the weights stored in path. It is only read once per process and
+    shared by all the agents (and forked workers).
+    """
+    with open(path, 'r') as f:
+        prarms = json.load(f)
+    controller = FFNNC()
+    for i, layer in enumerate([controller.layer1, controller.layer2, controller.layer3], 1):
+        layer.weight = torch.nn.Parameter(torch.FloatTensor(prarms[f'weight{i}']), requires_grad=False)
+        layer.bias = torch.nn.Parameter(torch.FloatTensor(prarms[f'bias{i}']), requires_grad=False)
+    return controller.eval()
+
+
 class QuadrotorAgent(BaseAgent):
     def __init__(self, id, code=None, file_name=None, t_v_pair = [], box_side = []):
         super().__init__(id, code, file_name)
@@ -51,168 +78,113 @@ class QuadrotorAgent(BaseAgent):
         dref_z = bz
         return [dref_x, dref_y, dref_z, dx, dy, dz, dvx, dvy, dvz]
 
-    def action_handler(self, mode, state, lane_map: LaneMap_3d):
-        # if mode[0] == 'Normal':
-        df = 0
-        if lane_map.check_guard_box(self.id, state[3:9], self.box_side):
-            # lane_map.get_next_point(mode[1], self.id, state[3:6])
-            df = 1
-        # else:
-        #     raise ValueError
-        return df
-
-    def runModel(self, mode,  initalCondition, time_bound, time_step, ref_input, lane_map: LaneMap_3d):
-        path = os.path.abspath(__file__)
-        path = path.replace('quadrotor_agent.py', 'prarm.json')
-        # print(path)
-        with open(path, 'r') as f:
-            prarms = json.load(f)
-        bias1 = prarms['bias1']
-        bias2 = prarms['bias2']
-        bias3 = prarms['bias3']
-        weight1 = prarms['weight1']
-        weight2 = prarms['weight2']
-        weight3 = prarms['weight3']
-
-        bias1 = torch.FloatTensor(bias1)
-        bias2 = torch.FloatTensor(bias2)
-        bias3 = torch.FloatTensor(bias3)
-        weight1 = torch.FloatTensor(weight1)
-        weight2 = torch.FloatTensor(weight2)
-        weight3 = torch.FloatTensor(weight3)
-        controller = FFNNC()
-        controller.layer1.weight = torch.nn.Parameter(weight1)
-        controller.layer2.weight = torch.nn.Parameter(weight2)
-        controller.layer3.weight = torch.nn.Parameter(weight3)
-        controller.layer1.bias = torch.nn.Parameter(bias1)
-        controller.layer2.bias = torch.nn.Parameter(bias2)
-        controller.layer3.bias = torch.nn.Parameter(bias3)
-        control_input_list = [[-0.1, -0.1, 7.81],
-                              [-0.1, -0.1, 11.81],
-                              [-0.1, 0.1, 7.81],
-                              [-0.1, 0.1, 11.81],
-                              [0.1, -0.1, 7.81],
-                              [0.1, -0.1, 11.81],
-                              [0.1, 0.1, 7.81],
-                              [0.1, 0.1, 11.81]]
-        init = initalCondition
-        trajectory = [init]
+    def action_handler(self, mode, states, waypoints) -> np.ndarray:
+        """
+        For each run, 1 if its position (columns 3 to 5 of states) is in the box of side box_side
+        centered on the waypoint it tracks, 0 otherwise.
+        """
+        dest = np.array([wp[3:] for wp in waypoints])
+        return np.all(np.abs(states[:, 3:6] - dest) <= np.array(self.box_side) / 2, axis=1).astype(float)
+
+    def runModel(self, mode,  initalCondition, time_bound, time_step, ref_input, lane_map: LaneMap_3d, tracker: WaypointTracker):
+        return self.runModel_batch(mode, [initalCondition], time_bound, time_step, [ref_input], lane_map, [tracker.curr_wp])[0]
+
+    def runModel_batch(self, mode, initalConditions, time_bound, time_step, ref_inputs, lane_map: LaneMap_3d, waypoints):
+        """
+        Simulate one tracking segment from each of the initial conditions in lockstep, so that the
+        controller is evaluated once per step for the whole batch. waypoints holds the waypoint tracked
+        by each run.
+        """
+        controller = load_controller()
+        ref_input = np.array([ref[:3] for ref in ref_inputs])
+        sc = np.array([ref[3] for ref in ref_inputs])  # math.atan2(dot, det)
+        cos_sc = np.array([math.cos(a) for a in sc])
+        sin_sc = np.array([math.sin(a) for a in sc])
+        init = np.array(initalConditions, dtype=float)
+        curr = init
         r = ode(self.dynamic)
-        # r.set_initial_value(init)
-        ex_list = []
-        ey_list = []
-        ez_list = []
         t = 0
-        time = [t]
-        trace = [[t]]
-        trace[0].extend(init[3:])
+        traces = [[[t] + list(cond[3:])] for cond in initalConditions]
         i = 0
-        df = 0
-        while (t < time_bound) or df != 1:
-            ex = trajectory[i][3] - trajectory[i][0]
-            ey = trajectory[i][4] - trajectory[i][1]
-            ez = trajectory[i][5] - trajectory[i][2]
-            # if self.id == 'test1':
-            #     print([t, ex, ey, ez, trajectory[i][0],
-            #           trajectory[i][1], trajectory[i][2]])
-            evx = trajectory[i][6] - ref_input[0]
-            evy = trajectory[i][7] - ref_input[1]
-            evz = trajectory[i][8] - ref_input[2]
-
-            sc = ref_input[3]  # math.atan2(dot, det)
-
-            tmp1 = ex * math.cos(sc) - ey * math.sin(sc)
-            tmp2 = ex * math.sin(sc) + ey * math.cos(sc)
-            ex = tmp1
-            ey = tmp2
-
-            tmp1 = evx * math.cos(sc) - evy * math.sin(sc)
-            tmp2 = evx * math.sin(sc) + evy * math.cos(sc)
-            evx = tmp1
-            evy = tmp2
-
-            data = torch.FloatTensor(
-                [0.2 * ex, 0.2 * ey, 0.2 * ez, 0.1 * evx, 0.1 * evy, 0.1 * evz])
-            res = controller(data)
-            res = res.detach().numpy()
-            idx = np.argmax(res)
-            u = control_input_list[idx] + ref_input[0:3] + [sc]
-
-            df = self.action_handler(mode, init, lane_map)
-
-            u = u+[df]
-            init = trajectory[i]  # len 9
-            r = ode(self.dynamic)
-            r.set_initial_value(init)
-            r.set_f_params(u)
-            val = r.integrate(r.t + time_step)
+        df = np.zeros(len(initalConditions))
+        while (t < time_bound) or np.any(df != 1):
+            ex, ey, ez = (curr[:, 3:6] - curr[:, 0:3]).T
+            evx, evy, evz = (curr[:, 6:9] - ref_input).T
+
+            ex, ey = ex * cos_sc - ey * sin_sc, ex * sin_sc + ey * cos_sc
+            evx, evy = evx * cos_sc - evy * sin_sc, evx * sin_sc + evy * cos_sc
+
+            data = torch.from_numpy(np.stack([0.2 * ex, 0.2 * ey, 0.2 * ez, 0.1 * evx, 0.1 * evy, 0.1 * evz], axis=1)).float()
+            with torch.inference_mode():
+                res = controller(data).numpy()
+            idx = np.argmax(res, axis=1)
+
+            df = self.action_handler(mode, init, waypoints)
+            u = np.hstack([CONTROL_INPUTS[idx], ref_input, sc[:, None], df[:, None]])
+            init = curr  # len 9
+            vals = []
+            for k in range(len(curr)):
+                r.set_initial_value(curr[k])
+                r.set_f_params(u[k].tolist())
+                vals.append(r.integrate(r.t + time_step))
 
             t = t+time_step
             if round(t-time_bound-time_step, 4) >= 0:
                 break
             i += 1
-            #  print(i,idx,u,res)
-            trajectory.append(val)
-            time.append(t)
-
-            ex_list.append(ex)
-            ey_list.append(ey)
-            ez_list.append(ez)
-            trace.append([t])
+            curr = np.array(vals)
             # remove the reference trajectory from the trace
-            trace[i].extend(val[3:])
-            # if self.id == 'test1':
-            #     print([t, trajectory[i][0], trajectory[i][1], trajectory[i][2]])
-            #     print('curr', val[3:6])
-        # print(trajectory)
-        return trace
-
-    def TC_simulate(self, mode: List[str], initialCondition, time_bound, time_step, lane_map: LaneMap_3d = None) -> np.ndarray:
-        # print("TC", initialCondition)
+            for trace, val in zip(traces, vals):
+                trace.append([t] + list(val[3:]))
+        return traces
+
+    def TC_simulate(self, mode: List[str], initialCondition, time_bound, time_step, lane_map: LaneMap_3d = None, tracker: WaypointTracker = None) -> np.ndarray:
+        return self.TC_simulate_batch(mode, [initialCondition], time_bound, time_step, lane_map, None if tracker is None else [tracker])[0]
+
+    def _next_points(self, mode, lane_map: LaneMap_3d, trackers, positions, velocities):
+        return [lane_map.get_next_point(lane_map.trans_func(mode[1]), tracker, pos, vel, self.t_v_pair)
+                for tracker, pos, vel in zip(trackers, positions, velocities)]
+
+    def TC_simulate_batch(self, mode: List[str], initialConditions, time_bound, time_step, lane_map: LaneMap_3d = None,
+                          trackers: List[WaypointTracker] = None) -> List[np.ndarray]:
+        """
+        Simulate from each of the initial conditions. The runs advance in lockstep so that the neural
+        controller is evaluated on the whole batch at once, while each run follows its own waypoints.
+        trackers holds the waypoint tracking state of each run, a fresh one is used for each run if
+        it's not given.
+        """
         # total time_bound remained
         time_bound = float(time_bound)
-        traces = []
+        traces = [[] for _ in initialConditions]
         end_time = 0
         time_limit = self.t_v_pair[0]
-        mode_parameters = lane_map.get_next_point(
-            lane_map.trans_func(mode[1]), self.id, np.array(initialCondition[:3]), np.array(initialCondition[3:6]), self.t_v_pair)
+        if trackers is None:
+            trackers = [WaypointTracker() for _ in initialConditions]
+        mode_parameters = self._next_points(mode, lane_map, trackers,
+                                            [np.array(cond[:3]) for cond in initialConditions],
+                                            [np.array(cond[3:6]) for cond in initialConditions])
         while time_bound > end_time:
-            ref_vx = (mode_parameters[3] - mode_parameters[0]) / time_limit
-            ref_vy = (mode_parameters[4] - mode_parameters[1]) / time_limit
-            ref_vz = (mode_parameters[5] - mode_parameters[2]) / time_limit
-            sym_rot_angle = 0
-            # if self.id == 'test1':
-            #     print('test', np.linalg.norm(
-            #         np.array([ref_vx, ref_vy, ref_vz])))
-            trace = self.runModel(mode, mode_parameters[0:3] + list(initialCondition), min(time_limit, time_bound-end_time), time_step, [ref_vx, ref_vy, ref_vz,
-                                                                                                                                         sym_rot_angle], lane_map)
-            # if lane_map.check_guard_box(self.id, np.array(trace[-1][1:])):
-            #     mode_parameters = lane_map.get_next_point(
-            #         mode[1], self.id, np.array(trace[-1][1:4]), np.array(trace[-1][4:7]))
-            # delta = np.array(trace)[:, 1:4]-mode_parameters[3:6]
-            # min_dis = float('inf')
-            # min_index = 0
-            # index = 0
-            # for a in delta:
-            #     dis = np.linalg.norm(a)
-            #     if min_dis > dis:
-            #         min_dis = dis
-            #         min_index = index
-            #     index += 1
-            # if self.id == 'test1':
-            #     print(index)
-            # trace = trace[:index]
-            for p in trace:
-                p[0] = round(p[0]+end_time, 4)
-            end_time = trace[-1][0]
-            initialCondition = trace[-1][1:]
-            mode_parameters = lane_map.get_next_point(
-                lane_map.trans_func(mode[1]), self.id,  None, np.array(initialCondition[3:6]), self.t_v_pair)
-            if round(trace[0][0]-0, 4) != 0:
-                trace = trace[1:]
-            traces.extend(trace)
-        # print([ref_vx, ref_vy, ref_vz, sym_rot_angle])
-        return np.array(traces)
+            ref_inputs = []
+            for params in mode_parameters:
+                ref_vx = (params[3] - params[0]) / time_limit
+                ref_vy = (params[4] - params[1]) / time_limit
+                ref_vz = (params[5] - params[2]) / time_limit
+                sym_rot_angle = 0
+                ref_inputs.append([ref_vx, ref_vy, ref_vz, sym_rot_angle])
+            segments = self.runModel_batch(mode, [params[0:3] + list(cond) for params, cond in zip(mode_parameters, initialConditions)],
+                                           min(time_limit, time_bound-end_time), time_step, ref_inputs, lane_map, mode_parameters)
+            for trace in segments:
+                for p in trace:
+                    p[0] = round(p[0]+end_time, 4)
+            end_time = segments[0][-1][0]
+            initialConditions = [trace[-1][1:] for trace in segments]
+            mode_parameters = self._next_points(mode, lane_map, trackers, [None] * len(segments),
+                                                [np.array(cond[3:6]) for cond in initialConditions])
+            for k, trace in enumerate(segments):
+                if round(trace[0][0]-0, 4) != 0:
+                    trace = trace[1:]
+                traces[k].extend(trace)
+        return [np.array(trace) for trace in traces]
 
 # import json
 # import os
@@ -1,5 +1,8 @@
 from .analysis_tree import *
 from .simulator import Simulator
 from .verifier import Verifier
+from .boxset import BoxSet, TreeBoxes
+from .safety import UnsafeSet, Violation, check_unsafe
+from .collision import Contact, potential_collisions
 
-from . import simulator, verifier, analysis_tree
+from . import simulator, verifier, analysis_tree, boxset, safety, collision
@@ -1,7 +1,72 @@
-from typing import List, Dict, Any
+from typing import List, Dict, Any, Optional, Tuple
+from collections import defaultdict
+from collections.abc import MutableMapping
+from bisect import bisect_left, bisect_right
+import copy
 import json
+import shutil
+import tempfile
+import weakref
+import numpy as np
+from intervaltree import IntervalTree
 from treelib import Tree
 
+from verse.analysis.utils import REF_BYTES, STR_BYTES, trace_nbytes
+
+# Object, attribute dicts and the per agent dicts of a node
+NODE_BYTES = 1500
+
+class SpillDirectory:
+    """Temporary directory for spilled traces, removed with everything in it once the object is garbage
+    collected, or at exit"""
+    def __init__(self, prefix: Optional[str] = None, dir: Optional[str] = None):
+        self.name = tempfile.mkdtemp(prefix=prefix, dir=dir)
+        self._finalizer = weakref.finalize(self, shutil.rmtree, self.name, ignore_errors=True)
+
+class SpilledTraces(MutableMapping):
+    """Traces of a node that were written to disk by AnalysisTreeNode.spill. Each trace is read back from its
+    .npy file when accessed, as a list or an array like the original, and is not kept in memory. Assigned traces
+    are kept in memory. The SpillDirectory holding the files, if given, is removed once no SpilledTraces
+    refer to it anymore. Pickling only saves the file names, so the files must then be kept for as
+    long as the unpickled nodes are used."""
+    def __init__(self, paths: Dict[str, str], as_list: Dict[str, bool], traces: Optional[Dict] = None, directory: Optional[SpillDirectory] = None):
+        self.paths = paths
+        self.as_list = as_list
+        self.traces = dict(traces) if traces is not None else {}
+        self.directory = directory
+
+    def __getstate__(self):
+        state = dict(self.__dict__)
+        state['directory'] = None
+        return state
+
+    def __deepcopy__(self, memo):
+        # Copies read the same files, so they keep the directory too
+        return SpilledTraces(dict(self.paths), dict(self.as_list), copy.deepcopy(self.traces, memo), self.directory)
+
+    def __getitem__(self, agent_id):
+        if agent_id in self.traces:
+            return self.traces[agent_id]
+        trace = np.load(self.paths[agent_id])
+        return trace.tolist() if self.as_list[agent_id] else trace
+
+    def __setitem__(self, agent_id, trace):
+        self.paths.pop(agent_id, None)
+        self.traces[agent_id] = trace
+
+    def __delitem__(self, agent_id):
+        if agent_id in self.traces:
+            del self.traces[agent_id]
+        else:
+            del self.paths[agent_id]
+
+    def __iter__(self):
+        yield from self.paths
+        yield from self.traces
+
+    def __len__(self):
+        return len(self.paths) + len(self.traces)
+
 class AnalysisTreeNode:
     """AnalysisTreeNode class
     A AnalysisTreeNode stores the continous execution of the system without transition happening"""
@@ -21,9 +86,11 @@ class AnalysisTreeNode:
         assert_hits={},
         child=[],
         start_time = 0,
+        height = 0,
         ndigits = 10,
         type = 'simtrace',
-        id = 0
+        id = 0,
+        frontier = False
     ):
         self.trace:Dict = trace
         self.init: Dict[str, List[float]] = init
@@ -31,11 +98,14 @@ class AnalysisTreeNode:
         self.agent: Dict = agent
         self.child: List[AnalysisTreeNode] = child
         self.start_time: float = round(start_time, ndigits)
+        self.height: int = height
         self.assert_hits = assert_hits
         self.type: str = type
         self.static: Dict[str, List[str]] = static
         self.uncertain_param: Dict[str, List[str]] = uncertain_param
         self.id: int = id
+        # True for nodes that were created but never computed, because the run was stopped early
+        self.frontier: bool = frontier
 
     def to_dict(self):
         rst_dict = {
@@ -47,10 +117,12 @@ class AnalysisTreeNode:
             'mode': self.mode, 
             'static': self.static, 
             'start_time': self.start_time,
-            'trace': self.trace, 
+            'trace': dict(self.trace), 
             'type': self.type, 
             'assert_hits': self.assert_hits
         }
+        if self.frontier:
+            rst_dict['frontier'] = True
         agent_dict = {}
         for agent_id in self.agent:
             agent_dict[agent_id] = f'{type(self.agent[agent_id])}'
@@ -58,6 +130,41 @@ class AnalysisTreeNode:
 
         return rst_dict
 
+    def trace_nbytes(self) -> int:
+        """Approximate bytes held by the traces of the node that are in memory"""
+        if isinstance(self.trace, SpilledTraces):
+            return sum(trace_nbytes(trace) for trace in self.trace.traces.values())
+        return sum(trace_nbytes(trace) for trace in self.trace.values())
+
+    def spill(self, prefix: str, directory: Optional[SpillDirectory] = None):
+        """Write the traces of the node to prefix + "_<i>.npy" files, one per agent, and replace them by
+        SpilledTraces. Traces that can't be stored as a numeric array are kept in memory. directory is the
+        SpillDirectory the files are in, which the node keeps from being removed."""
+        if isinstance(self.trace, SpilledTraces):
+            return
+        paths, as_list, traces = {}, {}, {}
+        for i, (agent_id, trace) in enumerate(self.trace.items()):
+            try:
+                array = np.asarray(trace)
+            except ValueError:
+                array = None
+            if array is None or array.dtype == object:
+                traces[agent_id] = trace
+                continue
+            paths[agent_id] = f"{prefix}_{i}.npy"
+            as_list[agent_id] = not isinstance(trace, np.ndarray)
+            np.save(paths[agent_id], array)
+        self.trace = SpilledTraces(paths, as_list, traces, directory)
+
+    def meta_nbytes(self) -> int:
+        """Approximate bytes held by the rest of the node: initial sets, modes and so on"""
+        size = NODE_BYTES
+        for agent_id, init in self.init.items():
+            size += trace_nbytes(init)
+            size += len(self.mode.get(agent_id, ())) * (REF_BYTES + STR_BYTES)
+            size += len(self.static.get(agent_id, ())) * (REF_BYTES + STR_BYTES)
+        return size
+
     def get_track(self, agent_id, D):
         if 'TrackMode' not in self.agent[agent_id].decision_logic.mode_defs:
             return ""
@@ -92,12 +199,76 @@ class AnalysisTreeNode:
             child = [],
             start_time = data['start_time'],
             type = data['type'],
+            frontier = data.get('frontier', False),
         )
 
+class _Column:
+    """Read only view of the times of a trace, every step-th row starting from offset, for bisect"""
+    def __init__(self, trace, offset=0, step=1):
+        self.trace = trace
+        self.offset = offset
+        self.step = step
+
+    def __len__(self):
+        return (len(self.trace) - self.offset + self.step - 1) // self.step
+
+    def __getitem__(self, i):
+        return self.trace[self.offset + i * self.step][0]
+
 class AnalysisTree:
     def __init__(self, root):
         self.root:AnalysisTreeNode = root
         self.nodes:List[AnalysisTreeNode] = self.get_all_nodes(root)
+        self._by_id: Dict[int, AnalysisTreeNode] = {node.id: node for node in self.nodes}
+        # Built on first use, as they need the traces
+        self._by_mode: Optional[Dict[Tuple[str, Tuple[str, ...]], List[AnalysisTreeNode]]] = None
+        self._by_time: Optional[Dict[str, IntervalTree]] = None
+
+    def get_node(self, node_id: int) -> Optional[AnalysisTreeNode]:
+        return self._by_id.get(node_id)
+
+    def nodes_in_mode(self, agent_id: str, mode) -> List[AnalysisTreeNode]:
+        """Nodes in which the agent is in the given mode, a tuple like node.mode[agent_id]"""
+        if self._by_mode is None:
+            self._by_mode = defaultdict(list)
+            for node in self.nodes:
+                for aid, node_mode in node.mode.items():
+                    self._by_mode[aid, tuple(node_mode)].append(node)
+        return self._by_mode.get((agent_id, tuple(mode)), [])
+
+    def nodes_at(self, agent_id: str, time: float) -> List[AnalysisTreeNode]:
+        """Nodes whose trace of the agent covers the given time, across all branches, in the order of self.nodes"""
+        if self._by_time is None:
+            self._by_time = defaultdict(IntervalTree)
+            for node in self.nodes:
+                for aid, trace in node.trace.items():
+                    if len(trace) > 0:
+                        # The intervals of an IntervalTree exclude their end, and can't be empty
+                        self._by_time[aid].addi(trace[0][0], np.nextafter(trace[-1][0], np.inf), node)
+        if agent_id not in self._by_time:
+            return []
+        return sorted((interval.data for interval in self._by_time[agent_id].at(time)), key=lambda node: node.id)
+
+    def boxes_at(self, agent_id: str, time: float) -> List[Tuple[AnalysisTreeNode, Any]]:
+        """
+        States of the agent at the given time across all branches, as (node, rows) pairs. For reachtubes the
+        rows are the lower and upper corners of each rectangle whose time interval contains the time, for
+        simulations the rows whose time is the given one. Rows include the time in their first column.
+        """
+        res = []
+        for node in self.nodes_at(agent_id, time):
+            trace = node.trace[agent_id]
+            if node.type == 'reachtube':
+                # Rectangle i spans from the time of row 2i to the one of row 2i+1
+                lo = bisect_left(_Column(trace, 1, 2), time)
+                hi = bisect_right(_Column(trace, 0, 2), time)
+                for i in range(lo, hi):
+                    res.append((node, [trace[2 * i], trace[2 * i + 1]]))
+            else:
+                times = _Column(trace)
+                for i in range(bisect_left(times, time), bisect_right(times, time)):
+                    res.append((node, [trace[i]]))
+        return res
 
     def get_all_nodes(self, root: AnalysisTreeNode) -> List[AnalysisTreeNode]:
         # Perform BFS/DFS to store all the tree node in a list
@@ -113,6 +284,11 @@ class AnalysisTree:
         return res
 
     def dump(self, fn):
+        res_dict = self.to_dict()
+        with open(fn,'w+') as f:           
+            json.dump(res_dict,f, indent=4, sort_keys=True)
+
+    def to_dict(self) -> Dict[int, Dict]:
         res_dict = {}
         converted_node = self.root.to_dict()
         res_dict[self.root.id] = converted_node
@@ -125,15 +301,18 @@ class AnalysisTree:
                 res_dict[child_node.id] = node_dict 
                 res_dict[parent_node.id]['child'].append(child_node.id)
                 queue.append(child_node)
-
-        with open(fn,'w+') as f:           
-            json.dump(res_dict,f, indent=4, sort_keys=True)
+        return res_dict
 
     @staticmethod 
     def load(fn):
         f = open(fn, 'r')
         data = json.load(f)
         f.close()
+        return AnalysisTree.from_dict(data)
+
+    @staticmethod
+    def from_dict(data) -> "AnalysisTree":
+        data = {str(k): v for k, v in data.items()}
         root_node_dict = data[str(0)]
         root = AnalysisTreeNode.from_dict(root_node_dict)
         queue = [(root_node_dict, root)]
@@ -0,0 +1,145 @@
+from typing import Tuple, Union
+
+import numpy as np
+
+class BoxSet:
+    """
+    A set of n hyper-rectangles in d dimensions, stored as an (n, 2, d) array where data[i, 0] is the lower
+    corner of box i and data[i, 1] its upper corner. It can be built from a single [lo, hi] box like the
+    initial sets, from a list of such boxes like node.init[agent_id], or with from_tube from a reachtube
+    trace, where the lower and upper corners are interleaved rows (with the time in the first column).
+    from_trace also takes simulation traces, whose points are boxes of zero width.
+    """
+    __slots__ = ('data',)
+
+    def __init__(self, boxes):
+        data = boxes.data if isinstance(boxes, BoxSet) else np.asarray(boxes, dtype=float)
+        if data.ndim == 2:
+            data = data[np.newaxis]
+        if data.ndim != 3 or data.shape[1] != 2:
+            raise ValueError(f"expected boxes of shape (n, 2, d), got {data.shape}")
+        self.data: np.ndarray = data
+
+    @staticmethod
+    def from_tube(trace) -> "BoxSet":
+        """The rectangles of a reachtube trace. A trailing row without its upper corner is dropped."""
+        trace = np.asarray(trace, dtype=float)
+        num_rect = len(trace) // 2
+        dim = trace.shape[1] if trace.ndim == 2 else 0
+        return BoxSet(trace[:num_rect * 2].reshape(num_rect, 2, dim))
+
+    @staticmethod
+    def from_trace(trace, reach: bool) -> "BoxSet":
+        """The rectangles of a reachtube trace if reach, otherwise a box of zero width at each point of a simulation trace"""
+        if reach:
+            return BoxSet.from_tube(trace)
+        trace = np.asarray(trace, dtype=float)
+        dim = trace.shape[1] if trace.ndim == 2 else 0
+        trace = trace.reshape(len(trace), dim)
+        return BoxSet(np.stack([trace, trace], axis=1))
+
+    def to_tube(self) -> np.ndarray:
+        return self.data.reshape(-1, self.dim)
+
+    def tolist(self):
+        return self.data.tolist()
+
+    @property
+    def lo(self) -> np.ndarray:
+        return self.data[:, 0]
+
+    @property
+    def hi(self) -> np.ndarray:
+        return self.data[:, 1]
+
+    @property
+    def dim(self) -> int:
+        return self.data.shape[2]
+
+    def __len__(self):
+        return len(self.data)
+
+    def __getitem__(self, idx) -> "BoxSet":
+        return BoxSet(self.data[idx])
+
+    def __repr__(self):
+        return f"BoxSet({self.data.tolist()})"
+
+    def widths(self) -> np.ndarray:
+        return self.hi - self.lo
+
+    def intervals(self) -> np.ndarray:
+        """(n, d, 2) array of the (low, high) interval of each box in each dimension"""
+        return self.data.transpose(0, 2, 1)
+
+    def hull(self) -> "BoxSet":
+        """The smallest box containing all the boxes"""
+        return BoxSet(np.stack([self.lo.min(axis=0), self.hi.max(axis=0)]))
+
+    def union(self, other: "BoxSet") -> "BoxSet":
+        return BoxSet(np.concatenate([self.data, BoxSet(other).data]))
+
+    def bloat(self, eps: Union[float, np.ndarray]) -> "BoxSet":
+        """Grow every box by eps, a scalar or one value per dimension, on each side"""
+        return BoxSet(self.data + np.stack([-np.asarray(eps), np.asarray(eps)]).reshape(1, 2, -1))
+
+    def contains(self, other: "BoxSet") -> np.ndarray:
+        """For each box of other, whether it is contained in one of the boxes of this set"""
+        other = BoxSet(other)
+        inside = (self.lo[np.newaxis] <= other.lo[:, np.newaxis]) & (other.hi[:, np.newaxis] <= self.hi[np.newaxis])
+        return inside.all(axis=2).any(axis=1)
+
+    def overlaps(self, other: "BoxSet") -> np.ndarray:
+        """(len(self), len(other)) matrix of which boxes intersect, including boxes that only touch"""
+        other = BoxSet(other)
+        touching = (self.lo[:, np.newaxis] <= other.hi[np.newaxis]) & (other.lo[np.newaxis] <= self.hi[:, np.newaxis])
+        return touching.all(axis=2)
+
+    def intersection(self, other: "BoxSet") -> "BoxSet":
+        """Intersection of box i of this set with box i of other (or with its only box). Check is_empty for the
+        boxes that don't intersect."""
+        other = BoxSet(other)
+        return BoxSet(np.stack([np.maximum(self.lo, other.lo), np.minimum(self.hi, other.hi)], axis=1))
+
+    def is_empty(self) -> np.ndarray:
+        return np.any(self.lo > self.hi, axis=1)
+
+    def time_slice(self, start: float, end: float, dim: int = 0) -> "BoxSet":
+        """Boxes whose interval in dim, the time for boxes of a reachtube, overlaps [start, end]"""
+        return self[(self.lo[:, dim] <= end) & (start <= self.hi[:, dim])]
+
+
+class TreeBoxes:
+    """
+    The boxes of one agent in every node of a tree (see BoxSet.from_trace), stacked in the order of tree.nodes:
+    lower and upper corners without the time, start and end times, and the node index and trace row of each box.
+    """
+    def __init__(self, tree, agent_id: str):
+        lo, hi, times, ends, nodes, rows = [], [], [], [], [], []
+        for node_idx, node in enumerate(tree.nodes):
+            if agent_id not in node.trace or len(node.trace[agent_id]) == 0:
+                continue
+            reach = node.type == 'reachtube'
+            boxes = BoxSet.from_trace(node.trace[agent_id], reach).data
+            lo.append(boxes[:, 0, 1:])
+            hi.append(boxes[:, 1, 1:])
+            times.append(boxes[:, 0, 0])
+            ends.append(boxes[:, 1, 0])
+            nodes.append(np.full(len(boxes), node_idx))
+            rows.append(np.arange(len(boxes)) * (2 if reach else 1))
+        if lo:
+            self.lo, self.hi, self.times, self.ends = np.concatenate(lo), np.concatenate(hi), np.concatenate(times), np.concatenate(ends)
+            self.nodes, self.rows = np.concatenate(nodes), np.concatenate(rows)
+        else:
+            self.lo = self.hi = np.empty((0, 0))
+            self.times, self.ends = np.empty(0), np.empty(0)
+            self.nodes, self.rows = np.empty(0, dtype=int), np.empty(0, dtype=int)
+
+    def __len__(self):
+        return len(self.times)
+
+    def align(self, other: "TreeBoxes") -> Tuple[np.ndarray, np.ndarray]:
+        """Indices of the boxes of both agents that are at the same row of the same node"""
+        key = lambda boxes: boxes.nodes * (max(self.rows.max(initial=0), other.rows.max(initial=0)) + 1) + boxes.rows
+        _, ind, other_ind = np.intersect1d(key(self), key(other), assume_unique=True, return_indices=True)
+        return ind, other_ind
@@ -0,0 +1,93 @@
+from dataclasses import dataclass
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from verse.analysis.analysis_tree import AnalysisTree, AnalysisTreeNode
+from verse.analysis.boxset import TreeBoxes
+
+@dataclass
+class Contact:
+    """A time window during which the rectangles (or points) of two agents in a node may be closer than the margin"""
+    agents: Tuple[str, str]
+    node: AnalysisTreeNode
+    start: float
+    end: float
+
+def _range_pairs(starts: np.ndarray, ends: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    # All the (i, j) with starts[i] <= j < ends[i]
+    counts = np.maximum(ends - starts, 0)
+    first = np.repeat(np.arange(len(starts)), counts)
+    offsets = np.repeat(np.cumsum(counts) - counts, counts)
+    second = np.arange(counts.sum()) - offsets + np.repeat(starts, counts)
+    return first, second
+
+def _sweep(agent: np.ndarray, t0: np.ndarray, t1: np.ndarray, lo: np.ndarray, hi: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Pairs of boxes of different agents that overlap in time and in every dimension. The time is cut into slices
+    at the start times of the boxes, and the boxes of each slice are swept along the first dimension: once sorted
+    by their lower bound, the boxes that may overlap a box are the ones after it up to its upper bound.
+    """
+    slices = np.unique(t0)
+    first_slice = np.searchsorted(slices, t0, 'left')
+    last_slice = np.maximum(np.searchsorted(slices, t1, 'left'), first_slice + 1)
+    box, slice_idx = _range_pairs(first_slice, last_slice)
+    # Offset the slices so that they don't overlap along the first dimension, then sweep all of them at once
+    width = hi[:, 0].max() - lo[:, 0].min() + 1
+    key_lo = slice_idx * width + (lo[box, 0] - lo[:, 0].min())
+    key_hi = slice_idx * width + (hi[box, 0] - lo[:, 0].min())
+    order = np.argsort(key_lo, kind='stable')
+    box, key_lo, key_hi = box[order], key_lo[order], key_hi[order]
+    ends = np.searchsorted(key_lo, key_hi, 'right')
+    i, j = _range_pairs(np.arange(len(box)) + 1, ends)
+    i, j = box[i], box[j]
+    keep = (agent[i] != agent[j]) & np.all((lo[i] <= hi[j]) & (lo[j] <= hi[i]), axis=1)
+    keep &= (np.maximum(t0[i], t0[j]) < np.minimum(t1[i], t1[j])) | (t0[i] == t0[j])
+    i, j = i[keep], j[keep]
+    # A pair found in several slices is reported once, with the lower agent first
+    swap = agent[i] > agent[j]
+    i, j = np.where(swap, j, i), np.where(swap, i, j)
+    pairs = np.unique(np.stack([i, j], axis=1), axis=0) if len(i) > 0 else np.empty((0, 2), dtype=int)
+    return pairs[:, 0], pairs[:, 1]
+
+def potential_collisions(tree: AnalysisTree, dims: Sequence[int], margin: float = 0.0, agents: Optional[Sequence[str]] = None) -> List[Contact]:
+    """
+    Find the pairs of agents whose rectangles (or points, for simulations) may come closer than margin in every one
+    of dims, state dimensions without the time, e.g. (0, 1) for x and y. Only rectangles of the same node are
+    compared, as different nodes are different branches or different times. Returns one Contact per agent pair
+    and time window in a node, sorted by start time.
+    """
+    if agents is None:
+        agents = list(tree.root.agent)
+    dims = list(dims)
+    rects = [TreeBoxes(tree, agent_id) for agent_id in agents]
+    # Boxes of all the agents, bloated by half the margin on each side
+    agent = np.concatenate([np.full(len(r.times), k) for k, r in enumerate(rects)])
+    node = np.concatenate([r.nodes for r in rects])
+    t0 = np.concatenate([r.times for r in rects])
+    t1 = np.concatenate([r.ends for r in rects])
+    lo = np.concatenate([r.lo[:, dims] for r in rects if len(r.times) > 0] or [np.empty((0, len(dims)))]) - margin / 2
+    hi = np.concatenate([r.hi[:, dims] for r in rects if len(r.times) > 0] or [np.empty((0, len(dims)))]) + margin / 2
+
+    res = []
+    order = np.argsort(node, kind='stable')
+    node_ids, starts = np.unique(node[order], return_index=True)
+    for node_idx, box in zip(node_ids, np.split(order, starts[1:])):
+        i, j = _sweep(agent[box], t0[box], t1[box], lo[box], hi[box])
+        i, j = box[i], box[j]
+        start, end = np.maximum(t0[i], t0[j]), np.minimum(t1[i], t1[j])
+        # Merge the windows of each pair that overlap or come from consecutive boxes (as points of a
+        # simulation don't overlap in time)
+        pair_order = np.lexsort((start, agent[j], agent[i]))
+        windows, last = {}, {}
+        for k in pair_order.tolist():
+            pair = (agents[agent[i[k]]], agents[agent[j[k]]])
+            if pair in windows and (start[k] <= windows[pair][-1][1] or i[k] - last[pair][0] == 1 or j[k] - last[pair][1] == 1):
+                windows[pair][-1][1] = max(windows[pair][-1][1], end[k])
+            else:
+                windows.setdefault(pair, []).append([start[k], end[k]])
+            last[pair] = (i[k], j[k])
+        for pair, pair_windows in windows.items():
+            res += [Contact(pair, tree.nodes[node_idx], float(s), float(e)) for s, e in pair_windows]
+    res.sort(key=lambda c: (c.start, c.node.id, c.agents))
+    return res
@@ -209,7 +209,8 @@ def calc_bloated_tube(
         sim_trace_num,
         guard_checker=None,
         guard_str="",
-        lane_map = None
+        lane_map = None,
+        batch_sim_func=None
     ):
     """
     This function calculate the reach tube for single given mode
@@ -224,6 +225,7 @@ def calc_bloated_tube(
         kvalue (list): list of float used when bloating method set to PW
         guard_checker (verse.core.guard.Guard or None): guard check object
         guard_str (str): guard string
+        batch_sim_func (function or None): simulates from a list of initial points at once, used instead of sim_func if given
        
     Returns:
         Bloated reach tube
@@ -233,11 +235,15 @@ def calc_bloated_tube(
     random.seed(4)
     cur_center = calcCenterPoint(initial_set[0], initial_set[1])
     cur_delta = calcDelta(initial_set[0], initial_set[1])
-    traces = [sim_func(mode_label, cur_center, time_horizon, time_step, lane_map)]
-    # Simulate SIMTRACENUM times to learn the sensitivity
-    for i in range(sim_trace_num):
-        new_init_point = randomPoint(initial_set[0], initial_set[1], i)
-        traces.append(sim_func(mode_label, new_init_point, time_horizon, time_step, lane_map))
+    if batch_sim_func is not None:
+        init_points = [cur_center] + [randomPoint(initial_set[0], initial_set[1], i) for i in range(sim_trace_num)]
+        traces = list(batch_sim_func(mode_label, init_points, time_horizon, time_step, lane_map))
+    else:
+        traces = [sim_func(mode_label, cur_center, time_horizon, time_step, lane_map)]
+        # Simulate SIMTRACENUM times to learn the sensitivity
+        for i in range(sim_trace_num):
+            new_init_point = randomPoint(initial_set[0], initial_set[1], i)
+            traces.append(sim_func(mode_label, new_init_point, time_horizon, time_step, lane_map))
 
     # Trim the trace to the same length
     traces = trimTraces(traces)
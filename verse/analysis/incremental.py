@@ -5,12 +5,93 @@ from typing import Any, DefaultDict, List, Tuple, Optional, Dict
 from verse.agents.base_agent import BaseAgent
 from verse.analysis import AnalysisTreeNode
 from intervaltree import IntervalTree
-import itertools, copy, numpy as np
+import itertools, copy, heapq
 
+from verse.analysis.boxset import BoxSet
 from verse.analysis.dryvr import _EPSILON
+from verse.analysis.utils import freeze, trace_nbytes
 # from verse.analysis.simulator import PathDiffs
 from verse.parser.parser import ControllerIR, ModePath
 
+class TransitionStore:
+    """
+    List of cached transitions without duplicates. Duplicates are found through a hash index on
+    key(transition), and the transitions are grouped by their initial sets so that suitability
+    is checked once per distinct initial set instead of once per transition. Each group keeps its
+    transitions with their insertion index, so the suitable groups are merged back in insertion
+    order without sorting.
+    """
+    def __init__(self, transitions=(), key=lambda t: t):
+        self.key = key
+        self.transitions = []
+        self.index = set()
+        self.by_inits: Dict[Any, Tuple[Dict, List[Tuple[int, Any]]]] = {}
+        self.extend(transitions)
+
+    def append(self, transition):
+        k = freeze(self.key(transition))
+        if k in self.index:
+            return
+        self.index.add(k)
+        # Exact initial sets: a group is checked through the initial set of its first transition,
+        # so every transition of a group needs to suit exactly when that one does
+        inits_key = freeze(transition.inits)
+        if inits_key not in self.by_inits:
+            self.by_inits[inits_key] = (transition.inits, [])
+        self.by_inits[inits_key][1].append((len(self.transitions), transition))
+        self.transitions.append(transition)
+
+    def extend(self, transitions) -> list:
+        """Add the transitions that aren't already stored and return them"""
+        num_stored = len(self.transitions)
+        for transition in transitions:
+            self.append(transition)
+        return self.transitions[num_stored:]
+
+    def suitable(self, inits, suits) -> list:
+        """The transitions whose initial sets suit inits, in insertion order"""
+        groups = [group for t_inits, group in self.by_inits.values() if suits(t_inits, inits)]
+        if len(groups) == 1:
+            return [t for _, t in groups[0]]
+        return [t for _, t in heapq.merge(*groups, key=lambda p: p[0])]
+
+    def num_suitable(self, inits, suits) -> int:
+        return sum(len(group) for t_inits, group in self.by_inits.values() if suits(t_inits, inits))
+
+    def filter(self, f) -> "TransitionStore":
+        return TransitionStore([t for t in self.transitions if f(t)], self.key)
+
+    def __iter__(self):
+        return iter(self.transitions)
+
+    def __len__(self):
+        return len(self.transitions)
+
+    def __getitem__(self, i):
+        return self.transitions[i]
+
+# Interval object and its slot in an IntervalTree, and an empty IntervalTree
+INTERVAL_BYTES = 500
+TREE_BYTES = 900
+# Dataclass instance with its dicts, for a cache entry or a cached transition
+ENTRY_BYTES = 600
+
+def transitions_nbytes(transitions) -> int:
+    return sum(ENTRY_BYTES + sum(trace_nbytes(init) for init in t.inits.values()) for t in transitions)
+
+def entry_nbytes(num_levels: int, transitions=(), trace=None) -> int:
+    """Approximate bytes added to a cache by an entry with the given transitions and trace that is indexed by num_levels intervals"""
+    size = num_levels * INTERVAL_BYTES + (num_levels - 1) * TREE_BYTES + ENTRY_BYTES + transitions_nbytes(transitions)
+    if trace is not None:
+        size += trace_nbytes(trace)
+    return size
+
+def sim_trans_key(t: "CachedTransition"):
+    return (t.disc, t.cont, t.inits)
+
+def reach_trans_key(t: "CachedReachTrans"):
+    return (t.mode, t.dest, t.inits)
+
 @dataclass
 class CachedTransition:
     inits: Dict[str, List[float]]
@@ -23,7 +104,7 @@ class CachedTransition:
 class CachedSegment:
     trace: List[List[float]]
     asserts: List[str]
-    transitions: List[CachedTransition]
+    transitions: TransitionStore
     controller: ControllerIR
     run_num: int
     node_id: int
@@ -41,7 +122,7 @@ class CachedReachTrans:
 @dataclass
 class CachedRTTrans:
     asserts: List[str]
-    transitions: List[CachedReachTrans]
+    transitions: TransitionStore
     controller: ControllerIR
     run_num: int
     node_id: int
@@ -77,7 +158,7 @@ def to_simulate(old_agents: Dict[str, BaseAgent], new_agents: Dict[str, BaseAgen
     # pp(("removed_paths", removed_paths))
     for agent_id in cached:
         segment = copy.deepcopy(cached[agent_id])
-        new_transitions = []
+        removed_trans = set()
         for trans in segment.transitions:
             removed = False
             for path in trans.paths:
@@ -90,9 +171,9 @@ def to_simulate(old_agents: Dict[str, BaseAgent], new_agents: Dict[str, BaseAgen
                     if path.cond == rcp.cond:
                         path.val = rcp.val
             # pp(("filter", agent_id, trans.paths, removed))
-            if not removed:
-                new_transitions.append(trans)
-        segment.transitions = new_transitions
+            if removed:
+                removed_trans.add(id(trans))
+        segment.transitions = segment.transitions.filter(lambda t: id(t) not in removed_trans)
         new_cache[agent_id] = segment
         # pp(("filtered", agent_id, len(cached[agent_id].transitions), len(new_cache[agent_id].transitions), len([p for a, p in added_paths if a.id == agent_id])))
     return new_cache, added_paths
@@ -110,8 +191,7 @@ def convert_reach_trans(agent_id, transit_agents, inits, transition, trans_ind):
         return []
 
 def combine_all(inits):
-    return [[min(a) for a in np.transpose(np.array(inits)[:, 0])],
-            [max(a) for a in np.transpose(np.array(inits)[:, 1])]]
+    return BoxSet(inits).hull().data[0].tolist()
 
 def sim_trans_suit(a: Dict[str, List[float]], b: Dict[str, List[float]]) -> bool:
     assert set(a.keys()) == set(b.keys())
@@ -139,6 +219,8 @@ class CachedTube:
 class SimTraceCache:
     def __init__(self):
         self.cache: DefaultDict[tuple, IntervalTree] = defaultdict(IntervalTree)
+        # Approximate bytes held by the entries
+        self.nbytes = 0
 
     def add_segment(self, agent_id: str, node: AnalysisTreeNode, transit_agents: List[str], trace: List[List[float]], transition, trans_ind: int, run_num: int):
         key = (agent_id,) + tuple(node.mode[agent_id])
@@ -148,9 +230,10 @@ class SimTraceCache:
         # pp(('add seg', agent_id, *node.mode[agent_id], *init))
         for i, val in enumerate(init):
             if i == len(init) - 1:
-                transitions = convert_sim_trans(agent_id, transit_agents, node.init, transition, trans_ind)
+                transitions = TransitionStore(convert_sim_trans(agent_id, transit_agents, node.init, transition, trans_ind), sim_trans_key)
                 entry = CachedSegment(trace, assert_hits.get(agent_id), transitions, node.agent[agent_id].decision_logic, run_num, node.id)
                 tree[val - _EPSILON:val + _EPSILON] = entry
+                self.nbytes += entry_nbytes(len(init), transitions, trace)
                 return entry
             else:
                 next_level_tree = IntervalTree()
@@ -195,9 +278,7 @@ class SimTraceCache:
         entries = self.query_cont(tree, init)
         if len(entries) == 0:
             return None
-        def num_trans_suit(e: CachedSegment) -> int:
-            return sum(1 if sim_trans_suit(t.inits, inits) else 0 for t in e.transitions)
-        entries = list(sorted([(e, -num_trans_suit(e)) for e in entries], key=lambda p: p[1]))
+        entries = list(sorted([(e, -e.transitions.num_suitable(inits, sim_trans_suit)) for e in entries], key=lambda p: p[1]))
         # pp(("check hit entries", len(entries), entries[0][1]))
         assert isinstance(entries[0][0], (type(None), CachedSegment))
         return entries[0][0]
@@ -205,15 +286,18 @@ class SimTraceCache:
 class TubeCache:
     def __init__(self):
         self.cache: DefaultDict[tuple, IntervalTree] = defaultdict(IntervalTree)
+        # Approximate bytes held by the entries
+        self.nbytes = 0
 
     def add_tube(self, agent_id: str, mode: Tuple[str], init: List[List[float]], trace: List[List[List[float]]]):
         key = (agent_id,) + tuple(mode)
-        init = list(map(list, zip(*init)))
+        init = BoxSet(init).intervals()[0].tolist()
         tree = self.cache[key]
         for i, (low, high) in enumerate(init):
             if i == len(init) - 1:
                 entry = CachedTube(trace)
                 tree[low:high + _EPSILON] = entry
+                self.nbytes += entry_nbytes(len(init), trace=trace)
                 return entry
             else:
                 next_level_tree = IntervalTree()
@@ -226,7 +310,7 @@ class TubeCache:
         if key not in self.cache:
             return None
         tree = self.cache[key]
-        for low, high in list(map(list, zip(*init))):
+        for low, high in BoxSet(init).intervals()[0].tolist():
             next_level_entries = [t for t in tree[low:high + _EPSILON] if t.begin <= low and high <= t.end]
             if len(next_level_entries) == 0:
                 return None
@@ -237,18 +321,21 @@ class TubeCache:
 class ReachTubeCache:
     def __init__(self):
         self.cache: DefaultDict[tuple, IntervalTree] = defaultdict(IntervalTree)
+        # Approximate bytes held by the entries
+        self.nbytes = 0
 
     def add_tube(self, agent_id: str, init: Dict[str, List[List[float]]], node: AnalysisTreeNode, transit_agents: List[str], transition, trans_ind: int, run_num: int):
         key = (agent_id,) + tuple(node.mode[agent_id])
         tree = self.cache[key]
         # pp(('add seg', agent_id, node.mode[agent_id], init))
         assert_hits = node.assert_hits or {}
-        init = list(map(tuple, zip(*init[agent_id])))
+        init = BoxSet(init[agent_id]).intervals()[0].tolist()
         for i, (low, high) in enumerate(init):
             if i == len(init) - 1:
-                transitions = convert_reach_trans(agent_id, transit_agents, node.init, transition, trans_ind)
+                transitions = TransitionStore(convert_reach_trans(agent_id, transit_agents, node.init, transition, trans_ind), reach_trans_key)
                 entry = CachedRTTrans(assert_hits.get(agent_id), transitions, node.agent[agent_id].decision_logic, run_num, node.id)
                 tree[low:high + _EPSILON] = entry
+                self.nbytes += entry_nbytes(len(init), transitions)
                 return entry
             else:
                 next_level_tree = IntervalTree()
@@ -273,12 +360,10 @@ class ReachTubeCache:
         if key not in self.cache:
             return None
         tree = self.cache[key]
-        entries = self.query_cont(tree, list(map(tuple, zip(*init))))
+        entries = self.query_cont(tree, BoxSet(init).intervals()[0].tolist())
         if len(entries) == 0:
             return None
-        def num_trans_suit(e: CachedRTTrans) -> int:
-            return sum(1 if reach_trans_suit(t.inits, inits) else 0 for t in e.transitions)
-        entries = list(sorted([(e, -num_trans_suit(e)) for e in entries], key=lambda p: p[1]))
+        entries = list(sorted([(e, -e.transitions.num_suitable(inits, reach_trans_suit)) for e in entries], key=lambda p: p[1]))
         # pp(("check hit entries", len(entries), entries[0][1]))
         assert isinstance(entries[0][0], (type(None), CachedRTTrans))
         return entries[0][0]
@@ -4,6 +4,7 @@ import inspect, ast, textwrap, inspect, astunparse
 import warnings
 from sympy import Symbol, diff
 from sympy.utilities.lambdify import lambdify
+from mpmath import iv
 from sympy.core import *
 
 from scipy.integrate import ode
@@ -34,29 +35,266 @@ def find_max(expr_func, jac_func, var_range, num_var, args, idx):
     return -res
 
 def find_min_symbolic(expr, var_range):
-    bounds = []
     vars = list(expr.free_symbols)
-    x0 = []
-    jac = []
-    for var in vars:
-        bounds.append(var_range[var])
-        x0.append(var_range[var][0])
-        jac.append(diff(expr, var))
-    expr_func = lambdify([vars], expr)
-    jac_func = lambdify([vars], jac)
-    res = minimize(
-        expr_func, 
-        x0,
-        bounds = bounds,
-        jac = jac_func,
-        method = 'L-BFGS-B'
-    )
-    return res.fun
+    return SymbolicObjective(expr, vars).minimize(var_range)
 
 def find_max_symbolic(expr, var_range):
-    tmp = -expr 
-    res = find_min_symbolic(tmp, var_range)
-    return -res
+    vars = list(expr.free_symbols)
+    return SymbolicObjective(expr, vars).maximize(var_range)
+
+class SymbolicObjective:
+    """
+        A sympy expression and its gradient lambdified once to NumPy, so that it can be
+        minimized or maximized over many different boxes without calling sympy again.
+        Symbols in params are not optimized over and their values are passed to minimize/maximize.
+    """
+    def __init__(self, expr, symbols, params = None):
+        self.vars = [var for var in symbols if var in expr.free_symbols]
+        self.params = list(params or [])
+        self.expr_func = lambdify([self.vars] + self.params, expr, 'numpy')
+        self.jac_func = lambdify([self.vars] + self.params, [diff(expr, var) for var in self.vars], 'numpy')
+
+    def minimize(self, var_range, params = None):
+        params = params or []
+        if not self.vars:
+            return float(self.expr_func([], *params))
+        bounds = [var_range[var] for var in self.vars]
+        x0 = [bound[0] for bound in bounds]
+        res = minimize(
+            self.expr_func,
+            x0,
+            args = tuple(params),
+            bounds = bounds,
+            jac = self.jac_func,
+            method = 'L-BFGS-B'
+        )
+        return res.fun
+
+    def maximize(self, var_range, params = None):
+        params = params or []
+        if not self.vars:
+            return float(self.expr_func([], *params))
+        bounds = [var_range[var] for var in self.vars]
+        x0 = [bound[0] for bound in bounds]
+        res = minimize(
+            lambda x, *args: -self.expr_func(x, *args),
+            x0,
+            args = tuple(params),
+            bounds = bounds,
+            jac = lambda x, *args: -np.array(self.jac_func(x, *args), dtype=float),
+            method = 'L-BFGS-B'
+        )
+        return -res.fun
+
+def compute_decomposition_symbolic(objectives, symbol_x, symbol_w, x, w, x_hat, w_hat, params = None):
+    d = []
+    for objective in objectives:
+        if all(a<=b for a,b in zip(x, x_hat)) and all(a<=b for a,b in zip(w,w_hat)):
+            var_range = {}
+            for i, var in enumerate(symbol_x):
+                var_range[var] = (x[i], x_hat[i])
+            for i, var in enumerate(symbol_w):
+                var_range[var] = (w[i], w_hat[i])
+            res = objective.minimize(var_range, params)
+            d.append(res)
+        elif all(a>=b for a,b in zip(x,x_hat)) and all(a>=b for a,b in zip(w,w_hat)):
+            var_range = {}
+            for i,var in enumerate(symbol_x):
+                var_range[var] = (x_hat[i], x[i])
+            for i, var in enumerate(symbol_w):
+                var_range[var] = (w_hat[i], w[i])
+            res = objective.maximize(var_range, params)
+            d.append(res)
+        else:
+            raise ValueError(f"Condition for x, w, x_hat, w_hat not satisfied: {[x, w, x_hat, w_hat]}")
+    return d
+
+def extract_dynamics_symbolic(agent):
+    """
+        Extract the discrete time dynamics between the 'Begin Dynamic' and 'End Dynamic' markers of agent.dynamics as sympy expressions.
+        The result is (exprs, symbol_x, symbol_w, dt), where dt is kept as a symbol.
+    """
+    dynamics_func = agent.dynamics
+    lines = inspect.getsource(dynamics_func)
+    function_body = ast.parse(textwrap.dedent(lines)).body[0].body
+    if not isinstance(function_body, list):
+        raise ValueError(f'Failed to extract dynamics for {agent}')
+
+    text_exprs = []
+    extract = False
+    x_var = []
+    w_var = []
+    for i, elem in enumerate(function_body):
+        if isinstance(elem, ast.Expr):
+            if isinstance(elem.value, ast.Constant) and elem.value.value == 'Begin Dynamic':
+                extract = True
+            elif isinstance(elem.value, ast.Constant) and elem.value.value == 'End Dynamic':
+                extract = False
+        elif extract:
+            if isinstance(elem, ast.Assign):
+                text_exprs.append(astunparse.unparse(elem.value))
+        elif isinstance(elem, ast.Assign) and isinstance(elem.value, ast.Name) and isinstance(elem.targets[0], ast.Tuple):
+            # Unpacking of the state and of the uncertain parameters, e.g. x1, x2 = x and w1, w2, dt = args
+            var_list = elem.targets[0].elts
+            if elem.value.id == 'args':
+                for var in var_list[:-1]:
+                    w_var.append(var.id)
+            elif elem.value.id == 'x':
+                for var in var_list:
+                    x_var.append(var.id)
+
+    if len(text_exprs) != len(x_var):
+        raise ValueError(f'Failed to extract dynamics for {agent}')
+
+    symbol_x = [Symbol(elem,real=True) for elem in x_var]
+    symbol_w = [Symbol(elem,real=True) for elem in w_var]
+    dt = Symbol("dt", real=True)
+
+    exprs = []
+    for expr in [sympify(elem) for elem in text_exprs]:
+        for symbol in symbol_x + symbol_w + [dt]:
+            expr = expr.subs(symbol.name, symbol)
+        exprs.append(expr)
+    return exprs, symbol_x, symbol_w, dt
+
+def get_symbolic_decomposition(agent):
+    """
+        Objectives for the decomposition function of each state variable of the agent.
+        They are extracted and compiled on the first call and cached on the agent afterwards.
+    """
+    dynamics_func = getattr(agent.dynamics, '__func__', agent.dynamics)
+    cached = getattr(agent, '_symbolic_decomposition', None)
+    if cached is not None and cached[0] is dynamics_func:
+        return cached[1]
+    exprs, symbol_x, symbol_w, dt = extract_dynamics_symbolic(agent)
+    objectives = [SymbolicObjective(expr, symbol_x + symbol_w, [dt]) for expr in exprs]
+    res = (objectives, symbol_x, symbol_w)
+    agent._symbolic_decomposition = (dynamics_func, res)
+    return res
+
+class BatchedBoundSolver:
+    """
+        Computes the decomposition function of an agent with dynamics and dynamics_jac by optimizing all
+        the state dimensions in a single call of the optimizer. Each dimension gets its own copy of the
+        variables, so the summed objective is separable and its minimizer minimizes every dimension.
+        The optimizer is warm started from the minimizers of the previous time step.
+
+        dynamics and dynamics_jac are called once per evaluation on the columns of all the points, e.g.
+        x = [x1, x2] with arrays x1 and x2, when they broadcast like NumPy ufuncs; otherwise they are
+        called once per distinct point.
+
+        L-BFGS-B stops on the tolerances of the summed objective and of its projected gradient, not of
+        each dimension, so a single bound may stop further from its optimum than the 'separate' solver,
+        which optimizes every dimension to the tolerances on its own.
+
+        With use_corner, dynamics_jac is also evaluated on mpmath intervals to enclose the Jacobian over
+        the whole box. A dimension whose row of the enclosure doesn't change sign is monotone in every
+        variable, so its bound is taken at the corner the signs point to. Dimensions that aren't proven
+        monotone, or all of them when dynamics_jac can't be evaluated on intervals, are optimized.
+    """
+    def __init__(self, agent, use_corner = False):
+        self.agent = agent
+        self.use_corner = use_corner
+        self.prev_argmin = {}
+        self.num_optimizer_calls = 0
+        self.num_corner_hits = 0
+        # Functions that failed on arrays of points are called point by point
+        self._pointwise = set()
+
+    def decomposition(self, x, w, xhat, what, dt):
+        assert len(x) == len(xhat)
+        assert len(w) == len(what)
+        if all(a <= b for a, b in zip(x, xhat)) and all(a <= b for a, b in zip(w, what)):
+            return self.bound(np.array(x + w, dtype=float), np.array(xhat + what, dtype=float), len(x), [dt], 1)
+        elif all(b <= a for a, b in zip(x, xhat)) and all(b <= a for a, b in zip(w, what)):
+            return self.bound(np.array(xhat + what, dtype=float), np.array(x + w, dtype=float), len(x), [dt], -1)
+        else:
+            raise ValueError(f"Condition for x, w, x_hat, w_hat not satisfied: {[x, w, xhat, what]}")
+
+    def _dynamics(self, z, num_var, args):
+        return np.array(self.agent.dynamics(list(z[:num_var]), list(z[num_var:]) + args), dtype=float)
+
+    def _jac(self, z, num_var, args):
+        return np.array(self.agent.dynamics_jac(list(z[:num_var]), list(z[num_var:]) + args), dtype=float)
+
+    def _at(self, f, points, num_var, args):
+        """f at each row of points, from a single call on the columns of points when f broadcasts"""
+        shape = (num_var,) if f == self._dynamics else (num_var, points.shape[1])
+        if f not in self._pointwise:
+            try:
+                with np.errstate(all='ignore'):
+                    values = f(points.T, num_var, args)
+                if values.shape == shape + (len(points),):
+                    return np.moveaxis(values, -1, 0)
+            except (TypeError, ValueError):
+                pass
+            self._pointwise.add(f)
+        values = {}
+        for p in points:
+            key = p.tobytes()
+            if key not in values:
+                values[key] = f(p, num_var, args)
+        return np.array([values[p.tobytes()] for p in points])
+
+    def _jac_enclosure(self, low, high, num_var, args):
+        """(lower, upper) bounds of dynamics_jac over the box [low, high], or None if it can't be evaluated on intervals"""
+        box = [iv.mpf([l, h]) for l, h in zip(low.tolist(), high.tolist())]
+        try:
+            jac = np.array(self.agent.dynamics_jac(box[:num_var], box[num_var:] + args), dtype=object)
+            entries = [iv.mpf(e.item() if isinstance(e, np.ndarray) else e) for e in jac.flatten()]
+        except (TypeError, ValueError, AttributeError, ZeroDivisionError):
+            return None
+        if jac.shape != (num_var, len(low)):
+            return None
+        lower = np.array([e.a >= 0 for e in entries]).reshape(jac.shape)
+        upper = np.array([e.b <= 0 for e in entries]).reshape(jac.shape)
+        return lower, upper
+
+    def bound(self, low, high, num_var, args, sign):
+        """Minimum (sign 1) or maximum (sign -1) of each dimension of the dynamics over the box [low, high]."""
+        num_all = len(low)
+        res = np.zeros(num_var)
+        argmin = np.tile(low, (num_var, 1))
+        solved = np.zeros(num_var, dtype=bool)
+        enclosure = self._jac_enclosure(low, high, num_var, args) if self.use_corner else None
+        if enclosure is not None:
+            nonneg, nonpos = enclosure if sign > 0 else enclosure[::-1]
+            # Each dimension proven monotone in every variable is minimized at a corner
+            rows = np.where(np.all(nonneg | nonpos, axis=1))[0]
+            if len(rows) > 0:
+                corners = np.where(nonneg[rows], low, high)
+                res[rows] = self._at(self._dynamics, corners, num_var, args)[np.arange(len(rows)), rows]
+                argmin[rows] = corners
+                solved[rows] = True
+                self.num_corner_hits += len(rows)
+
+        todo = np.where(~solved)[0]
+        if len(todo) > 0:
+            x0 = self.prev_argmin.get(sign)
+            if x0 is None or x0.shape != (num_var, num_all):
+                x0 = argmin
+            x0 = np.clip(x0[todo], low, high)
+            rows = np.arange(len(todo))
+
+            def objective(z):
+                z = z.reshape(len(todo), num_all)
+                vals = self._at(self._dynamics, z, num_var, args)[rows, todo]
+                grad = self._at(self._jac, z, num_var, args)[rows, todo]
+                return sign * np.sum(vals), sign * grad.flatten()
+
+            opt = minimize(
+                objective,
+                x0.flatten(),
+                jac = True,
+                bounds = list(zip(low, high)) * len(todo),
+                method = 'L-BFGS-B'
+            )
+            self.num_optimizer_calls += 1
+            z = opt.x.reshape(len(todo), num_all)
+            res[todo] = self._at(self._dynamics, z, num_var, args)[rows, todo]
+            argmin[todo] = z
+        self.prev_argmin[sign] = argmin
+        return res.tolist()
 
 def compute_reachtube_mixmono_disc(
     initial_set,
@@ -162,11 +400,16 @@ def calculate_bloated_tube_mixmono_disc(
             time_horizon,
             time_step,
             agent,
-            lane_map
+            lane_map,
+            params = {}
     ):
         if hasattr(agent, 'dynamics') and hasattr(agent, 'decomposition'):
             decomposition = agent.decomposition
             res = compute_reachtube_mixmono_disc(init, uncertain_param, time_horizon, time_step, decomposition)
+        elif hasattr(agent, 'dynamics') and hasattr(agent, 'dynamics_jac') and params.get('mixmono_solver', 'separate') == 'batched':
+            solver = BatchedBoundSolver(agent, params.get('mixmono_corner', False))
+            res = compute_reachtube_mixmono_disc(init, uncertain_param, time_horizon, time_step,
+                                                      solver.decomposition)
         elif hasattr(agent, 'dynamics') and hasattr(agent, 'dynamics_jac'):
             def decomposition_func(x, w, xhat, what, dt):
                 expr_func = lambda x, num_var, args, idx: agent.dynamics(list(x[:num_var]), list(x[num_var:])+args)[idx]
@@ -195,78 +438,10 @@ def calculate_bloated_tube_mixmono_disc(
             res = compute_reachtube_mixmono_disc(init, uncertain_param, time_horizon, time_step,
                                                       decomposition_func)
         elif hasattr(agent, 'dynamics'):
-            dynamics_func = agent.dynamics
-            lines = inspect.getsource(dynamics_func)
-            function_body = ast.parse(textwrap.dedent(lines)).body[0].body
-            if not isinstance(function_body, list):
-                raise ValueError(f'Failed to extract dynamics for {agent}')
-            
-            text_exprs = []
-            extract = False
-            x_var = []
-            w_var = []
-            for i, elem in enumerate(function_body):
-                if isinstance(elem, ast.Expr):
-                    if isinstance(elem.value, ast.Constant) and elem.value.value == 'Begin Dynamic':
-                        extract = True
-                elif isinstance(elem, ast.Expr):
-                    if isinstance(elem.value, ast.Constant) and elem.value.value == 'End Dynamic':
-                        extract = False
-                elif extract:
-                    if isinstance(elem, ast.Assign):
-                        text_exprs.append(astunparse.unparse(elem.value))
-                        # x_var_name = elem.targets[0].id.replace('_plus','')
-                        # x_var.append(x_var_name)
-                else:
-                    if isinstance(elem, ast.Assign):
-                        if elem.value.id == 'args':
-                            var_list = elem.targets[0].elts
-                            for var in var_list[:-1]:
-                                w_var.append(var.id)
-                        elif elem.value.id == 'x':
-                            var_list = elem.targets[0].elts
-                            for var in var_list:
-                                x_var.append(var.id)
-
-            if len(text_exprs) != len(x_var):
-                raise ValueError(f'Failed to extract dynamics for {agent}')
-
-            symbol_x = [Symbol(elem,real=True) for elem in x_var]
-            symbol_w = [Symbol(elem,real=True) for elem in w_var]
-            dt = Symbol("dt", real=True)
-
-            tmp = [sympify(elem).subs("dt", time_step) for elem in text_exprs]
-            expr_symbol = []
-            for expr in tmp:
-                for symbol in symbol_x:
-                    expr =  expr.subs(symbol.name, symbol) 
-                for symbol in symbol_w:
-                    expr =  expr.subs(symbol.name, symbol) 
-                expr_symbol.append(expr)
-            exprs = expr_symbol 
+            objectives, symbol_x, symbol_w = get_symbolic_decomposition(agent)
 
             def computeD(x, w, x_hat, w_hat, dt):
-                d = []
-                for expr in exprs:
-                    if all(a<=b for a,b in zip(x, x_hat)) and all(a<=b for a,b in zip(w,w_hat)):
-                        var_range = {}
-                        for i, var in enumerate(symbol_x):
-                            var_range[var] = (x[i], x_hat[i])
-                        for i, var in enumerate(symbol_w):
-                            var_range[var] = (w[i], w_hat[i])
-                        res = find_min_symbolic(expr, var_range)
-                        d.append(res)
-                    elif all(a>=b for a,b in zip(x,x_hat)) and all(a>=b for a,b in zip(w,w_hat)):
-                        var_range = {}
-                        for i,var in enumerate(symbol_x):
-                            var_range[var] = (x_hat[i], x[i])
-                        for i, var in enumerate(symbol_w):
-                            var_range[var] = (w_hat[i], w[i])
-                        res = find_max_symbolic(expr, var_range)
-                        d.append(res)
-                    else:
-                        raise ValueError(f"Condition for x, w, x_hat, w_hat not satisfied: {[x, w, x_hat, w_hat]}")
-                return d
+                return compute_decomposition_symbolic(objectives, symbol_x, symbol_w, x, w, x_hat, w_hat, [dt])
             res = compute_reachtube_mixmono_disc(init, uncertain_param, time_horizon, time_step,
                                                       computeD)
         else:
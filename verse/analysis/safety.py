@@ -0,0 +1,87 @@
+from dataclasses import dataclass
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+from verse.analysis.analysis_tree import AnalysisTree, AnalysisTreeNode
+from verse.analysis.boxset import TreeBoxes
+
+@dataclass
+class UnsafeSet:
+    """
+    The unsafe set {x | A x <= b}. x is the state (without the time) of agents[0] or, for a pair of agents,
+    the state of agents[0] minus the one of agents[1].
+    """
+    agents: Tuple[str, ...]
+    A: np.ndarray
+    b: np.ndarray
+
+    def __post_init__(self):
+        if isinstance(self.agents, str):
+            self.agents = (self.agents,)
+        self.agents = tuple(self.agents)
+        assert len(self.agents) in (1, 2), "an unsafe set is for one agent or a pair of agents"
+        self.A = np.atleast_2d(np.array(self.A, dtype=float))
+        self.b = np.atleast_1d(np.array(self.b, dtype=float))
+
+    @staticmethod
+    def box(agents, lo, hi) -> "UnsafeSet":
+        """The box lo <= x <= hi. Use -inf/inf (or None) for the dimensions that are not bounded."""
+        lo = np.array([-np.inf if v is None else v for v in lo], dtype=float)
+        hi = np.array([np.inf if v is None else v for v in hi], dtype=float)
+        eye = np.eye(len(lo))
+        A, b = np.concatenate([eye, -eye]), np.concatenate([hi, -lo])
+        keep = np.isfinite(b)
+        return UnsafeSet(agents, A[keep], b[keep])
+
+@dataclass
+class Violation:
+    """The earliest rectangle (or point) of a tree that intersects an unsafe set"""
+    unsafe: UnsafeSet
+    node: AnalysisTreeNode
+    time: float
+    index: int
+    """Index of the lower corner (or of the point) in the traces of the node"""
+
+def intersects(lo: np.ndarray, hi: np.ndarray, A: np.ndarray, b: np.ndarray) -> np.ndarray:
+    """
+    For each box lo[i] <= x <= hi[i], check that the minimum of each row of A x over the box is at most b. This is
+    exact when {A x <= b} is a box and otherwise may report boxes that only come close to the polytope, so a box that
+    passes is never unsafe.
+    """
+    if len(lo) == 0:
+        return np.zeros(0, dtype=bool)
+    lowest = lo @ np.maximum(A, 0).T + hi @ np.minimum(A, 0).T
+    return np.all(lowest <= b, axis=1)
+
+def check_unsafe(tree: AnalysisTree, unsafe_sets: Sequence[UnsafeSet]) -> List[Optional[Violation]]:
+    """
+    Check every rectangle of a reachtube tree (or every point of a simulation tree) against the unsafe sets.
+    Returns, for each unsafe set, its earliest violation or None if it is never reached. Agents of a pair are
+    compared at the same trace row of the same node.
+    """
+    boxes: Dict[str, TreeBoxes] = {}
+    def get_boxes(agent_id):
+        if agent_id not in boxes:
+            boxes[agent_id] = TreeBoxes(tree, agent_id)
+        return boxes[agent_id]
+
+    res = []
+    for unsafe in unsafe_sets:
+        first = get_boxes(unsafe.agents[0])
+        if len(unsafe.agents) == 1:
+            ind = np.arange(len(first))
+            lo, hi = first.lo, first.hi
+        else:
+            second = get_boxes(unsafe.agents[1])
+            ind, other_ind = first.align(second)
+            lo = first.lo[ind] - second.hi[other_ind]
+            hi = first.hi[ind] - second.lo[other_ind]
+        hits = ind[intersects(lo, hi, unsafe.A, unsafe.b)]
+        if len(hits) == 0:
+            res.append(None)
+            continue
+        # Earliest time, then first node in BFS order
+        hit = hits[np.lexsort((first.nodes[hits], first.times[hits]))[0]]
+        res.append(Violation(unsafe, tree.nodes[first.nodes[hit]], float(first.times[hit]), int(first.rows[hit])))
+    return res
@@ -2,13 +2,16 @@ from typing import List, Tuple
 import copy
 import itertools
 import functools
+import random
+from collections import deque
+
+import numpy as np
 
 import pprint
 from verse.agents.base_agent import BaseAgent
 
-from verse.analysis.incremental import SimTraceCache, convert_sim_trans, to_simulate
-from verse.analysis.utils import dedup
-from verse.parser.parser import ModePath, find
+from verse.analysis.incremental import SimTraceCache, convert_sim_trans, to_simulate, transitions_nbytes
+from verse.parser.parser import ModePath
 
 pp = functools.partial(pprint.pprint, compact=True, width=130)
 
@@ -20,6 +23,15 @@ PathDiffs = List[Tuple[BaseAgent, ModePath]]
 MAX_DEPTH = 3
 
 
+def nth_combination(lists, idx):
+    """The idx-th element of itertools.product(*lists)"""
+    res = []
+    for l in reversed(lists):
+        idx, i = divmod(idx, len(l))
+        res.append(l[i])
+    return tuple(reversed(res))
+
+
 def red(s):
     return "\x1b[31m" + s + "\x1b[0m"  # ]]
 
@@ -30,9 +42,36 @@ class Simulator:
         self.cache = SimTraceCache()
         self.config = config
         self.cache_hits = (0, 0)
+        self.branching_rng = random.Random(config.branching_seed)
 
     def simulate(self, init_list, init_mode_list, static_list, uncertain_param_list, agent_list,
                  transition_graph, time_horizon, time_step, lane_map, run_num, past_runs):
+        for _ in self.simulate_iter(init_list, init_mode_list, static_list, uncertain_param_list, agent_list,
+                                    transition_graph, time_horizon, time_step, lane_map, run_num, past_runs):
+            pass
+        return self.simulation_tree
+
+    def simulate_iter(self, init_list, init_mode_list, static_list, uncertain_param_list, agent_list,
+                      transition_graph, time_horizon, time_step, lane_map, run_num, past_runs, resume_from=None):
+        """Generator version of simulate. Nodes are yielded in BFS order, starting from the root, once
+        their traces and assert hits are final. Children are only created when the simulation reaches
+        them. Closing the generator stops the simulation; the children that were not reached yet are
+        still created then, so that the caller can tell them apart. resume_from is a partial tree of
+        an earlier simulation, which is continued from its frontier nodes (the nodes that were already
+        computed are yielded first, and the random branching choices continue from where it stopped)."""
+        if resume_from is not None:
+            simulation_queue = deque()
+            for node in resume_from.nodes:
+                if node.frontier:
+                    node.frontier = False
+                    simulation_queue.append(node)
+                else:
+                    yield node
+            yield from self._simulate_queue(simulation_queue, resume_from.root, transition_graph, time_horizon, time_step, lane_map, run_num, past_runs)
+            return
+        # Every run makes the same random branching choices for a given config.branching_seed
+        seed = self.config.branching_seed
+        self.branching_rng = random.Random(np.random.randint(2**31) if seed is None else seed)
         # Setup the root of the simulation tree
         root = AnalysisTreeNode(
             trace={},
@@ -55,16 +94,34 @@ class Simulator:
             root.agent[agent.id] = agent
             root.type = 'simtrace'
 
-        simulation_queue = []
+        simulation_queue = deque()
         simulation_queue.append(root)
+        yield from self._simulate_queue(simulation_queue, root, transition_graph, time_horizon, time_step, lane_map, run_num, past_runs)
+
+    def _simulate_queue(self, simulation_queue, root, transition_graph, time_horizon, time_step, lane_map, run_num, past_runs):
+        try:
+            yield from self._simulate_loop(simulation_queue, transition_graph, time_horizon, time_step, lane_map, run_num, past_runs)
+        finally:
+            # Create the children still waiting in the queue, so a stopped simulation leaves
+            # them in the tree
+            for item in simulation_queue:
+                if not isinstance(item, AnalysisTreeNode):
+                    for _ in item:
+                        pass
+        self.simulation_tree = AnalysisTree(root)
+
+    def _simulate_loop(self, simulation_queue, transition_graph, time_horizon, time_step, lane_map, run_num, past_runs):
         # Perform BFS through the simulation tree to loop through all possible transitions
-        while simulation_queue != []:
-            node: AnalysisTreeNode = simulation_queue.pop(0)
+        while simulation_queue:
+            node: AnalysisTreeNode = self._next_node(simulation_queue)
+            if node is None:
+                continue
             # Setup the root of the simulation tree
 
             # pp(("start sim", node.start_time, {a: (*node.mode[a], *node.init[a]) for a in node.mode}))
             remain_time = round(time_horizon - node.start_time, 10)
             if remain_time <= 0:
+                yield node
                 continue
             # For trace not already simulated
             cached_segments = {}
@@ -109,7 +166,7 @@ class Simulator:
             if len(node_ids) == 1 and len(cached_segments.keys()) == len(node.agent):
                 old_run_num, old_node_id = node_ids[0]
                 if old_run_num != run_num:
-                    old_node = find(past_runs[old_run_num].nodes, lambda n: n.id == old_node_id)
+                    old_node = past_runs[old_run_num].get_node(old_node_id)
                     assert old_node != None
                     new_cache, paths_to_sim = to_simulate(old_node.agent, node.agent, cached_segments)
                     # pp(("to sim", new_cache.keys(), len(paths_to_sim)))
@@ -144,9 +201,11 @@ class Simulator:
                                 self.cache.add_segment(agent_id, node, [], full_traces[agent_id], [], transition_idx,
                                                        run_num)
                     # print(red("no trans"))
+                    yield node
                     continue
                 if (node.height >= MAX_DEPTH):
                     print("max depth reached")
+                    yield node
                     continue
 
                 transit_agents = transitions.keys()
@@ -155,78 +214,81 @@ class Simulator:
                     for agent_id in node.agent:
                         transition = transitions[agent_id] if agent_id in transit_agents else []
                         if agent_id in cached_segments:
-                            cached_segments[agent_id].transitions.extend(
+                            added = cached_segments[agent_id].transitions.extend(
                                 convert_sim_trans(agent_id, transit_agents, node.init, transition, transition_idx))
-                            pre_len = len(cached_segments[agent_id].transitions)
-                            cached_segments[agent_id].transitions = dedup(cached_segments[agent_id].transitions,
-                                                                          lambda i: (i.disc, i.cont, i.inits))
-                            # pp(("dedup!", pre_len, len(cached_segments[agent_id].transitions)))
+                            self.cache.nbytes += transitions_nbytes(added)
                         else:
                             self.cache.add_segment(agent_id, node, transit_agents, full_traces[agent_id], transition,
                                                    transition_idx, run_num)
                 # pp(("cached inits", self.cache.get_cached_inits(3)))
-                # Generate the transition combinations if multiple agents can transit at the same time step
-                transition_list = list(transitions.values())
-                all_transition_combinations = itertools.product(
-                    *transition_list)
-
-                # For each possible transition, construct the new node.
-                # Obtain the new initial condition for agent having transition
-                # copy the traces that are not under transition
-                all_transition_paths = []
-                for transition_combination in all_transition_combinations:
-                    transition_paths = []
-                    next_node_mode = copy.deepcopy(node.mode)
-                    next_node_static = copy.deepcopy(node.static)
-                    next_node_uncertain_param = copy.deepcopy(node.uncertain_param)
-                    next_node_agent = node.agent
-                    next_node_start_time = list(
-                        truncated_trace.values())[0][0][0]
-                    next_node_init = {}
-                    next_node_trace = {}
-                    for transition in transition_combination:
-                        transit_agent_idx, dest_mode, next_init, paths = transition
-                        if dest_mode is None:
-                            continue
-                        transition_paths.extend(paths)
-                        # next_node = AnalysisTreeNode(trace = {},init={},mode={},agent={}, child = [], start_time = 0)
-                        next_node_mode[transit_agent_idx] = dest_mode
-                        next_node_init[transit_agent_idx] = next_init
-                    for agent_idx in next_node_agent:
-                        if agent_idx not in next_node_init:
-                            next_node_trace[agent_idx] = truncated_trace[agent_idx]
-                            next_node_init[agent_idx] = truncated_trace[agent_idx][0][1:]
-
-                    all_transition_paths.append(transition_paths)
-
-                    tmp = AnalysisTreeNode(
-                        trace=next_node_trace,
-                        init=next_node_init,
-                        mode=next_node_mode,
-                        static=next_node_static,
-                        uncertain_param=next_node_uncertain_param,
-                        agent=next_node_agent,
-                        height=node.height + 1,
-                        child=[],
-                        start_time=next_node_start_time,
-                        type='simtrace'
-                    )
-                    node.child.append(tmp)
-                    simulation_queue.append(tmp)
-                # print(red("end sim"))
-                # Put the node in the child of current node. Put the new node in the queue
-            #     node.child.append(AnalysisTreeNode(
-            #         trace = next_node_trace,
-            #         init = next_node_init,
-            #         mode = next_node_mode,
-            #         agent = next_node_agent,
-            #         child = [],
-            #         start_time = next_node_start_time
-            #     ))
+                # Generate the transition combinations if multiple agents can transit at the same time step.
+                # The children are created lazily when the scheduler reaches them
+                simulation_queue.append(self._child_nodes(node, transitions, truncated_trace))
             # simulation_queue += node.child
-
-        self.simulation_tree = AnalysisTree(root)
-        return self.simulation_tree
+            yield node
+
+    @staticmethod
+    def _next_node(simulation_queue):
+        # The queue holds nodes and generators of sibling nodes. Siblings stay in front until
+        # all of them are processed, which keeps the BFS order
+        item = simulation_queue.popleft()
+        if isinstance(item, AnalysisTreeNode):
+            return item
+        node = next(item, None)
+        if node is not None:
+            simulation_queue.appendleft(item)
+        return node
+
+    def _transition_combinations(self, transitions):
+        """Lazily enumerate the combinations of transitions of agents that can transit at the
+        same time step, keeping at most config.branching_limit of them. The 'random' policy draws
+        them from branching_rng, seeded with config.branching_seed at the start of each run"""
+        transition_list = list(transitions.values())
+        limit = self.config.branching_limit
+        total = functools.reduce(lambda n, l: n * len(l), transition_list, 1)
+        if limit is None or total <= limit:
+            return itertools.product(*transition_list)
+        if self.config.branching_policy == 'first':
+            return itertools.islice(itertools.product(*transition_list), limit)
+        if self.config.branching_policy == 'random':
+            return (nth_combination(transition_list, i) for i in sorted(self.branching_rng.sample(range(total), limit)))
+        raise ValueError(f"Branching policy {self.config.branching_policy} not available.")
+
+    def _child_nodes(self, node: AnalysisTreeNode, transitions, truncated_trace):
+        """
+        Generate the children of node, one for each combination of transitions. Siblings share
+        the static and uncertain parameters of node, only the mode dict is copied.
+        """
+        next_node_start_time = list(truncated_trace.values())[0][0][0]
+        for transition_combination in self._transition_combinations(transitions):
+            next_node_mode = dict(node.mode)
+            next_node_init = {}
+            next_node_trace = {}
+            for transition in transition_combination:
+                transit_agent_idx, dest_mode, next_init, paths = transition
+                if dest_mode is None:
+                    continue
+                next_node_mode[transit_agent_idx] = dest_mode
+                next_node_init[transit_agent_idx] = next_init
+            for agent_idx in node.agent:
+                if agent_idx not in next_node_init:
+                    next_node_trace[agent_idx] = truncated_trace[agent_idx]
+                    next_node_init[agent_idx] = truncated_trace[agent_idx][0][1:]
+
+            tmp = AnalysisTreeNode(
+                trace=next_node_trace,
+                init=next_node_init,
+                mode=next_node_mode,
+                static=node.static,
+                uncertain_param=node.uncertain_param,
+                agent=node.agent,
+                height=node.height + 1,
+                child=[],
+                start_time=next_node_start_time,
+                type='simtrace'
+            )
+            node.child.append(tmp)
+            yield tmp
 
     def simulate_simple(self, init_list, init_mode_list, static_list, uncertain_param_list, agent_list,
                         transition_graph, time_horizon, time_step, lane_map, run_num, past_runs):
@@ -252,11 +314,13 @@ class Simulator:
             root.agent[agent.id] = agent
             root.type = 'simtrace'
 
-        simulation_queue = []
+        simulation_queue = deque()
         simulation_queue.append(root)
         # Perform BFS through the simulation tree to loop through all possible transitions
-        while simulation_queue != []:
-            node: AnalysisTreeNode = simulation_queue.pop(0)
+        while simulation_queue:
+            node: AnalysisTreeNode = self._next_node(simulation_queue)
+            if node is None:
+                continue
             # continue if we are at the depth limit
 
             pp(("start sim", node.start_time, {a: (*node.mode[a], *node.init[a]) for a in node.mode}))
@@ -305,64 +369,7 @@ class Simulator:
                     continue
 
                 # pp(("transit agents", transit_agents))
-
-                transition_list = list(transitions.values())
-                all_transition_combinations = itertools.product(
-                    *transition_list)
-
-                # For each possible transition, construct the new node.
-                # Obtain the new initial condition for agent having transition
-                # copy the traces that are not under transition
-                all_transition_paths = []
-                for transition_combination in all_transition_combinations:
-                    transition_paths = []
-                    next_node_mode = copy.deepcopy(node.mode)
-                    next_node_static = copy.deepcopy(node.static)
-                    next_node_uncertain_param = copy.deepcopy(node.uncertain_param)
-                    next_node_agent = node.agent
-                    next_node_start_time = list(
-                        truncated_trace.values())[0][0][0]
-                    next_node_init = {}
-                    next_node_trace = {}
-                    for transition in transition_combination:
-                        transit_agent_idx, dest_mode, next_init, paths = transition
-                        if dest_mode is None:
-                            continue
-                        transition_paths.extend(paths)
-                        # next_node = AnalysisTreeNode(trace = {},init={},mode={},agent={}, child = [], start_time = 0)
-                        next_node_mode[transit_agent_idx] = dest_mode
-                        next_node_init[transit_agent_idx] = next_init
-                    for agent_idx in next_node_agent:
-                        if agent_idx not in next_node_init:
-                            next_node_trace[agent_idx] = truncated_trace[agent_idx]
-                            next_node_init[agent_idx] = truncated_trace[agent_idx][0][1:]
-
-                    all_transition_paths.append(transition_paths)
-
-                    tmp = AnalysisTreeNode(
-                        trace=next_node_trace,
-                        init=next_node_init,
-                        mode=next_node_mode,
-                        static=next_node_static,
-                        uncertain_param=next_node_uncertain_param,
-                        agent=next_node_agent,
-                        height=node.height + 1,
-                        child=[],
-                        start_time=next_node_start_time,
-                        type='simtrace'
-                    )
-                    node.child.append(tmp)
-                    simulation_queue.append(tmp)
-                # print(red("end sim"))
-                # Put the node in the child of current node. Put the new node in the queue
-            #     node.child.append(AnalysisTreeNode(
-            #         trace = next_node_trace,
-            #         init = next_node_init,
-            #         mode = next_node_mode,
-            #         agent = next_node_agent,
-            #         child = [],
-            #         start_time = next_node_start_time
-            #     ))
+                simulation_queue.append(self._child_nodes(node, transitions, truncated_trace))
             # simulation_queue += node.child
 
         self.simulation_tree = AnalysisTree(root)
@@ -1,10 +1,21 @@
+import asyncio
 import copy
 import importlib
 import itertools
+import multiprocessing
+import os
+import pickle
+import signal
+import warnings
+import weakref
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from typing import Tuple, Dict, Callable, List, Optional, Union, Sequence
 
 import numpy as np
 
+from verse.parser.parser import dumps
+
 # Useful types
 Vector = Union[np.ndarray, Sequence[float]]
 Matrix = Union[np.ndarray, Sequence[Sequence[float]]]
@@ -385,13 +396,203 @@ def sample_rect(rect: List[List[float]], seed = None) -> List[float]:
     res = np.random.uniform(rect[0], rect[1]).tolist()
     return res
 
+def freeze(a):
+    """Hashable version of a, equal for equal lists, tuples, dicts and arrays"""
+    if isinstance(a, list):
+        return (list, tuple(freeze(v) for v in a))
+    if isinstance(a, tuple):
+        return (tuple, tuple(freeze(v) for v in a))
+    if isinstance(a, dict):
+        return (dict, frozenset((k, freeze(v)) for k, v in a.items()))
+    if isinstance(a, np.ndarray):
+        return (list, freeze(a.tolist())[1])
+    return a
+
 def dedup(l, f=lambda a:a):
+    # Keys are compared through their hash when they can be frozen, and one by one otherwise
     o = []
-    l = [(i, f(i)) for i in l]
-    for i, k in l:
-        for _, k_ in o:
-            if k == k_:
-                break
-        else:
-            o.append((i, k))
-    return [i for i, _ in o]
+    seen = set()
+    unhashable = []
+    for i in l:
+        k = f(i)
+        try:
+            h = freeze(k)
+            if h in seen:
+                continue
+            seen.add(h)
+        except TypeError:
+            if any(k == k_ for k_ in unhashable):
+                continue
+            unhashable.append(k)
+        o.append(i)
+    return o
+
+
+_parallel_job = None
+
+def _run_parallel_job(idx):
+    func, items = _parallel_job
+    return func(items[idx])
+
+def map_parallel(func, items, num_workers=None):
+    """
+    Apply func to each of the items using forked worker processes.
+    The workers inherit func and items from the parent instead of pickling them, since
+    agents and controllers can not be pickled. Falls back to a sequential map when
+    fork is not available, when there is nothing to parallelize, or when the workers
+    can't be started or die before returning their results.
+    """
+    global _parallel_job
+    items = list(items)
+    if num_workers is None:
+        num_workers = multiprocessing.cpu_count()
+    num_workers = min(num_workers, len(items))
+    if num_workers <= 1 or 'fork' not in multiprocessing.get_all_start_methods() or _parallel_job is not None:
+        return [func(item) for item in items]
+    _parallel_job = (func, items)
+    try:
+        with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context('fork')) as executor:
+            return list(executor.map(_run_parallel_job, range(len(items))))
+    except (BrokenProcessPool, OSError) as e:
+        warnings.warn(f"forked workers failed ({e!r}), running {len(items)} jobs sequentially")
+    finally:
+        _parallel_job = None
+    return [func(item) for item in items]
+
+class _JobCancelled(BaseException):
+    # Not an Exception, so that the job doesn't handle it as an error of its own
+    pass
+
+# Set in each worker process of a ForkPool by _init_pool_worker
+_pool_lock = None
+_pool_pids = None
+_pool_cancelled = None
+_pool_ticket = None
+
+def _init_pool_worker(lock, pids, cancelled):
+    global _pool_lock, _pool_pids, _pool_cancelled, _parallel_job
+    _pool_lock, _pool_pids, _pool_cancelled = lock, pids, cancelled
+    # Jobs started from here run sequentially, the pool already bounds the number of processes
+    _parallel_job = (None, ())
+    signal.signal(signal.SIGUSR1, _cancel_pool_job)
+
+def _cancel_pool_job(signum, frame):
+    # The signal may arrive just after the job it was meant for, only stop a cancelled job
+    if _pool_ticket is not None and _pool_cancelled[_pool_ticket]:
+        raise _JobCancelled()
+
+def _run_pool_job(ticket, job):
+    global _pool_ticket
+    with _pool_lock:
+        _pool_pids[ticket] = os.getpid()
+        cancelled = _pool_cancelled[ticket]
+    try:
+        if cancelled:
+            return None
+        func, args = pickle.loads(job)
+        _pool_ticket = ticket
+        try:
+            return func(*args)
+        finally:
+            _pool_ticket = None
+    except _JobCancelled:
+        return None
+    finally:
+        with _pool_lock:
+            _pool_pids[ticket] = 0
+
+class ForkPool:
+    """
+    Runs jobs from an asyncio event loop in a ProcessPoolExecutor of max_workers forked processes,
+    which is started with the first job and reused by the following ones. Jobs are pickled with
+    verse.parser.IRPickler, as agents hold compiled controllers, and results with pickle. At most
+    max_workers jobs are submitted at a time, the others wait in the event loop. Cancelling the
+    awaiting task interrupts the job in its worker, which then takes the next job.
+    """
+    def __init__(self, max_workers=None):
+        if max_workers is None:
+            max_workers = multiprocessing.cpu_count()
+        self.max_workers = max(1, max_workers)
+        self._executor: Optional[ProcessPoolExecutor] = None
+        # Each submitted job holds a ticket, an index in the shared arrays where its worker
+        # writes its pid and where the job is marked cancelled
+        self._tickets = list(range(self.max_workers))
+        self._lock = self._pids = self._cancelled = None
+        # asyncio semaphores are bound to the loop they are first used in, so each event loop
+        # (e.g. each asyncio.run) gets its own
+        self._slots: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = weakref.WeakKeyDictionary()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            ctx = multiprocessing.get_context('fork')
+            self._lock = ctx.Lock()
+            self._pids = ctx.Array('q', self.max_workers, lock=False)
+            self._cancelled = ctx.Array('b', self.max_workers, lock=False)
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=ctx, initializer=_init_pool_worker,
+                                                 initargs=(self._lock, self._pids, self._cancelled))
+        return self._executor
+
+    def shutdown(self):
+        """Stop the worker processes, they are started again by the next job"""
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    async def submit(self, func, *args):
+        loop = asyncio.get_running_loop()
+        if loop not in self._slots:
+            self._slots[loop] = asyncio.Semaphore(self.max_workers)
+        async with self._slots[loop]:
+            if 'fork' not in multiprocessing.get_all_start_methods():
+                return await loop.run_in_executor(None, func, *args)
+            job = dumps((func, args))
+            while not self._tickets:
+                # Taken by jobs from another event loop
+                await asyncio.sleep(0.01)
+            ticket = self._tickets.pop()
+            executor = self._get_executor()
+            self._cancelled[ticket] = 0
+            future = loop.run_in_executor(executor, _run_pool_job, ticket, job)
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                with self._lock:
+                    self._cancelled[ticket] = 1
+                    if self._pids[ticket]:
+                        os.kill(self._pids[ticket], signal.SIGUSR1)
+                # The worker is busy until the job stops
+                await asyncio.wait([future])
+                raise
+            except BrokenProcessPool:
+                if self._executor is executor:
+                    self._executor = None
+                raise RuntimeError("a worker process of the pool exited") from None
+            finally:
+                self._tickets.append(ticket)
+
+_default_pool = None
+
+def default_pool() -> ForkPool:
+    """The ForkPool shared by all scenarios, sized to the number of cores."""
+    global _default_pool
+    if _default_pool is None:
+        _default_pool = ForkPool()
+    return _default_pool
+
+# Sizes of CPython objects on 64 bit platforms, used to estimate memory from shapes instead of
+# walking the objects
+LIST_BYTES = 56
+REF_BYTES = 8
+FLOAT_BYTES = 24
+STR_BYTES = 56
+
+def trace_nbytes(trace) -> int:
+    """Approximate bytes held by a trace, a rectangle or a point: an array or nested lists of numbers.
+    Only the first element of each level is looked at, the others are assumed to be the same size."""
+    if isinstance(trace, np.ndarray):
+        return trace.nbytes
+    if not isinstance(trace, (list, tuple)):
+        return FLOAT_BYTES
+    if len(trace) == 0:
+        return LIST_BYTES
+    return LIST_BYTES + len(trace) * (REF_BYTES + trace_nbytes(trace[0]))
@@ -1,20 +1,47 @@
 import functools
 import itertools
 import pprint
-from typing import List
+import os
+import pickle
+import time
+from typing import Dict, List
 import copy
 
+from collections import defaultdict
 import numpy as np
 
 # from verse.agents.base_agent import BaseAgent
 from verse.analysis.analysis_tree import AnalysisTreeNode, AnalysisTree
+from verse.analysis.boxset import BoxSet
 from verse.analysis.dryvr import calc_bloated_tube, SIMTRACENUM
 from verse.analysis.mixmonotone import calculate_bloated_tube_mixmono_cont, calculate_bloated_tube_mixmono_disc
-from verse.analysis.incremental import ReachTubeCache, TubeCache, convert_reach_trans, to_simulate, combine_all
-from verse.analysis.utils import dedup
-from verse.parser.parser import find
+from verse.analysis.incremental import ReachTubeCache, TubeCache, convert_reach_trans, to_simulate, combine_all, transitions_nbytes
+from verse.analysis.utils import map_parallel
+from verse.parser.parser import IRPickler
 pp = functools.partial(pprint.pprint, compact=True, width=130)
 
+def most_sensitive_dim(mode_label, initial_set, time_horizon, time_step, sim_func, lane_map, scale):
+    """
+    Estimate which dimension of the initial set the trajectories are most sensitive to, by comparing
+    the simulation from the center of the box with simulations from the center of each of its faces.
+    Deviations are normalized by scale. Returns None if the box is a single point.
+    """
+    initial_set = np.array(initial_set, dtype=float)
+    center = (initial_set[0] + initial_set[1]) / 2
+    center_trace = np.array(sim_func(mode_label, center.tolist(), time_horizon, time_step, lane_map))
+    best_dim, best_sensitivity = None, -1
+    for dim in range(initial_set.shape[1]):
+        if initial_set[1, dim] <= initial_set[0, dim]:
+            continue
+        point = center.copy()
+        point[dim] = initial_set[1, dim]
+        trace = np.array(sim_func(mode_label, point.tolist(), time_horizon, time_step, lane_map))
+        length = min(len(trace), len(center_trace))
+        sensitivity = np.max(np.abs(trace[:length, 1:] - center_trace[:length, 1:]) / scale)
+        if sensitivity > best_sensitivity:
+            best_dim, best_sensitivity = dim, sensitivity
+    return best_dim
+
 class Verifier:
     def __init__(self, config):
         self.reachtube_tree = None
@@ -23,6 +50,138 @@ class Verifier:
         self.tube_cache_hits = (0, 0)
         self.trans_cache_hits = (0, 0)
         self.config = config
+        self.num_subsumed = 0
+        self.num_merged = 0
+        self.covered = []
+
+    @staticmethod
+    def mode_key(node: AnalysisTreeNode):
+        return tuple((agent_id, tuple(node.mode[agent_id])) for agent_id in sorted(node.mode))
+
+    @staticmethod
+    def subsumption_key(node: AnalysisTreeNode):
+        return (node.start_time, Verifier.mode_key(node))
+
+    @staticmethod
+    def contains(node: AnalysisTreeNode, new_boxes: Dict[str, BoxSet]) -> bool:
+        """Check if, for every agent, the box in new_boxes is contained in one of the initial rectangles of node"""
+        return all(BoxSet(node.init[agent_id]).contains(new_box).all() for agent_id, new_box in new_boxes.items())
+
+    def save_checkpoint(self, path, time_horizon, time_step, run_num, root: AnalysisTreeNode, verification_queue, num_calls, num_transitions):
+        """
+        Write the state of an ongoing compute_full_reachtube to path: the nodes of the partial tree, which of them
+        are still queued, the counters and the incremental caches. The file is replaced atomically, so a crash while
+        writing leaves the previous checkpoint intact.
+        """
+        nodes = AnalysisTree(root).nodes
+        index = {id(node): i for i, node in enumerate(nodes)}
+        def node_state(node):
+            return {
+                # Spilled traces are read back, as their files are removed along with the nodes
+                'trace': dict(node.trace), 'init': node.init, 'mode': node.mode, 'static': node.static,
+                'uncertain_param': node.uncertain_param, 'agent': list(node.agent), 'assert_hits': node.assert_hits,
+                'start_time': node.start_time, 'height': node.height, 'type': node.type,
+                'child': [index[id(c)] for c in node.child],
+            }
+        state = {
+            'time_horizon': time_horizon,
+            'time_step': time_step,
+            'run_num': run_num,
+            'nodes': [node_state(node) for node in nodes],
+            'queue': [index[id(node)] for node in verification_queue],
+            'covered': [(node_state(node), index[id(by)]) for node, by in self.covered],
+            'num_calls': num_calls,
+            'num_transitions': num_transitions,
+            'num_subsumed': self.num_subsumed,
+            'num_merged': self.num_merged,
+            'cache': self.cache,
+            'trans_cache': self.trans_cache,
+            'tube_cache_hits': self.tube_cache_hits,
+            'trans_cache_hits': self.trans_cache_hits,
+        }
+        tmp = f"{path}.{os.getpid()}.tmp"
+        with open(tmp, "wb") as f:
+            IRPickler(f).dump(state)
+        os.replace(tmp, path)
+
+    def load_checkpoint(self, path, time_horizon, time_step, run_num, agent_dict):
+        """
+        Read a checkpoint written by save_checkpoint. Returns the nodes of the partial tree in BFS order, the queued
+        nodes and the counters. The caches are only restored if they were saved by the run with the same index in
+        past_runs, as they refer to earlier runs by that index.
+        """
+        with open(path, "rb") as f:
+            state = pickle.load(f)
+        if state['time_horizon'] != time_horizon or state['time_step'] != time_step:
+            raise ValueError(f"checkpoint {path} was saved with time_horizon={state['time_horizon']} and time_step={state['time_step']}")
+        def make_node(data):
+            return AnalysisTreeNode(
+                trace=data['trace'], init=data['init'], mode=data['mode'], static=data['static'],
+                uncertain_param=data['uncertain_param'], agent={agent_id: agent_dict[agent_id] for agent_id in data['agent']},
+                assert_hits=data['assert_hits'], child=[], start_time=data['start_time'], height=data['height'], type=data['type'],
+            )
+        nodes = [make_node(data) for data in state['nodes']]
+        for node, data in zip(nodes, state['nodes']):
+            node.child = [nodes[i] for i in data['child']]
+        self.covered = [(make_node(data), nodes[i]) for data, i in state['covered']]
+        self.num_subsumed = state['num_subsumed']
+        self.num_merged = state['num_merged']
+        if state['run_num'] == run_num:
+            self.cache = state['cache']
+            self.trans_cache = state['trans_cache']
+            self.tube_cache_hits = state['tube_cache_hits']
+            self.trans_cache_hits = state['trans_cache_hits']
+        return nodes, [nodes[i] for i in state['queue']], state['num_calls'], state['num_transitions']
+
+    def cover(self, explored, new_node: AnalysisTreeNode) -> bool:
+        """
+        Check if new_node is covered by a node in explored, i.e. a node with the same modes that starts no later
+        than new_node and whose initial set contains the one of new_node. For time invariant dynamics, everything
+        reachable from new_node is then reachable from that node up to a time shift, so new_node doesn't need to be
+        expanded. Covered nodes are recorded in self.covered along with the node covering them.
+        """
+        new_boxes = {agent_id: BoxSet(inits).hull() for agent_id, inits in new_node.init.items()}
+        for node in explored[self.mode_key(new_node)]:
+            if node.start_time > new_node.start_time or node.static != new_node.static or node.uncertain_param != new_node.uncertain_param:
+                continue
+            if self.contains(node, new_boxes):
+                self.covered.append((new_node, node))
+                return True
+        return False
+
+    def subsume(self, visited, expanded, new_node: AnalysisTreeNode) -> bool:
+        """
+        Check if new_node is redundant given the nodes in visited that share its start time and modes.
+        It is redundant if, for every agent, its initial set is contained in one of the initial rectangles
+        of such a node. Otherwise, if such a node is still queued (its id is not in expanded) and the hull of
+        both initial sets is at most config.merge_ratio wider than the larger of them in every dimension,
+        the queued node is enlarged to the hull and new_node is also redundant.
+        """
+        new_boxes = {agent_id: BoxSet(inits).hull() for agent_id, inits in new_node.init.items()}
+        for node in visited[self.subsumption_key(new_node)]:
+            if node.static != new_node.static or node.uncertain_param != new_node.uncertain_param:
+                continue
+            if self.contains(node, new_boxes):
+                self.num_subsumed += 1
+                return True
+            if id(node) in expanded:
+                continue
+            hulls = {}
+            for agent_id, new_box in new_boxes.items():
+                old_box = BoxSet(node.init[agent_id]).hull()
+                hull = old_box.union(new_box).hull()
+                max_width = np.maximum(old_box.widths(), new_box.widths())
+                if np.any(hull.widths() > (1 + self.config.merge_ratio) * max_width):
+                    break
+                hulls[agent_id] = hull
+            else:
+                for agent_id, hull in hulls.items():
+                    if not np.array_equal(hull.data, BoxSet(node.init[agent_id]).hull().data):
+                        node.init[agent_id] = hull.tolist()
+                        node.trace.pop(agent_id, None)
+                self.num_merged += 1
+                return True
+        return False
 
     def calculate_full_bloated_tube(
         self,
@@ -38,7 +197,8 @@ class Verifier:
         combine_seg_length = 1000,
         guard_checker=None,
         guard_str="",
-        lane_map = None
+        lane_map = None,
+        batch_sim_func = None
     ):
         # Handle Parameters
         bloating_method = 'PW'
@@ -70,6 +230,21 @@ class Verifier:
                 cached = None
             if cached != None:
                 cur_bloated_tube = cached.tube
+            elif 'refine_width' in params:
+                cur_bloated_tube = self.calculate_refined_bloated_tube(mode_label,
+                                            combined_rect,
+                                            time_horizon,
+                                            time_step,
+                                            sim_func,
+                                            bloating_method,
+                                            kvalue,
+                                            sim_trace_num,
+                                            lane_map,
+                                            params,
+                                            batch_sim_func
+                                            )
+                if self.config.incremental:
+                    self.cache.add_tube(agent_id, mode_label, combined_rect, cur_bloated_tube)
             else:
                 cur_bloated_tube = calc_bloated_tube(mode_label,
                                             combined_rect,
@@ -79,7 +254,8 @@ class Verifier:
                                             bloating_method,
                                             kvalue,
                                             sim_trace_num,
-                                            lane_map = lane_map
+                                            lane_map = lane_map,
+                                            batch_sim_func = batch_sim_func
                                             )
                 if self.config.incremental:
                     self.cache.add_tube(agent_id, mode_label, combined_rect, cur_bloated_tube)
@@ -100,6 +276,75 @@ class Verifier:
                 )
         return res_tube.tolist()
 
+    def calculate_refined_bloated_tube(
+        self,
+        mode_label,
+        initial_set,
+        time_horizon,
+        time_step,
+        sim_func,
+        bloating_method,
+        kvalue,
+        sim_trace_num,
+        lane_map,
+        params,
+        batch_sim_func=None
+    ):
+        """
+        Adaptively partition the initial set. A box whose bloated tube is wider than params['refine_width']
+        (a number or one number per dimension) is split in half along its most sensitive dimension, at most
+        params['refine_depth'] times. The tubes of each level of the partition are computed in parallel by
+        params['refine_workers'] forked processes, or in this process when it is 1, fork is not available or
+        the workers fail, and the union of the tubes of all the final boxes is returned.
+        """
+        max_width = np.array(params['refine_width'], dtype=float)
+        max_depth = params.get('refine_depth', 3)
+        num_workers = params.get('refine_workers', os.cpu_count())
+
+        def compute_tube(rect):
+            return calc_bloated_tube(mode_label,
+                                     rect,
+                                     time_horizon,
+                                     time_step,
+                                     sim_func,
+                                     bloating_method,
+                                     kvalue,
+                                     sim_trace_num,
+                                     lane_map = lane_map,
+                                     batch_sim_func = batch_sim_func
+                                     )
+
+        boxes = [np.array(initial_set, dtype=float)]
+        tubes = [compute_tube(initial_set)]
+        leaf_tubes = []
+        for depth in range(max_depth + 1):
+            next_boxes = []
+            for box, tube in zip(boxes, tubes):
+                width = np.max(tube[1::2, 1:] - tube[::2, 1:], axis=0)
+                if depth == max_depth or np.all(width <= max_width):
+                    leaf_tubes.append(tube)
+                    continue
+                dim = most_sensitive_dim(mode_label, box, time_horizon, time_step, sim_func, lane_map, max_width)
+                if dim is None:
+                    leaf_tubes.append(tube)
+                    continue
+                mid = (box[0, dim] + box[1, dim]) / 2
+                lower_box, upper_box = box.copy(), box.copy()
+                lower_box[1, dim] = mid
+                upper_box[0, dim] = mid
+                next_boxes += [lower_box, upper_box]
+            if not next_boxes:
+                break
+            boxes = next_boxes
+            tubes = map_parallel(compute_tube, [box.tolist() for box in boxes], num_workers)
+
+        tube_length = min(len(tube) for tube in leaf_tubes)
+        res_tube = np.array(leaf_tubes[0][:tube_length])
+        for tube in leaf_tubes[1:]:
+            res_tube[::2, 1:] = np.minimum(res_tube[::2, 1:], tube[:tube_length:2, 1:])
+            res_tube[1::2, 1:] = np.maximum(res_tube[1::2, 1:], tube[1:tube_length:2, 1:])
+        return res_tube
+
 
     def compute_full_reachtube(
         self,
@@ -118,6 +363,12 @@ class Verifier:
         past_runs,
         params = {},
     ):
+        for _ in self.compute_full_reachtube_iter(init_list, init_mode_list, static_list, uncertain_param_list, agent_list, transition_graph,
+                                                  time_horizon, time_step, lane_map, init_seg_length, reachability_method, run_num, past_runs, params):
+            pass
+        return self.reachtube_tree
+
+    def _init_reachtube(self, init_list, init_mode_list, static_list, uncertain_param_list, agent_list):
         root = AnalysisTreeNode(
             trace={},
             init={},
@@ -144,15 +395,69 @@ class Verifier:
             root.type = 'reachtube'
         verification_queue = []
         verification_queue.append(root)
-        num_calls = 0
-        num_transitions = 0
+        visited = defaultdict(list)
+        visited[self.subsumption_key(root)].append(root)
+        explored = defaultdict(list)
+        explored[self.mode_key(root)].append(root)
+        self.covered = []
+        expanded = set()
+        return root, verification_queue, visited, explored, expanded
+
+    def compute_full_reachtube_iter(
+        self,
+        init_list: List[float],
+        init_mode_list: List[str],
+        static_list: List[str],
+        uncertain_param_list: List[float],
+        agent_list,
+        transition_graph,
+        time_horizon,
+        time_step,
+        lane_map,
+        init_seg_length,
+        reachability_method,
+        run_num,
+        past_runs,
+        params = {},
+        resume_from = None,
+    ):
+        """Generator version of compute_full_reachtube. Nodes are yielded in BFS order, starting from
+        the root, once their reachtubes, assert hits and children are final. Closing the generator
+        stops the computation. If config.checkpoint_file is set, the state of the computation is saved
+        there every config.checkpoint_interval seconds, and resume_from continues from such a file
+        (the nodes that were already done are yielded first)."""
+        if resume_from is not None:
+            nodes, verification_queue, num_calls, num_transitions = self.load_checkpoint(
+                resume_from, time_horizon, time_step, run_num, {agent.id: agent for agent in agent_list})
+            root = nodes[0]
+            queued = set(id(node) for node in verification_queue)
+            visited = defaultdict(list)
+            explored = defaultdict(list)
+            expanded = set()
+            for node in nodes:
+                visited[self.subsumption_key(node)].append(node)
+                explored[self.mode_key(node)].append(node)
+                if id(node) not in queued:
+                    expanded.add(id(node))
+                    yield node
+        else:
+            root, verification_queue, visited, explored, expanded = self._init_reachtube(
+                init_list, init_mode_list, static_list, uncertain_param_list, agent_list)
+            num_calls = 0
+            num_transitions = 0
+        last_checkpoint = time.time()
         while verification_queue != []:
+            if self.config.checkpoint_file is not None and time.time() - last_checkpoint >= self.config.checkpoint_interval:
+                self.save_checkpoint(self.config.checkpoint_file, time_horizon, time_step, run_num, root, verification_queue, num_calls, num_transitions)
+                last_checkpoint = time.time()
             node: AnalysisTreeNode = verification_queue.pop(0)
+            expanded.add(id(node))
             combined_inits = {a: combine_all(inits) for a, inits in node.init.items()}
             print(node.mode)
             # pp(("start sim", node.start_time, {a: (*node.mode[a], *combined_inits[a]) for a in node.mode}))
             remain_time = round(time_horizon - node.start_time, 10)
             if remain_time <= 0:
+                yield node
                 continue
             num_transitions += 1
             cached_tubes = {}
@@ -189,7 +494,8 @@ class Verifier:
                                             100,
                                             SIMTRACENUM,
                                             combine_seg_length=init_seg_length,
-                                            lane_map = lane_map
+                                            lane_map = lane_map,
+                                            batch_sim_func = getattr(node.agent[agent_id], 'TC_simulate_batch', None)
                                             )
                     elif reachability_method == "NeuReach":
                         from verse.analysis.NeuReach.NeuReach_onestep_rect import postCont
@@ -220,7 +526,8 @@ class Verifier:
                             remain_time,
                             time_step,
                             node.agent[agent_id],
-                            lane_map
+                            lane_map,
+                            params
                         ) 
                     else:
                         raise ValueError(f"Reachability computation method {reachability_method} not available.")
@@ -235,20 +542,21 @@ class Verifier:
             if len(node_ids) == 1 and len(cached_tubes.keys()) == len(node.agent):
                 old_run_num, old_node_id = node_ids[0]
                 if old_run_num != run_num:
-                    old_node = find(past_runs[old_run_num].nodes, lambda n: n.id == old_node_id)
+                    old_node = past_runs[old_run_num].get_node(old_node_id)
                     assert old_node != None
                     new_cache, paths_to_sim = to_simulate(old_node.agent, node.agent, cached_tubes)
                     # pp(("to sim", new_cache.keys(), len(paths_to_sim)))
 
             # Get all possible transitions to next mode
             asserts, all_possible_transitions = transition_graph.get_transition_verify(new_cache, paths_to_sim, node)
-            pp(("transitions:", [(t[0], t[2]) for t in all_possible_transitions]))
             node.assert_hits = asserts
             if asserts != None:
                 asserts, idx = asserts
                 for agent in node.agent:
                     node.trace[agent] = node.trace[agent][:(idx + 1) * 2]
+                yield node
                 continue
+            pp(("transitions:", [(t[0], t[2]) for t in all_possible_transitions]))
 
             transit_map = {k: list(l) for k, l in itertools.groupby(all_possible_transitions, key=lambda p:p[0])}
             transit_agents = transit_map.keys()
@@ -258,10 +566,8 @@ class Verifier:
                 for agent_id in node.agent:
                     transition = transit_map[agent_id] if agent_id in transit_agents else []
                     if agent_id in cached_tubes:
-                        cached_tubes[agent_id].transitions.extend(convert_reach_trans(agent_id, transit_agents, node.init, transition, transit_ind))
-                        pre_len = len(cached_tubes[agent_id].transitions)
-                        cached_tubes[agent_id].transitions = dedup(cached_tubes[agent_id].transitions, lambda i: (i.mode, i.dest, i.inits))
-                        # pp(("dedup!", pre_len, len(cached_tubes[agent_id].transitions)))
+                        added = cached_tubes[agent_id].transitions.extend(convert_reach_trans(agent_id, transit_agents, node.init, transition, transit_ind))
+                        self.trans_cache.nbytes += transitions_nbytes(added)
                     else:
                         self.trans_cache.add_tube(agent_id, combined_inits, node, transit_agents, transition, transit_ind, run_num)
 
@@ -310,8 +616,14 @@ class Verifier:
                     start_time=round(next_node_start_time, 10),
                     type='reachtube'
                 )
+                if self.config.detect_fixed_point and self.cover(explored, tmp):
+                    continue
+                if self.config.subsume_nodes and self.subsume(visited, expanded, tmp):
+                    continue
                 node.child.append(tmp)
                 verification_queue.append(tmp)
+                visited[self.subsumption_key(tmp)].append(tmp)
+                explored[self.mode_key(tmp)].append(tmp)
 
             """Truncate trace of current node based on max_end_idx"""
             """Only truncate when there's transitions"""
@@ -319,12 +631,11 @@ class Verifier:
                 for agent_idx in node.agent:
                     node.trace[agent_idx] = node.trace[agent_idx][:(
                         max_end_idx+1)*2]
+            yield node
 
         self.reachtube_tree = AnalysisTree(root)
         # print(f">>>>>>>> Number of calls to reachability engine: {num_calls}")
         # print(f">>>>>>>> Number of transitions happening: {num_transitions}")
         self.num_transitions = num_transitions
 
-        return self.reachtube_tree
-
 
@@ -1,4 +1,5 @@
-import itertools, copy
+import itertools, copy, ast, builtins, functools
+from typing import Callable, List, Optional, Tuple
 import numpy as np
 
 from verse.parser import unparse
@@ -17,6 +18,52 @@ class ResetExpression():
             return False 
         return self.var == o.var and self.expr == o.expr
 
+@functools.lru_cache(maxsize=None)
+def compile_reset(expr: str) -> Optional[Tuple[List[str], Callable]]:
+    """
+    Compile a continuous reset expression into a function of the dotted variables it reads
+    (e.g. ego.x), returned together with their names in argument order. Returns None if
+    the expression reads anything else than these variables and builtins.
+    """
+    names = []
+    class _Rename(ast.NodeTransformer):
+        def visit_Attribute(self, node):
+            if not isinstance(node.value, ast.Name):
+                return self.generic_visit(node)
+            name = f"{node.value.id}.{node.attr}"
+            if name not in names:
+                names.append(name)
+            return ast.copy_location(ast.Name(id=f"_v{names.index(name)}", ctx=ast.Load()), node)
+    try:
+        body = _Rename().visit(ast.parse(expr, mode='eval').body)
+    except SyntaxError:
+        return None
+    for node in ast.walk(body):
+        if isinstance(node, ast.Name) and not node.id.startswith('_v') and not hasattr(builtins, node.id):
+            return None
+    args = ast.arguments(posonlyargs=[], args=[ast.arg(arg=f"_v{i}") for i in range(len(names))],
+                         kwonlyargs=[], kw_defaults=[], defaults=[])
+    func = ast.fix_missing_locations(ast.Expression(ast.Lambda(args=args, body=body)))
+    return names, eval(compile(func, '<reset>', 'eval'), {})
+
+def eval_reset_corners(func: Callable, bounds) -> Tuple[float, float]:
+    """
+    Evaluate a compiled reset at all the corners of the intervals in bounds at once, returning
+    the smallest and largest value. Falls back to one call per corner for expressions that
+    don't work on arrays.
+    """
+    if not bounds:
+        res = func()
+        return res, res
+    corners = np.meshgrid(*[np.asarray(b, dtype=float) for b in bounds], indexing='ij')
+    try:
+        with np.errstate(all='raise'):
+            res = np.broadcast_to(func(*corners), corners[0].shape)
+        return float(res.min()), float(res.max())
+    except Exception:
+        res = [func(*corner) for corner in itertools.product(*[np.asarray(b, dtype=float).tolist() for b in bounds])]
+        return min(res), max(res)
+
 # class ResetExpression:
 #     def __init__(self, reset_list):
 #         self.ast_list = []
@@ -1,6 +1,7 @@
 from audioop import ratecv
-from typing import Dict, List
+from typing import Dict, List, Optional
 import copy
+from dataclasses import dataclass, field
 from enum import Enum
 
 import numpy as np
@@ -9,6 +10,21 @@ from verse.map.lane_segment_3d import AbstractLane_3d
 from verse.map.lane_3d import Lane_3d
 
 
+@dataclass
+class WaypointTracker:
+    """
+    Waypoint tracking state of one simulation: the current waypoint, the segment it is on and the
+    waypoints visited so far. It is kept out of LaneMap_3d so that the map is never modified and can
+    be shared between simulations, threads and processes.
+    """
+    curr_wp: Optional[List[float]] = None
+    curr_seg: Optional[AbstractLane_3d] = None
+    wps: List[List[float]] = field(default_factory=list)
+
+    def copy(self) -> "WaypointTracker":
+        return WaypointTracker(self.curr_wp, self.curr_seg, list(self.wps))
+
+
 class LaneMap_3d:
 
     def __init__(self, lane_seg_list: List[Lane_3d] = []):
@@ -26,9 +42,6 @@ class LaneMap_3d:
 
         # self.box_side = box_side
         # self.t_v_pair = t_v_pair
-        self.curr_wp = {}
-        self.curr_seg = {}
-        self.wps = {}
 
     def trans_func(self, lane_idx: str) -> str:
         lane = 'T'+lane_idx[-1]
@@ -232,27 +245,27 @@ class LaneMap_3d:
     def get_curr_waypoint(self, agent_id):
         return self.waypoints[agent_id]
 
-    def check_guard_box(self, agent_id, state, box_side):
-        dest = self.curr_wp[agent_id][3:]
+    def check_guard_box(self, tracker: WaypointTracker, state, box_side):
+        dest = tracker.curr_wp[3:]
         for i in range(len(dest)):
             if state[i] < dest[i]-box_side[i]/2 or state[i] > dest[i]+box_side[i]/2:
                 return False
         return True
 
-    def get_next_point(self, lane, agent_id, pos, velocity, t_v_pair):
+    def get_next_point(self, lane, tracker: WaypointTracker, pos, velocity, t_v_pair):
         est_len = t_v_pair[0]*t_v_pair[1]
         if isinstance(pos, np.ndarray):
             curr_point = pos[:3]
-        elif agent_id in self.curr_wp:
-            curr_point = self.curr_wp[agent_id][3:]
+        elif tracker.curr_wp is not None:
+            curr_point = tracker.curr_wp[3:]
         else:
             raise ValueError
         seg, possible_seg = self.get_lane_segment(lane, curr_point)
-        if agent_id not in self.curr_seg:
-            self.curr_seg[agent_id] = seg
+        if tracker.curr_seg is None:
+            tracker.curr_seg = seg
         else:
-            if self.curr_seg[agent_id] in possible_seg:
-                seg = self.curr_seg[agent_id]
+            if tracker.curr_seg in possible_seg:
+                seg = tracker.curr_seg
         longitudinal, lateral, theta = seg.local_coordinates(curr_point)
 
         rate = 0.7
@@ -279,15 +292,12 @@ class LaneMap_3d:
                     max_in = d
                     next_seg = n_seg
             next_point = next_seg.position(0, lateral, theta)
-            self.curr_seg[agent_id] = next_seg
+            tracker.curr_seg = next_seg
 
         next_waypoint = list(curr_point) + next_point.tolist()
 
-        self.curr_wp[agent_id] = next_waypoint
-        if agent_id not in self.wps:
-            self.wps[agent_id] = [next_waypoint]
-        else:
-            self.wps[agent_id].append(next_waypoint)
+        tracker.curr_wp = next_waypoint
+        tracker.wps.append(next_waypoint)
         # print('next', next_waypoint)
         return next_waypoint
 
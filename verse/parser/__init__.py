@@ -1,2 +1,2 @@
-from .parser import ControllerIR, StateDef, ModeDef, Lambda, Reduction, ReductionType, unparse
+from .parser import ControllerIR, StateDef, ModeDef, Lambda, Reduction, ReductionType, IRPickler, unparse
 from . import astunparser, parser
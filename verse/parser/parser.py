@@ -1,6 +1,6 @@
-import ast, copy, warnings
+import ast, copy, warnings, hashlib, io, marshal, os, pickle, sys, types
 from typing import List, Dict, Union, Optional, Any, Tuple
-from dataclasses import dataclass, field, fields
+from dataclasses import dataclass, field, fields, replace
 from enum import Enum, auto
 from verse.parser import astunparser
 
@@ -264,7 +264,25 @@ class ControllerIR:
 
     @staticmethod
     def parse(code: Optional[str] = None, fn: Optional[str] = None) -> "ControllerIR":
-        return ControllerIR.from_env(Env.parse(code, fn))
+        """
+        Parse the controller, reusing the IR of any controller with the same source text parsed
+        before in this process, or in PARSE_CACHE_DIR when it is set
+        """
+        if code == None:
+            if fn == None:
+                raise TypeError("need at least one of `code` and `fn`")
+            with open(fn) as f:
+                code = f.read()
+        key = hashlib.sha256(code.encode()).hexdigest()
+        ir = _parse_cache.get(key)
+        if ir == None:
+            ir = _load_ir(key)
+            if ir == None:
+                ir = ControllerIR.from_env(Env.parse(code, fn))
+                _store_ir(key, ir)
+            _parse_cache[key] = ir
+        # The lanes of the map get added to mode_defs, so that part can't be shared
+        return replace(ir, mode_defs=copy.deepcopy(ir.mode_defs))
 
     @staticmethod
     def empty() -> "ControllerIR":
@@ -334,6 +352,56 @@ class ControllerIR:
                     paths.append(ModePath(cond, cond_veri, var, val, val_veri))
         return ControllerIR(controller.args, paths, asserts_sim, asserts_veri, env.state_defs, env.mode_defs, env.controller_code)
 
+# Parsed controllers by hash of their source text
+_parse_cache: Dict[str, ControllerIR] = {}
+# Directory for pickled controllers shared between processes, disabled when None
+PARSE_CACHE_DIR: Optional[str] = os.environ.get("VERSE_PARSE_CACHE_DIR")
+
+class IRPickler(pickle.Pickler):
+    """
+    Pickler for parsed controllers and anything holding them (agents, scenarios, checkpoints).
+    Their compiled conditions and values aren't picklable, so code objects are marshalled. The
+    result is read back with pickle.load, by the same python version.
+    """
+    def reducer_override(self, obj):
+        if isinstance(obj, types.CodeType):
+            return marshal.loads, (marshal.dumps(obj),)
+        return NotImplemented
+
+def dumps(obj) -> bytes:
+    """Pickle obj with IRPickler"""
+    f = io.BytesIO()
+    IRPickler(f).dump(obj)
+    return f.getvalue()
+
+def _ir_path(key: str) -> str:
+    # marshal's format depends on the python version
+    return os.path.join(PARSE_CACHE_DIR, f"{key}-py{sys.version_info[0]}{sys.version_info[1]}.pkl")
+
+def _load_ir(key: str) -> Optional[ControllerIR]:
+    if PARSE_CACHE_DIR == None:
+        return None
+    try:
+        with open(_ir_path(key), "rb") as f:
+            return pickle.load(f)
+    except Exception:
+        return None
+
+def _store_ir(key: str, ir: ControllerIR):
+    if PARSE_CACHE_DIR == None:
+        return
+    path = _ir_path(key)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    try:
+        os.makedirs(PARSE_CACHE_DIR, exist_ok=True)
+        with open(tmp, "wb") as f:
+            IRPickler(f).dump(ir)
+        os.replace(tmp, path)
+    except Exception as e:
+        warnings.warn(f"can't store parsed controller in {PARSE_CACHE_DIR}: {e}")
+        if os.path.exists(tmp):
+            os.remove(tmp)
+
 @dataclass
 class Env():
     controller_code: str
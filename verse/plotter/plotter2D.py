@@ -4,11 +4,13 @@ This file consist main plotter code for DryVR reachtube output
 
 from __future__ import annotations
 import copy
+from collections import defaultdict
 import numpy as np
 import plotly.graph_objects as go
-from typing import List, Tuple, Union
+from typing import Dict, List, Tuple, Union
 from plotly.graph_objs.scatter import Marker
 from verse.analysis.analysis_tree import AnalysisTree, AnalysisTreeNode
+from verse.analysis.boxset import BoxSet
 from verse.map.lane_map import LaneMap
 
 colors = [
@@ -161,43 +163,20 @@ def simulation_anime(root: Union[AnalysisTree, AnalysisTreeNode], map=None, fig=
         num_digit = 3
     org_root = copy.deepcopy(root)
     root = sample_trace(root, sample_rate)
-    timed_point_dict = {}
-    queue = [root]
-    x_min, x_max = float('inf'), -float('inf')
-    y_min, y_max = float('inf'), -float('inf')
     # input check
     num_dim = np.array(root.trace[list(root.agent.keys())[0]]).shape[1]
     check_dim(num_dim, x_dim, y_dim, print_dim_list)
     if print_dim_list is None:
         print_dim_list = range(0, num_dim)
     agent_list = list(root.agent.keys())
-    num_points = 0
-    while queue != []:
-        node = queue.pop()
-        traces = node.trace
-        for agent_id in traces:
-            trace = np.array(traces[agent_id])
-            for i in range(len(trace)):
-                x_min = min(x_min, trace[i][x_dim])
-                x_max = max(x_max, trace[i][x_dim])
-                y_min = min(y_min, trace[i][y_dim])
-                y_max = max(y_max, trace[i][y_dim])
-                time_point = round(trace[i][0], num_digit)
-                tmp_trace = trace[i][0:].tolist()
-                if time_point not in timed_point_dict:
-                    num_points += 1
-                    timed_point_dict[time_point] = {agent_id: [tmp_trace]}
-                else:
-                    if agent_id not in timed_point_dict[time_point].keys():
-                        timed_point_dict[time_point][agent_id] = [tmp_trace]
-                    elif tmp_trace not in timed_point_dict[time_point][agent_id]:
-                        timed_point_dict[time_point][agent_id].append(
-                            tmp_trace)
-        queue += node.child
+    tree = AnalysisTree(root)
+    frames = anime_frames(tree, num_digit)
+    x_min, x_max, y_min, y_max = trace_bounds(tree, x_dim, y_dim)
+    num_points = len(frames)
     duration = int(5000/num_points/speed_rate)
     fig_dict, sliders_dict = create_anime_dict(duration)
     # used for trail mode
-    time_list = list(timed_point_dict.keys())
+    time_list = list(frames)
     agent_list = list(root.agent.keys())
     trail_limit = min(10, len(time_list))
     trail_len = trail_limit
@@ -208,7 +187,7 @@ def simulation_anime(root: Union[AnalysisTree, AnalysisTreeNode], map=None, fig=
 
     if anime_mode == 'normal':
         # make data
-        trace_dict = timed_point_dict[0]
+        trace_dict = frames[time_list[0]]
         for agent_id, trace_list in trace_dict.items():
             color = colors[agent_list.index(agent_id) % num_theme][1]
             x_list = []
@@ -236,10 +215,10 @@ def simulation_anime(root: Union[AnalysisTree, AnalysisTreeNode], map=None, fig=
             }
             fig_dict["data"].append(data_dict)
         # make frames
-        for time_point in timed_point_dict:
+        for time_point in time_list:
             frame = {"data": [], "layout": {
                 "annotations": []}, "name": time_point}
-            point_list = timed_point_dict[time_point]
+            point_list = frames[time_point]
             for agent_id, trace_list in point_list.items():
                 color = colors[agent_list.index(agent_id) % num_theme][1]
                 x_list = []
@@ -281,9 +260,8 @@ def simulation_anime(root: Union[AnalysisTree, AnalysisTreeNode], map=None, fig=
         fig_dict["layout"]["sliders"] = [sliders_dict]
     else:
         # make data
-        trace_dict = timed_point_dict[0]
-        for time_point in list(timed_point_dict.keys())[0:int(trail_limit/step)]:
-            trace_dict = timed_point_dict[time_point]
+        for time_point in time_list[0:int(trail_limit/step)]:
+            trace_dict = frames[time_point]
             for agent_id, point_list in trace_dict.items():
                 x_list = []
                 y_list = []
@@ -312,7 +290,7 @@ def simulation_anime(root: Union[AnalysisTree, AnalysisTreeNode], map=None, fig=
             for agent_id in agent_list:
                 color = colors[agent_list.index(agent_id) % num_theme][1]
                 for id in range(0, trail_len, step):
-                    tmp_point_list = timed_point_dict[time_list[time_point_id-id]][agent_id]
+                    tmp_point_list = frames[time_list[time_point_id-id]].get(agent_id, [])
                     trace_x = []
                     trace_y = []
                     text_list = []
@@ -520,47 +498,21 @@ def reachtube_anime(root: Union[AnalysisTree, AnalysisTreeNode], map=None, fig=g
         num_digit = 3
     root = sample_trace(root, sample_rate)
     agent_list = list(root.agent.keys())
-    timed_point_dict = {}
-    queue = [root]
-    x_min, x_max = float('inf'), -float('inf')
-    y_min, y_max = float('inf'), -float('inf')
     # input check
     num_dim = np.array(root.trace[list(root.agent.keys())[0]]).shape[1]
     check_dim(num_dim, x_dim, y_dim, print_dim_list)
     if print_dim_list is None:
         print_dim_list = range(0, num_dim)
     # scheme_list = list(scheme_dict.keys())
-    num_points = 0
-    while queue != []:
-        node = queue.pop()
-        traces = node.trace
-        for agent_id in traces:
-            trace = np.array(traces[agent_id])
-            if trace[0][0] > 0:
-                trace = trace[8:]
-            for i in range(0, len(trace)-1, 2):
-                x_min = min(x_min, trace[i][x_dim])
-                x_max = max(x_max, trace[i][x_dim])
-                y_min = min(y_min, trace[i][y_dim])
-                y_max = max(y_max, trace[i][y_dim])
-                time_point = round(trace[i][0], num_digit)
-                rect = [trace[i][0:].tolist(), trace[i+1][0:].tolist()]
-                if time_point not in timed_point_dict:
-                    num_points += 1
-                    timed_point_dict[time_point] = {agent_id: [rect]}
-                else:
-                    if agent_id in timed_point_dict[time_point].keys():
-                        timed_point_dict[time_point][agent_id].append(rect)
-                    else:
-                        timed_point_dict[time_point][agent_id] = [rect]
-
-        queue += node.child
+    tree = AnalysisTree(root)
+    frames = anime_frames(tree, num_digit, reachtube=True)
+    x_min, x_max, y_min, y_max = trace_bounds(tree, x_dim, y_dim)
+    num_points = len(frames)
     duration = int(5000/num_points/speed_rate)
     fig_dict, sliders_dict = create_anime_dict(duration)
-    for time_point in timed_point_dict:
+    for time_point, agent_dict in frames.items():
         frame = {"data": [], "layout": {
             "annotations": [], "shapes": []}, "name": time_point}
-        agent_dict = timed_point_dict[time_point]
         for agent_id, rect_list in agent_dict.items():
             for rect in rect_list:
                 shape_dict = {
@@ -660,6 +612,60 @@ def reachtube_anime(root: Union[AnalysisTree, AnalysisTreeNode], map=None, fig=g
 """Functions below are low-level functions and usually are not called outside this file."""
 
 
+def anime_frames(tree: AnalysisTree, num_digit: int = 3, reachtube: bool = False) -> Dict[float, Dict[str, np.ndarray]]:
+    """Points (or rectangles for reachtubes) of every agent in each frame of an animation, by time rounded to num_digit.
+    The points of a frame are looked up with AnalysisTree.boxes_at; identical points shared by branches are shown once."""
+    # Exact times of the points, grouped by the frame they are shown in
+    frame_times = defaultdict(set)
+    for node in tree.nodes:
+        for trace in node.trace.values():
+            if reachtube and len(trace) > 0:
+                start = _tube_start(trace)
+                trace = [row for row in trace[::2] if row[0] >= start]
+            for row in trace:
+                frame_times[round(row[0], num_digit)].add(row[0])
+    agent_list = list(tree.root.agent.keys())
+    frames = {}
+    for time_point in sorted(frame_times):
+        frame = {}
+        for agent_id in agent_list:
+            points = []
+            for time in sorted(frame_times[time_point]):
+                for node, rows in tree.boxes_at(agent_id, time):
+                    if not reachtube:
+                        points.append(rows[0])
+                    elif rows[0][0] == time and time >= _tube_start(node.trace[agent_id]):
+                        # Rectangles are shown at the time they start
+                        points.append(rows)
+            if points:
+                points = np.array(points, dtype=float)
+                frame[agent_id] = points if reachtube else np.unique(points, axis=0)
+        frames[time_point] = frame
+    return frames
+
+
+def _tube_start(trace) -> float:
+    # The first rectangles of a child overlap with the end of its parent, so they are not shown
+    offset = 8 if trace[0][0] > 0 else 0
+    return trace[offset][0] if len(trace) > offset else float('inf')
+
+
+def trace_bounds(tree: AnalysisTree, x_dim: int, y_dim: int) -> Tuple[float, float, float, float]:
+    """Ranges of the two dimensions over all the traces of the tree"""
+    x_min, x_max = float('inf'), -float('inf')
+    y_min, y_max = float('inf'), -float('inf')
+    for node in tree.nodes:
+        for trace in node.trace.values():
+            if len(trace) == 0:
+                continue
+            trace = np.array(trace, dtype=float)
+            x_min = min(x_min, trace[:, x_dim].min())
+            x_max = max(x_max, trace[:, x_dim].max())
+            y_min = min(y_min, trace[:, y_dim].min())
+            y_max = max(y_max, trace[:, y_dim].max())
+    return x_min, x_max, y_min, y_max
+
+
 def reachtube_tree_single(root: Union[AnalysisTree, AnalysisTreeNode], agent_id, fig=go.Figure(), x_dim: int = 1, y_dim: int = 2, color=None, print_dim_list=None, combine_rect=1, plot_color = None):
     """It statically shows the verfication traces of one given agent."""
     if isinstance(root, AnalysisTree):
@@ -690,15 +696,9 @@ def reachtube_tree_single(root: Union[AnalysisTree, AnalysisTreeNode], agent_id,
                                      showlegend=show_legend
                                      ))
         elif combine_rect == None:
-            max_id = len(trace)-1
-            trace_x_odd = np.array([trace[i][x_dim]
-                                   for i in range(0, max_id, 2)])
-            trace_x_even = np.array([trace[i][x_dim]
-                                    for i in range(1, max_id+1, 2)])
-            trace_y_odd = np.array([trace[i][y_dim]
-                                   for i in range(0, max_id, 2)])
-            trace_y_even = np.array([trace[i][y_dim]
-                                    for i in range(1, max_id+1, 2)])
+            tube = BoxSet.from_tube(trace)
+            trace_x_odd, trace_x_even = tube.lo[:, x_dim], tube.hi[:, x_dim]
+            trace_y_odd, trace_y_even = tube.lo[:, y_dim], tube.hi[:, y_dim]
             fig.add_trace(go.Scatter(x=trace_x_odd.tolist()+trace_x_even[::-1].tolist()+[trace_x_odd[0]], y=trace_y_odd.tolist()+trace_y_even[::-1].tolist()+[trace_y_odd[0]], mode='markers+lines',
                                      fill='toself',
                                      fillcolor=fillcolor,
@@ -709,21 +709,9 @@ def reachtube_tree_single(root: Union[AnalysisTree, AnalysisTreeNode], agent_id,
                                      showlegend=show_legend
                                      ))
         elif combine_rect <= 1:
-            for idx in range(0, len(trace), 2):
-                trace_x = np.array([
-                    trace[idx][x_dim],
-                    trace[idx+1][x_dim],
-                    trace[idx+1][x_dim],
-                    trace[idx][x_dim],
-                    trace[idx][x_dim]
-                ])
-                trace_y = np.array([
-                    trace[idx][y_dim],
-                    trace[idx][y_dim],
-                    trace[idx+1][y_dim],
-                    trace[idx+1][y_dim],
-                    trace[idx][y_dim],
-                ])
+            for lo, hi in BoxSet.from_tube(trace).data:
+                trace_x = np.array([lo[x_dim], hi[x_dim], hi[x_dim], lo[x_dim], lo[x_dim]])
+                trace_y = np.array([lo[y_dim], lo[y_dim], hi[y_dim], hi[y_dim], lo[y_dim]])
                 fig.add_trace(go.Scatter(x=trace_x, y=trace_y, mode='markers+lines',
                                          fill='toself',
                                          fillcolor=fillcolor,
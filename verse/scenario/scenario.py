@@ -1,13 +1,15 @@
 from pprint import pp
-from typing import DefaultDict, NamedTuple, Optional, Tuple, List, Dict, Any
+from typing import DefaultDict, Iterator, NamedTuple, Optional, Tuple, List, Dict, Any
 import copy
 import itertools
+import os
 import warnings
 from collections import defaultdict, namedtuple
 import ast
 from dataclasses import dataclass
 import types
 import sys
+import time
 from enum import Enum
 
 import numpy as np
@@ -17,8 +19,10 @@ from verse.analysis.dryvr import _EPSILON
 from verse.analysis.incremental import CachedRTTrans, CachedSegment, combine_all, reach_trans_suit, sim_trans_suit
 from verse.analysis.simulator import PathDiffs
 from verse.automaton import GuardExpressionAst, ResetExpression
-from verse.analysis import Simulator, Verifier, AnalysisTreeNode, AnalysisTree
-from verse.analysis.utils import dedup, sample_rect
+from verse.automaton.reset import compile_reset, eval_reset_corners
+from verse.analysis import Simulator, Verifier, AnalysisTreeNode, AnalysisTree, SpillDirectory
+from verse.analysis.boxset import BoxSet
+from verse.analysis.utils import ForkPool, dedup, default_pool, sample_rect
 from verse.parser import astunparser
 from verse.parser.parser import ControllerIR, ModePath, find
 from verse.sensor.base_sensor import BaseSensor
@@ -58,6 +62,66 @@ def namedTupleToClass(inp: NamedTuple):
         setattr(res, field, getattr(inp, field))
     return res
 
+class ControllerAdapter:
+    """
+    The executed controller module of an agent, with lookup tables to build the arguments of
+    its decisionLogic from the sensed variables. Used by the simple simulator, which runs the
+    controller directly.
+    """
+    def __init__(self, agent: BaseAgent):
+        self.code = agent.decision_logic.controller_code
+        self.module = types.ModuleType('dl')
+        exec(self.code, self.module.__dict__)
+        self.args = agent.decision_logic.args
+        self.disc_fields = set()
+        self.enum_lookup = {}
+        for state_def in agent.decision_logic.state_defs.values():
+            for field, field_type in zip(state_def.disc, state_def.disc_type):
+                self.disc_fields.add(field)
+                if field not in self.enum_lookup:
+                    self.enum_lookup[field] = getattr(self.module, field_type).__members__
+        self.split_keys = {}
+
+    @staticmethod
+    def get(agent: BaseAgent) -> "ControllerAdapter":
+        adapter = agent.__dict__.get('_controller_adapter')
+        if adapter is None or adapter.code != agent.decision_logic.controller_code:
+            adapter = agent._controller_adapter = ControllerAdapter(agent)
+        return adapter
+
+    def state(self, values: Dict[str, Any]) -> types.SimpleNamespace:
+        res = types.SimpleNamespace()
+        for field, val in values.items():
+            lookup = self.enum_lookup.get(field)
+            res.__dict__[field] = val if lookup is None else lookup[val]
+        return res
+
+    def pack_args(self, cont, disc, track_map) -> Tuple[List[Any], Dict[str, Any]]:
+        """Same as pack_env, but returns the decisionLogic arguments and the values of ego"""
+        packed: DefaultDict[str, Dict[str, Any]] = defaultdict(dict)
+        split_keys = self.split_keys
+        for e in (cont, disc):
+            for k, v in e.items():
+                ks = split_keys.get(k)
+                if ks is None:
+                    ks = split_keys[k] = tuple(k.split("."))
+                packed[ks[0]][ks[1]] = v
+        arg_list = []
+        for arg in self.args:
+            if arg.name == EGO:
+                arg_list.append(self.state(packed[EGO]))
+            elif "map" in arg.name:
+                arg_list.append(track_map)
+            elif arg.name in packed:
+                other_keys, other_vals = tuple(map(list, zip(*packed[arg.name].items())))
+                others = [self.state(dict(zip(other_keys, vals))) for vals in zip(*other_vals)]
+                arg_list.append(others if arg.is_list else others[0])
+            elif arg.is_list:
+                arg_list.append([])
+            else:
+                raise ValueError(f"Expected one {arg.typ} for {arg.name}, got none")
+        return arg_list, packed[EGO]
+
 def red(s):
     return "\x1b[31m" + s + "\x1b[0m"
 
@@ -117,10 +181,9 @@ def check_sim_transitions(agent: BaseAgent, guards: List[Tuple], cont, disc, map
 
     all_resets = defaultdict(list)
     for path, disc_vars in guards:
-        env = pack_env(agent, ego_ty_name, cont, disc, map)    # TODO: diff disc -> disc_vars?
-
+        # TODO: diff disc -> disc_vars?
         # Collect all the hit guards for this agent at this time step
-        if eval(path.cond, env):
+        if eval(path.cond, packed_env):
             # If the guard can be satisfied, handle resets
             all_resets[path.var].append((path.val, path))
 
@@ -170,6 +233,16 @@ class ScenarioConfig:
     unsafe_continue: bool = False
     init_seg_length: int = 1000
     reachability_method: str = 'DRYVR'
+    subsume_nodes: bool = False
+    merge_ratio: float = 0.0
+    detect_fixed_point: bool = False
+    checkpoint_file: Optional[str] = None
+    checkpoint_interval: float = 600.0
+    memory_limit: Optional[int] = None
+    spill_dir: Optional[str] = None
+    branching_limit: Optional[int] = None
+    branching_policy: str = 'first'
+    branching_seed: Optional[int] = None
 
 class Scenario:
     def __init__(self, config=ScenarioConfig()):
@@ -183,6 +256,12 @@ class Scenario:
         self.map = LaneMap()
         self.sensor = BaseSensor()
         self.past_runs = []
+        # Approximate bytes held by the nodes of past_runs, see memory_usage
+        self.trace_nbytes = 0
+        self.node_nbytes = 0
+        self.num_cache_evictions = 0
+        # Runs at the start of past_runs whose traces were spilled to disk by the memory limit
+        self.num_spilled_runs = 0
 
         # Parameters
         self.config = config
@@ -297,7 +376,18 @@ class Scenario:
             res_list.append(trace)
         return res_list
 
-    def simulate(self, time_horizon, time_step, seed = None) -> AnalysisTree:
+    def simulate(self, time_horizon, time_step, seed = None, time_budget = None, node_budget = None, resume_from = None) -> AnalysisTree:
+        """Simulate the scenario. If the simulation runs for longer than time_budget seconds or computes
+        node_budget nodes, it stops after the current node and the partial tree is returned, with the
+        nodes that were not computed marked as frontier. Passing such a partial tree as resume_from
+        continues it from its frontier nodes; the tree is completed in place."""
+        self._run_budgeted(self.simulate_iter(time_horizon, time_step, seed, resume_from), time_budget, node_budget)
+        return self.past_runs[-1]
+
+    def simulate_iter(self, time_horizon, time_step, seed = None, resume_from = None) -> Iterator[AnalysisTreeNode]:
+        """Same as simulate, but yields each AnalysisTreeNode as soon as it is final. Breaking out
+        of the loop cancels the rest of the simulation; the partial tree is still recorded in
+        past_runs, with the nodes that were not computed marked as frontier."""
         self.check_init()
         init_list = []
         init_mode_list = []
@@ -311,9 +401,8 @@ class Scenario:
             uncertain_param_list.append(self.uncertain_param_dict[agent_id])
             agent_list.append(self.agent_dict[agent_id])
         print(init_list)
-        tree = self.simulator.simulate(init_list, init_mode_list, static_list, uncertain_param_list, agent_list, self, time_horizon, time_step, self.map, len(self.past_runs), self.past_runs)
-        self.past_runs.append(tree)
-        return tree
+        nodes = self.simulator.simulate_iter(init_list, init_mode_list, static_list, uncertain_param_list, agent_list, self, time_horizon, time_step, self.map, len(self.past_runs), self.past_runs, resume_from)
+        yield from self._record_run(nodes)
 
     def simulate_simple(self, time_horizon, time_step, seed = None) -> AnalysisTree:
         self.check_init()
@@ -330,10 +419,23 @@ class Scenario:
             agent_list.append(self.agent_dict[agent_id])
         print(init_list)
         tree = self.simulator.simulate_simple(init_list, init_mode_list, static_list, uncertain_param_list, agent_list, self, time_horizon, time_step, self.map, len(self.past_runs), self.past_runs)
+        for node in tree.nodes:
+            self._account_node(node)
         self.past_runs.append(tree)
         return tree
 
-    def verify(self, time_horizon, time_step, params={}) -> AnalysisTree:
+    def verify(self, time_horizon, time_step, params={}, resume_from=None, time_budget=None, node_budget=None) -> AnalysisTree:
+        """Compute the reachtubes of the scenario. resume_from is a checkpoint file written by an
+        interrupted verify of the same scenario (see ScenarioConfig.checkpoint_file) to continue from.
+        The budgets work as in simulate."""
+        self._run_budgeted(self.verify_iter(time_horizon, time_step, params, resume_from), time_budget, node_budget)
+        return self.past_runs[-1]
+
+    def verify_iter(self, time_horizon, time_step, params={}, resume_from=None) -> Iterator[AnalysisTreeNode]:
+        """Same as verify, but yields each AnalysisTreeNode as soon as its reachtube and transitions
+        are final, e.g. to stop at the first node with assert_hits. Breaking out of the loop cancels
+        the rest of the verification; the partial tree is still recorded in past_runs, with the
+        nodes that were not computed marked as frontier."""
         self.check_init()
         init_list = []
         init_mode_list = []
@@ -350,11 +452,136 @@ class Scenario:
             static_list.append(self.static_dict[agent_id])
             uncertain_param_list.append(self.uncertain_param_dict[agent_id])
             agent_list.append(self.agent_dict[agent_id])
-        tree = self.verifier.compute_full_reachtube(init_list, init_mode_list, static_list, uncertain_param_list, agent_list, self, time_horizon,
-                                                    time_step, self.map, self.config.init_seg_length, self.config.reachability_method, len(self.past_runs), self.past_runs, params)
+        nodes = self.verifier.compute_full_reachtube_iter(init_list, init_mode_list, static_list, uncertain_param_list, agent_list, self, time_horizon,
+                                                          time_step, self.map, self.config.init_seg_length, self.config.reachability_method, len(self.past_runs), self.past_runs, params,
+                                                          resume_from)
+        yield from self._record_run(nodes)
+
+    async def simulate_async(self, time_horizon, time_step, seed = None, pool: ForkPool = None) -> AnalysisTree:
+        """Awaitable simulate that runs in a worker process of pool (the shared default_pool() if
+        not given). Cancelling the awaiting task stops the run in its worker."""
+        return await self._run_async(pool, self._simulate_in_worker, time_horizon, time_step, seed)
+
+    async def verify_async(self, time_horizon, time_step, params={}, pool: ForkPool = None) -> AnalysisTree:
+        """Awaitable verify that runs in a worker process of pool (the shared default_pool() if
+        not given). Cancelling the awaiting task stops the run in its worker."""
+        return await self._run_async(pool, self._verify_in_worker, time_horizon, time_step, params)
+
+    def _simulate_in_worker(self, time_horizon, time_step, seed):
+        return self.simulate(time_horizon, time_step, seed).to_dict()
+
+    def _verify_in_worker(self, time_horizon, time_step, params):
+        return self.verify(time_horizon, time_step, params).to_dict()
+
+    async def _run_async(self, pool, func, *args) -> AnalysisTree:
+        # The worker gets a copy of the scenario, with its past runs and caches, and sends back the
+        # tree without its agents, which are attached again here. Caches filled in the worker are
+        # not carried back.
+        if pool is None:
+            pool = default_pool()
+        tree = AnalysisTree.from_dict(await pool.submit(func, *args))
+        for node in tree.nodes:
+            node.agent = {agent_id: self.agent_dict[agent_id] for agent_id in node.agent}
+            self._account_node(node)
         self.past_runs.append(tree)
         return tree
 
+    def memory_usage(self) -> Dict[str, int]:
+        """Approximate bytes held by the traces and the rest of the nodes of past_runs and by each
+        incremental cache. The counts are updated as nodes and cache entries are created, from the
+        shapes of the data, so this is cheap to call at any time. Traces spilled to disk (see
+        ScenarioConfig.spill_dir) are not counted. Spilling doesn't shrink the incremental caches,
+        which keep their own copies of the traces."""
+        return {
+            'traces': self.trace_nbytes,
+            'nodes': self.node_nbytes,
+            'sim_cache': self.simulator.cache.nbytes,
+            'tube_cache': self.verifier.cache.nbytes,
+            'trans_cache': self.verifier.trans_cache.nbytes,
+        }
+
+    def _account_node(self, node: AnalysisTreeNode):
+        self.trace_nbytes += node.trace_nbytes()
+        self.node_nbytes += node.meta_nbytes()
+
+    def _over_memory_limit(self) -> bool:
+        limit = self.config.memory_limit
+        return limit is not None and sum(self.memory_usage().values()) > limit
+
+    def _enforce_memory_limit(self):
+        # Soft limit: when it's exceeded, the traces of past_runs are spilled to disk as with
+        # config.spill_dir, and the incremental caches are dropped, largest first, while they alone
+        # take more than the limit. Only the caches are compared with it, as the rest of the nodes
+        # stays in memory and would otherwise have the caches dropped after every node.
+        for run_num in range(self.num_spilled_runs, len(self.past_runs)):
+            spill_dir = self._spill_dir(run_num)
+            for i, node in enumerate(self.past_runs[run_num].nodes):
+                self._spill_node(node, spill_dir, i)
+        self.num_spilled_runs = len(self.past_runs)
+        caches = [(self.simulator, 'cache'), (self.verifier, 'cache'), (self.verifier, 'trans_cache')]
+        for owner, name in sorted(caches, key=lambda c: -getattr(*c).nbytes):
+            if sum(getattr(*c).nbytes for c in caches) <= self.config.memory_limit:
+                break
+            setattr(owner, name, type(getattr(owner, name))())
+            self.num_cache_evictions += 1
+
+    @staticmethod
+    def _run_budgeted(nodes: Iterator[AnalysisTreeNode], time_budget: Optional[float], node_budget: Optional[int]):
+        start = time.time()
+        num_nodes = 0
+        for _ in nodes:
+            num_nodes += 1
+            if (node_budget is not None and num_nodes >= node_budget) or (time_budget is not None and time.time() - start >= time_budget):
+                nodes.close()
+                return
+
+    def _record_run(self, nodes: Iterator[AnalysisTreeNode]) -> Iterator[AnalysisTreeNode]:
+        # The incremental caches refer to runs by their index in past_runs, so the run is recorded
+        # even if the consumer stops early. Children that were never yielded are kept in it as
+        # frontier nodes.
+        # With config.spill_dir set, the traces of each node are written to disk once the consumer is
+        # done with it, so only the traces of the nodes being computed stay in memory.
+        # Once config.memory_limit is exceeded, this run is spilled the same way from then on.
+        done = {}
+        spill_dir = None
+        if self.config.spill_dir is not None:
+            spill_dir = self._spill_dir(len(self.past_runs))
+        try:
+            for node in nodes:
+                done[id(node)] = node
+                self._account_node(node)
+                if self._over_memory_limit():
+                    self._enforce_memory_limit()
+                    if spill_dir is None:
+                        spill_dir = self._spill_dir(len(self.past_runs))
+                        # The last node is spilled once the consumer is done with it
+                        for i, prev in enumerate(list(done.values())[:-1]):
+                            self._spill_node(prev, spill_dir, i)
+                yield node
+                if spill_dir is not None:
+                    self._spill_node(node, spill_dir, len(done) - 1)
+        finally:
+            nodes.close()
+            if done:
+                for node in done.values():
+                    for child in node.child:
+                        if id(child) not in done:
+                            child.frontier = True
+                self.past_runs.append(AnalysisTree(next(iter(done.values()))))
+
+    def _spill_dir(self, run_num: int) -> SpillDirectory:
+        # Each run gets a fresh directory, so that scenarios sharing spill_dir don't overwrite each
+        # other's traces. The spilled nodes keep it, so it is removed with the last of them. Without
+        # spill_dir, the memory limit spills to the system's temporary directory.
+        if self.config.spill_dir is not None:
+            os.makedirs(self.config.spill_dir, exist_ok=True)
+        return SpillDirectory(prefix=f"run{run_num}_", dir=self.config.spill_dir)
+
+    def _spill_node(self, node: AnalysisTreeNode, spill_dir: SpillDirectory, index: int):
+        self.trace_nbytes -= node.trace_nbytes()
+        node.spill(os.path.join(spill_dir.name, f"node{index}"), spill_dir)
+        self.trace_nbytes += node.trace_nbytes()
+
     def apply_reset(self, agent: BaseAgent, reset_list, all_agent_state) -> Tuple[str, np.ndarray]:
         track_map = self.map
         dest = []
@@ -365,7 +592,7 @@ class Scenario:
         dest = copy.deepcopy(agent_mode)
         possible_dest = [[elem] for elem in dest]
         ego_type = find(agent.decision_logic.args, lambda a: a.name == EGO).typ
-        rect = copy.deepcopy([agent_state[0][1:], agent_state[1][1:]])
+        rect = BoxSet(agent_state).data[0, :, 1:].tolist()
 
         # The reset_list here are all the resets for a single transition. Need to evaluate each of them
         # and then combine them together
@@ -412,6 +639,14 @@ class Scenario:
                 if not found:
                     raise ValueError(
                         f'Reset continuous variable {cts_variable} not found')
+                compiled = compile_reset(expr)
+                if compiled is not None and all(var in cont_var_dict and np.ndim(cont_var_dict[var]) == 1 for var in compiled[0]):
+                    symbols, func = compiled
+                    lb, ub = eval_reset_corners(func, [cont_var_dict[var] for var in symbols])
+                    rect[0][lhs_idx] = lb
+                    rect[1][lhs_idx] = ub
+                    continue
+
                 # substituting low variables
 
                 symbols = []
@@ -464,8 +699,21 @@ class Scenario:
     #         unrolled_variable, unrolled_variable_index = updater[variable]
     #         disc_var_dict[unrolled_variable] = disc_var_dict[variable][unrolled_variable_index]
 
+    def sensor_neighbors(self, node: AnalysisTreeNode) -> Optional[Dict[str, List[str]]]:
+        if not hasattr(self.sensor, 'neighbors'):
+            return None
+        return self.sensor.neighbors(node)
+
+    def sense(self, agent: BaseAgent, state_dict, neighbors=None):
+        """Sense the environment of agent, only including the agents it can sense according to neighbors"""
+        if neighbors is not None and agent.id in neighbors:
+            sensed = neighbors[agent.id]
+            state_dict = {aid: state for aid, state in state_dict.items() if aid == agent.id or aid in sensed}
+        return self.sensor.sense(self, agent, state_dict, self.map)
+
     def get_transition_simulate(self, cache: Dict[str, CachedSegment], paths: PathDiffs, node: AnalysisTreeNode) -> Tuple[Optional[Dict[str, List[str]]], Optional[Dict[str, List[Tuple[str, List[str], List[float]]]]], int]:
         track_map = self.map
+        neighbors = self.sensor_neighbors(node)
         trace_length = len(list(node.trace.values())[0])
 
         # For each agent
@@ -477,7 +725,7 @@ class Scenario:
         if not cache:
             paths = [(agent, p) for agent in node.agent.values() for p in agent.decision_logic.paths]
         else:
-            _transitions = [(aid, trans) for aid, seg in cache.items() for trans in seg.transitions if sim_trans_suit(trans.inits, node.init)]
+            _transitions = [(aid, trans) for aid, seg in cache.items() for trans in seg.transitions.suitable(node.init, sim_trans_suit)]
             # pp(("cached trans", _transitions))
             if len(_transitions) > 0:
                 min_trans_ind = min([t.transition for _, t in _transitions])
@@ -504,7 +752,7 @@ class Scenario:
                         continue
                     state_dict = {aid: (node.trace[aid][0], node.mode[aid], node.static[aid]) for aid in node.agent}
                     agent_paths = dedup([p for tran in segment.transitions for p in tran.paths], lambda i: (i.var, i.cond, i.val))
-                    cont_var_dict_template, discrete_variable_dict, len_dict = self.sensor.sense(self, agent, state_dict, self.map)
+                    cont_var_dict_template, discrete_variable_dict, len_dict = self.sense(agent, state_dict, neighbors)
                     for path in agent_paths:
                         cached_guards[agent_id].append((path, discrete_variable_dict, path_transitions[path.cond]))
 
@@ -515,7 +763,7 @@ class Scenario:
             agent_id = agent.id
             agent_mode = node.mode[agent_id]
             state_dict = {aid: (node.trace[aid][0], node.mode[aid], node.static[aid]) for aid in node.agent}
-            cont_var_dict_template, discrete_variable_dict, len_dict = self.sensor.sense(self, agent, state_dict, self.map)
+            cont_var_dict_template, discrete_variable_dict, len_dict = self.sense(agent, state_dict, neighbors)
             agent_guard_dict[agent_id].append((path, discrete_variable_dict))
 
         transitions = defaultdict(list)
@@ -530,7 +778,7 @@ class Scenario:
                 state_dict = {aid: (node.trace[aid][idx], node.mode[aid], node.static[aid]) for aid in node.agent}
                 agent_state, agent_mode, agent_static = state_dict[agent_id]
                 agent_state = agent_state[1:]
-                continuous_variable_dict, orig_disc_vars, _ = self.sensor.sense(self, agent, state_dict, self.map)
+                continuous_variable_dict, orig_disc_vars, _ = self.sense(agent, state_dict, neighbors)
                 unchecked_cache_guards = [g[:2] for g in cached_guards[agent_id] if g[2] < idx]     # FIXME: off by 1?
                 asserts, satisfied = check_sim_transitions(agent, agent_guard_dict[agent_id] + unchecked_cache_guards, continuous_variable_dict, orig_disc_vars, self.map, agent_state, agent_mode)
                 if asserts != None:
@@ -559,6 +807,7 @@ class Scenario:
 
     def get_transition_simulate_simple(self, node: AnalysisTreeNode) -> Tuple[Optional[Dict[str, List[str]]], Optional[Dict[str, List[Tuple[str, List[str], List[float]]]]], int]:
         track_map = self.map
+        neighbors = self.sensor_neighbors(node)
         trace_length = len(list(node.trace.values())[0])
 
         # For each agent
@@ -572,7 +821,7 @@ class Scenario:
                 continue
             agent_id = agent.id
             state_dict = {aid: (node.trace[aid][0], node.mode[aid], node.static[aid]) for aid in node.agent}
-            cont_var_dict_template, discrete_variable_dict, len_dict = self.sensor.sense(self, agent, state_dict, self.map)
+            cont_var_dict_template, discrete_variable_dict, len_dict = self.sense(agent, state_dict, neighbors)
             agent_guard_dict[agent_id].append((path, discrete_variable_dict))
 
         transitions = defaultdict(list)
@@ -582,48 +831,27 @@ class Scenario:
             satisfied_guard = []
             all_asserts = defaultdict(list)
             for agent_id in agent_guard_dict:
-                # Get agent controller 
+                # Get agent controller, executed once per agent
                 # Reference: https://stackoverflow.com/questions/55905240/python-dynamically-import-modules-code-from-string-with-importlib
                 agent: BaseAgent = self.agent_dict[agent_id]
-                dl = types.ModuleType('dl')
-                exec(agent.decision_logic.controller_code,dl.__dict__)
-                
+                adapter = ControllerAdapter.get(agent)
+
                 # Get the input arguments for the controller function
                 # Pack the environment (create ego and others list)
-                continuous_variable_dict, orig_disc_vars, _ = self.sensor.sense(self, agent, state_dict, self.map)
-                arg_list = []
-                env = pack_env(agent, EGO, continuous_variable_dict, orig_disc_vars, track_map)
-                for arg in agent.decision_logic.args:
-                    if arg.name == EGO:
-                        ego = namedTupleToClass(env[EGO])
-                        ego = convertStrToEnum(ego, agent, dl)
-                        arg_list.append(ego)
-                    elif arg.name == 'track_map':
-                        arg_list.append(track_map)
-                    else:
-                        if isinstance(env[arg.name], list):
-                            tmp_list = []
-                            for item in env[arg.name]:
-                                tmp = namedTupleToClass(item)
-                                tmp = convertStrToEnum(tmp, agent, dl)
-                                tmp_list.append(tmp)
-                            arg_list.append(tmp_list)
-                        else:
-                            tmp = namedTupleToClass(env[arg.name])
-                            tmp = convertStrToEnum(tmp, agent, dl)
-                            arg_list.append(tmp)
+                continuous_variable_dict, orig_disc_vars, _ = self.sense(agent, state_dict, neighbors)
+                arg_list, ego_vals = adapter.pack_args(continuous_variable_dict, orig_disc_vars, track_map)
 
                 try:
                     # Input the environment into the actual controller
-                    output = dl.decisionLogic(*arg_list)   
-                    output = convertEnumToStr(output, agent, dl)   
+                    output = adapter.module.decisionLogic(*arg_list)
+                    output = convertEnumToStr(output, agent, adapter.module)
                     # Check if output is the same as ego
-                    if not is_equivalent(env[EGO], output):
+                    if any(getattr(output, field) != val for field, val in ego_vals.items()):
                         # If not, a transition happen, get source and destination, break
                         next_init = []
                         pure_dest = []
-                        for field in env[EGO]._fields:
-                            if disc_field(field, agent):
+                        for field in ego_vals:
+                            if field in adapter.disc_fields:
                                 pure_dest.append(getattr(output, field))
                             else:
                                 next_init.append(getattr(output, field))  
@@ -649,6 +877,7 @@ class Scenario:
 
     def get_transition_verify(self, cache: Dict[str, CachedRTTrans], paths: PathDiffs, node: AnalysisTreeNode) -> Tuple[Optional[Dict[str, List[str]]], Optional[Dict[str, List[Tuple[str, List[str], List[float]]]]]]:
         track_map = self.map
+        neighbors = self.sensor_neighbors(node)
 
         # For each agent
         agent_guard_dict = defaultdict(list)
@@ -661,7 +890,7 @@ class Scenario:
         else:
 
             # _transitions = [trans.transition for seg in cache.values() for trans in seg.transitions]
-            _transitions = [(aid, trans) for aid, seg in cache.items() for trans in seg.transitions if reach_trans_suit(trans.inits, node.init)]
+            _transitions = [(aid, trans) for aid, seg in cache.items() for trans in seg.transitions.suitable(node.init, reach_trans_suit)]
             # pp(("cached trans", len(_transitions)))
             if len(_transitions) > 0:
                 min_trans_ind = min([t.transition for _, t in _transitions])
@@ -684,8 +913,7 @@ class Scenario:
 
                     agent_paths = dedup([p for tran in segment.transitions for p in tran.paths], lambda i: (i.var, i.cond, i.val))
                     for path in agent_paths:
-                        cont_var_dict_template, discrete_variable_dict, length_dict = self.sensor.sense(
-                            self, agent, state_dict, self.map)
+                        cont_var_dict_template, discrete_variable_dict, length_dict = self.sense(agent, state_dict, neighbors)
                         reset = (path.var, path.val_veri)
                         guard_expression = GuardExpressionAst([path.cond_veri])
 
@@ -702,13 +930,14 @@ class Scenario:
         # for aid, trace in node.trace.items():
         #     if len(trace) < 2:
         #         pp(("weird state", aid, trace))
+        # The rectangles of each agent, as (2, d) arrays with the time in the first column
+        tubes = {aid: BoxSet.from_tube(node.trace[aid]).data for aid in node.agent}
         for agent, path in paths:
             if len(agent.decision_logic.args) == 0:
                 continue
             agent_id = agent.id
-            state_dict = {aid: (node.trace[aid][0:2], node.mode[aid], node.static[aid]) for aid in node.agent}
-            cont_var_dict_template, discrete_variable_dict, length_dict = self.sensor.sense(
-                self, agent, state_dict, self.map)
+            state_dict = {aid: (tubes[aid][0], node.mode[aid], node.static[aid]) for aid in node.agent}
+            cont_var_dict_template, discrete_variable_dict, length_dict = self.sense(agent, state_dict, neighbors)
             # TODO-PARSER: Get equivalent for this function
             # Construct the guard expression
             guard_expression = GuardExpressionAst([path.cond_veri])
@@ -724,7 +953,7 @@ class Scenario:
             agent_guard_dict[agent_id].append(
                 (guard_expression, cont_var_updater, copy.deepcopy(discrete_variable_dict), path))
 
-        trace_length = int(min(len(v) for v in node.trace.values()) // 2)
+        trace_length = min(len(tube) for tube in tubes.values())
         # pp(("trace len", trace_length, {a: len(t) for a, t in node.trace.items()}))
         guard_hits = []
         guard_hit = False
@@ -733,7 +962,7 @@ class Scenario:
                 return None, cached_trans
             any_contained = False
             hits = []
-            state_dict = {aid: (node.trace[aid][idx*2:idx*2+2], node.mode[aid], node.static[aid]) for aid in node.agent}
+            state_dict = {aid: (tubes[aid][idx], node.mode[aid], node.static[aid]) for aid in node.agent}
 
             asserts = defaultdict(list)
             for agent_id in self.agent_dict.keys():
@@ -744,7 +973,7 @@ class Scenario:
                 # if np.array(agent_state).ndim != 2:
                 #     pp(("weird state", agent_id, agent_state))
                 agent_state = agent_state[1:]
-                cont_vars, disc_vars, len_dict = self.sensor.sense(self, agent, state_dict, self.map)
+                cont_vars, disc_vars, len_dict = self.sense(agent, state_dict, neighbors)
                 resets = defaultdict(list)
                 # Check safety conditions
                 for i, a in enumerate(agent.decision_logic.asserts_veri):
@@ -1,6 +1,10 @@
 
+from collections import defaultdict
+from typing import Dict, List, Optional, Tuple
 import numpy as np
+from scipy.spatial import cKDTree
 from verse.agents.base_agent import BaseAgent
+from verse.analysis.boxset import BoxSet
 
 
 def sets(d, thing, attrs, vals):
@@ -46,12 +50,260 @@ def add_states_3d(cont, disc, thing, val, cont_var, disc_var, stat_var):
     adds(disc, thing, disc_var, mode)
     adds(disc, thing, stat_var, static)
 
+
+def _find_arg(agent: BaseAgent, is_ego):
+    for arg in agent.decision_logic.args:
+        if is_ego and arg.name == 'ego':
+            return arg
+        if not is_ego and arg.name != 'ego' and 'map' not in arg.name:
+            return arg
+    return None
+
+
+class SensorLayout():
+    """
+    Fixed variable layout of what an ego agent senses from a given set of agents. It is
+    compiled once, then each call to fill builds the same cont/disc dicts as BaseSensor.sense
+    from the precomputed keys, taking the continuous values of all sensed agents at once.
+    """
+    def __init__(self, agent: BaseAgent, state_dict, reach: bool):
+        self.reach = reach
+        self.ego_id = None
+        self.other_ids = []
+        self.other_name = None
+        self.ego_first = True
+        ego_arg = _find_arg(agent, True)
+        other_arg = _find_arg(agent, False)
+        for agent_id in state_dict:
+            if agent_id == agent.id:
+                if ego_arg is None:
+                    if reach:
+                        raise ValueError(f"Invalid arg for ego")
+                    continue
+                self.ego_id = agent_id
+            else:
+                if other_arg is None:
+                    if reach:
+                        raise ValueError(f"Invalid arg for others")
+                    continue
+                if self.ego_id is None and not self.other_ids:
+                    self.ego_first = False
+                self.other_ids.append(agent_id)
+        if self.ego_id is not None:
+            self.ego_cont, self.ego_disc, self.ego_width = self._compile(agent, ego_arg, 'ego', [state_dict[self.ego_id][0]])
+        if self.other_ids:
+            self.other_name = other_arg.name
+            self.other_cont, self.other_disc, self.other_width = self._compile(agent, other_arg, other_arg.name, [state_dict[i][0] for i in self.other_ids])
+
+    def _compile(self, agent: BaseAgent, arg, thing, states):
+        state_def = agent.decision_logic.state_defs[arg.typ]
+        widths = set(len(state[0] if self.reach else state) - 1 for state in states)
+        if len(widths) > 1:
+            raise ValueError(f"Agents sensed as {thing} have states of different sizes")
+        width = min(len(state_def.cont), widths.pop())
+        cont_keys = [thing + "." + k for k in state_def.cont[:width]]
+        disc_keys = ([thing + "." + k for k in state_def.disc], [thing + "." + k for k in state_def.static])
+        return cont_keys, disc_keys, width
+
+    def fill(self, state_dict):
+        cont = {}
+        disc = {}
+        if self.ego_first:
+            self._fill_ego(cont, disc, state_dict)
+            self._fill_others(cont, disc, state_dict)
+        else:
+            self._fill_others(cont, disc, state_dict)
+            self._fill_ego(cont, disc, state_dict)
+        return cont, disc, {'others': len(state_dict)-1}
+
+    def _fill_ego(self, cont, disc, state_dict):
+        if self.ego_id is None:
+            return
+        state, mode, static = state_dict[self.ego_id]
+        end = self.ego_width + 1
+        if self.reach:
+            # Each variable gets a view of its [lower, upper] column
+            cont.update(zip(self.ego_cont, np.array([state[0][1:end], state[1][1:end]]).T))
+        else:
+            cont.update(zip(self.ego_cont, state[1:end]))
+        disc_keys, stat_keys = self.ego_disc
+        disc.update(zip(disc_keys, mode))
+        disc.update(zip(stat_keys, static))
+
+    def _fill_others(self, cont, disc, state_dict):
+        if not self.other_ids:
+            return
+        vals = [state_dict[agent_id] for agent_id in self.other_ids]
+        end = self.other_width + 1
+        if self.reach:
+            rects = np.array([[state[0][1:end], state[1][1:end]] for state, _, _ in vals])
+            cont.update(zip(self.other_cont, map(list, np.transpose(rects, (2, 0, 1)))))
+        else:
+            cont.update(zip(self.other_cont, map(list, zip(*[state[1:end] for state, _, _ in vals]))))
+        disc_keys, stat_keys = self.other_disc
+        disc.update(zip(disc_keys, map(list, zip(*[mode for _, mode, _ in vals]))))
+        disc.update(zip(stat_keys, map(list, zip(*[static for _, _, static in vals]))))
+
+
+def compile_sensor(agent: BaseAgent, state_dict) -> Optional[SensorLayout]:
+    """
+    Get the SensorLayout of agent for the agents in state_dict, compiling it on first use.
+    Returns None when the states can't be laid out, in which case sense_dicts should be used.
+    """
+    state = next(iter(state_dict.values()))[0]
+    reach = len(state) > 0 and isinstance(state[0], (list, tuple, np.ndarray))
+    # The layouts are kept with the decision logic they were compiled for, and dropped when it changes
+    cached = agent.__dict__.get('_sensor_layouts')
+    if cached is None or cached[0] is not agent.decision_logic:
+        cached = agent._sensor_layouts = (agent.decision_logic, {})
+    layouts = cached[1]
+    key = (reach, tuple((agent_id, len(val[0][0] if reach else val[0])) for agent_id, val in state_dict.items()))
+    if key not in layouts:
+        try:
+            layouts[key] = SensorLayout(agent, state_dict, reach)
+        except ValueError:
+            layouts[key] = None
+    return layouts[key]
+
+
+def _gap_dist(ego_lo, ego_hi, other_lo, other_hi):
+    # Distance between the closest points of the boxes, and between the farthest ones
+    gap = np.maximum(np.maximum(other_lo - ego_hi, ego_lo - other_hi), 0)
+    span = np.maximum(other_hi - ego_lo, ego_hi - other_lo)
+    return np.linalg.norm(gap, axis=-1), np.linalg.norm(span, axis=-1)
+
+
+def _close_pairs(ego_lo, ego_hi, other_lo, other_hi, radius):
+    """
+    The (ego, other, time step) triples of boxes that may be within radius, from a KD-tree on the box centers with
+    the time step as an extra coordinate, spaced so that boxes of different steps are never paired. Centers that
+    are more than radius plus the largest half diagonals apart hold boxes that are more than radius apart.
+    """
+    length, dims = ego_lo.shape[1:]
+    def points(lo, hi):
+        center = (lo + hi).reshape(-1, dims) / 2
+        half = np.linalg.norm(hi - lo, axis=-1).max(initial=0) / 2
+        return center, half
+    ego_center, ego_half = points(ego_lo, ego_hi)
+    other_center, other_half = points(other_lo, other_hi)
+    max_dist = radius + ego_half + other_half
+    step = np.tile(np.arange(length) * (2 * max_dist + 1), len(ego_lo))[:, None]
+    ego_tree = cKDTree(np.hstack([ego_center, step]))
+    other_tree = cKDTree(np.hstack([other_center, np.tile(step[:length], (len(other_lo), 1))]))
+    pairs = ego_tree.sparse_distance_matrix(other_tree, max_dist, output_type='ndarray')
+    return pairs['i'] // length, pairs['j'] // length, pairs['i'] % length
+
+
+def _sensed(ego_lo, ego_hi, other_lo, other_hi, radius, k_nearest, is_self):
+    # (ego, other) index pairs of the egos and the other agents they sense at some time step
+    length = ego_lo.shape[1]
+    num_others = other_lo.shape[0] - 1
+    if radius is None:
+        # Every agent may be among the nearest ones
+        ego, other = np.divmod(np.arange(len(ego_lo) * len(other_lo)), len(other_lo))
+        keep = ~is_self[ego, other]
+        ego, other = ego[keep], other[keep]
+        min_dist, max_dist = _gap_dist(ego_lo[ego], ego_hi[ego], other_lo[other], other_hi[other])
+        if k_nearest >= num_others:
+            return (ego, other) if length > 0 else (ego[:0], other[:0])
+        kth_dist = np.partition(max_dist.reshape(len(ego_lo), num_others, length), k_nearest - 1, axis=1)[:, k_nearest - 1]
+        sensed = (min_dist <= kth_dist[ego]).any(axis=1)
+        return ego[sensed], other[sensed]
+    ego, other, step = _close_pairs(ego_lo, ego_hi, other_lo, other_hi, radius)
+    keep = ~is_self[ego, other]
+    ego, other, step = ego[keep], other[keep], step[keep]
+    min_dist, max_dist = _gap_dist(ego_lo[ego, step], ego_hi[ego, step], other_lo[other, step], other_hi[other, step])
+    sensed = min_dist <= radius
+    if k_nearest is not None and k_nearest < num_others:
+        # The agents that aren't paired are farther than radius, so when the k nearest ones are within radius they
+        # are all paired. Otherwise the k-th distance is above radius and doesn't matter, take it as infinite.
+        key = ego * length + step
+        order = np.lexsort((max_dist, key))
+        keys, starts = np.unique(key[order], return_index=True)
+        rank = np.arange(len(order)) - np.repeat(starts, np.diff(np.append(starts, len(order))))
+        kth_dist = np.full(len(ego_lo) * length, np.inf)
+        kth = order[rank == k_nearest - 1]
+        kth_dist[key[kth]] = max_dist[kth]
+        sensed &= min_dist <= kth_dist[key]
+    return ego[sensed], other[sensed]
+
+
+def find_neighbors(node, radius=None, k_nearest=None, position=('x', 'y')) -> Dict[str, List[str]]:
+    """
+    For each agent in node, find the other agents that, at some time step of the node, may be within
+    radius of it and may be among its k_nearest closest agents. When both are given, an agent has to
+    pass both tests at the same time step. Distances are taken between the boxes of the position
+    variables, so for reachtubes the result over-approximates the neighbors of every trajectory in
+    the tubes. With a radius, only the boxes found close by a KD-tree are compared, otherwise every
+    pair is. Agents missing from the result sense everyone, which is also the case of an agent whose
+    controller takes a single other agent when it senses none.
+    """
+    reach = node.type == 'reachtube'
+    ids = list(node.trace)
+    boxes = {agent_id: BoxSet.from_trace(node.trace[agent_id], reach) for agent_id in ids}
+    length = min(len(box) for box in boxes.values())
+    # The egos are grouped by the state columns of the position of themselves and of the others
+    groups = defaultdict(list)
+    for agent_id in ids:
+        agent = node.agent[agent_id]
+        ego_arg = _find_arg(agent, True)
+        other_arg = _find_arg(agent, False)
+        if ego_arg is None or other_arg is None:
+            continue
+        ego_vars = agent.decision_logic.state_defs[ego_arg.typ].cont
+        other_vars = agent.decision_logic.state_defs[other_arg.typ].cont
+        pos = [v for v in position if v in ego_vars and v in other_vars]
+        if not pos or len(ids) < 2:
+            continue
+        ego_idx = tuple(ego_vars.index(v) + 1 for v in pos)
+        other_idx = tuple(other_vars.index(v) + 1 for v in pos)
+        groups[ego_idx, other_idx].append(agent_id)
+    res = {}
+    for (ego_idx, other_idx), egos in groups.items():
+        def stack(agent_ids, idx, bound):
+            return np.stack([boxes[i].data[:length, bound][:, list(idx)] for i in agent_ids])
+        is_self = np.array([[ego == agent_id for agent_id in ids] for ego in egos])
+        ego, other = _sensed(stack(egos, ego_idx, 0), stack(egos, ego_idx, 1), stack(ids, other_idx, 0),
+                             stack(ids, other_idx, 1), radius, k_nearest, is_self)
+        pairs = np.unique(np.stack([ego, other], axis=1), axis=0)
+        sensed = {agent_id: [] for agent_id in egos}
+        for e, o in pairs.tolist():
+            sensed[egos[e]].append(ids[o])
+        for agent_id, others in sensed.items():
+            if others or _find_arg(node.agent[agent_id], False).is_list:
+                res[agent_id] = others
+    return res
+
 # TODO-PARSER: Update base sensor
 
 
 class BaseSensor():
-    # The baseline sensor is omniscient. Each agent can get the state of all other agents
+    # The baseline sensor is omniscient. Each agent can get the state of all other agents,
+    # unless a sensing radius and/or a number of nearest agents to sense is given, in which
+    # case it senses the agents that are both within the radius and among the nearest ones
+    radius: Optional[float] = None
+    k_nearest: Optional[int] = None
+    position: Tuple[str, ...] = ('x', 'y')
+
+    def __init__(self, radius=None, k_nearest=None, position=('x', 'y')):
+        self.radius = radius
+        self.k_nearest = k_nearest
+        self.position = tuple(position)
+
+    def neighbors(self, node) -> Optional[Dict[str, List[str]]]:
+        """The other agents each agent can sense during node, None if it can sense all of them"""
+        if self.radius is None and self.k_nearest is None:
+            return None
+        return find_neighbors(node, self.radius, self.k_nearest, self.position)
+
     def sense(self, scenario, agent: BaseAgent, state_dict, lane_map):
+        layout = compile_sensor(agent, state_dict)
+        if layout is None:
+            return self.sense_dicts(scenario, agent, state_dict, lane_map)
+        return layout.fill(state_dict)
+
+    def sense_dicts(self, scenario, agent: BaseAgent, state_dict, lane_map):
+        """Uncompiled version of sense, rebuilding the environment from the controller args"""
         cont = {}
         disc = {}
         len_dict = {'others': len(state_dict)-1}